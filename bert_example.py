@@ -1,8 +1,11 @@
 
 #
 
+from cached_tokenization import CachedTokenizer
+
 import bert
 from datetime import datetime
+import numpy as np
 import pandas as pd
 import tensorflow as tf
 import tensorflow_hub as hub
@@ -77,8 +80,9 @@ def create_tokenizer_from_hub_module():
             vocab_file, do_lower_case = sess.run([tokenization_info['vocab_file'],
                                                   tokenization_info['do_lower_case']])
 
-    return bert.tokenization.FullTokenizer(
-        vocab_file=vocab_file, do_lower_case=do_lower_case)
+    # 같은 단어 / 문장을 반복해서 tokenize 하지 않도록 LRU 캐시를 씌운다.
+    return CachedTokenizer(bert.tokenization.FullTokenizer(
+        vocab_file=vocab_file, do_lower_case=do_lower_case))
 
 tokenizer = create_tokenizer_from_hub_module()
 
@@ -227,13 +231,67 @@ test_input_fn = run_classifier.input_fn_builder(
 
 estimator.evaluate(input_fn=test_input_fn, steps=None)
 
+PREDICT_BATCH_SIZE = 16
+EXPORT_DIR = os.path.join(OUTPUT_DIR, 'export')
+
+
+def serving_input_receiver_fn():
+    features = {
+        'input_ids': tf.placeholder(tf.int32, [None, MAX_SEQ_LENGTH], name='input_ids'),
+        'input_mask': tf.placeholder(tf.int32, [None, MAX_SEQ_LENGTH], name='input_mask'),
+        'segment_ids': tf.placeholder(tf.int32, [None, MAX_SEQ_LENGTH], name='segment_ids'),
+        'label_ids': tf.placeholder(tf.int32, [None], name='label_ids')}
+    return tf.estimator.export.ServingInputReceiver(features, features)
+
+
+def latest_export_dir(export_dir=EXPORT_DIR):
+    # export_saved_model은 timestamp 이름의 하위 폴더를 만든다.
+    versions = [d for d in os.listdir(export_dir) if d.isdigit()]
+    return os.path.join(export_dir, max(versions, key=int))
+
+
+class BertPredictor:
+    """Keeps the exported SavedModel loaded in one session and scores sentences in fixed-size batches."""
+    labels = ['Negative', 'Positive']
+
+    def __init__(self, export_dir, tokenizer, batch_size=PREDICT_BATCH_SIZE, max_seq_length=MAX_SEQ_LENGTH):
+        self.predict_fn = tf.contrib.predictor.from_saved_model(export_dir)
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_seq_length = max_seq_length
+
+    def _to_arrays(self, in_sentences):
+        input_examples = [run_classifier.InputExample(guid="", text_a=x, text_b=None, label=0) for x in in_sentences]
+        input_features = run_classifier.convert_examples_to_features(input_examples, label_list, self.max_seq_length, self.tokenizer)
+        return {'input_ids': np.array([f.input_ids for f in input_features], dtype=np.int32),
+                'input_mask': np.array([f.input_mask for f in input_features], dtype=np.int32),
+                'segment_ids': np.array([f.segment_ids for f in input_features], dtype=np.int32),
+                'label_ids': np.array([f.label_id for f in input_features], dtype=np.int32)}
+
+    def predict(self, in_sentences):
+        if len(in_sentences) == 0:
+            return []
+        arrays = self._to_arrays(in_sentences)
+
+        probabilities, labels = [], []
+        for start in range(0, len(in_sentences), self.batch_size):
+            batch = {k: v[start:(start + self.batch_size)] for k, v in arrays.items()}
+            n = len(batch['label_ids'])
+            # 항상 같은 batch 크기로 실행한다. (모자란 부분은 0으로 채우고 결과에서 버린다.)
+            batch = {k: np.pad(v, [(0, self.batch_size - n)] + [(0, 0)] * (v.ndim - 1)) for k, v in batch.items()}
+            outputs = self.predict_fn(batch)
+            probabilities.extend(outputs['probabilities'][:n])
+            labels.extend(outputs['labels'][:n])
+
+        return [(sentence, prob, self.labels[label]) for sentence, prob, label in zip(in_sentences, probabilities, labels)]
+
+
+estimator.export_saved_model(EXPORT_DIR, serving_input_receiver_fn)
+predictor = BertPredictor(latest_export_dir(), tokenizer)
+
+
 def get_prediction(in_sentences):
-    labels=['Negative', 'Positive']
-    input_examples = [run_classifier.InputExample(guid="", text_a=x, text_b=None, label=0) for x in in_sentences]
-    input_features = run_classifier.convert_examples_to_features(input_examples, label_list, MAX_SEQ_LENGTH, tokenizer)
-    predict_input_fn = run_classifier.input_fn_builder(features=input_features, seq_length=MAX_SEQ_LENGTH, is_training=False, drop_remainder=False)
-    predictions = estimator.predict(predict_input_fn)
-    return [(sentence, prediction['probabilities'], labels[prediction['labels']]) for sentence, prediction in zip(in_sentences, predictions)]
+    return predictor.predict(in_sentences)
 
 pred_sentences = [
     "That movie was absolutely awful",
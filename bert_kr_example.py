@@ -1,6 +1,8 @@
 
 #
-from run_squad import Config, validate_flags_or_throw, read_squad_examples, FeatureWriter, convert_examples_to_features, input_fn_builder, RawResult, write_predictions, model_fn_builder
+from run_squad import Config, validate_flags_or_throw, read_squad_examples, FeatureWriter, convert_examples_to_features, RawResult, write_predictions, model_fn_builder
+
+from cached_tokenization import CachedTokenizer, tokenizer_fingerprint
 
 import bert
 from datetime import datetime
@@ -13,6 +15,7 @@ import sys
 import re
 import random
 import json
+import multiprocessing
 import pandas as pd
 import tensorflow as tf
 import tensorflow_hub as hub
@@ -26,6 +29,144 @@ from tensorflow import keras
 
 FLAGS = Config()
 
+# feature 변환은 example을 NUM_FEATURE_SHARDS 개로 나눠서 process pool에서 진행하고
+# shard 마다 TFRecord 파일을 하나씩 쓴다.
+NUM_FEATURE_SHARDS = 8
+NUM_CONVERT_WORKERS = None  # None 이면 cpu 개수
+# unique_id = UNIQUE_ID_BASE + example_index * MAX_SPANS_PER_EXAMPLE + doc_span_index
+# shard 나누는 방법과 상관없이 같은 feature는 항상 같은 id를 가진다.
+UNIQUE_ID_BASE = 1000000000
+MAX_SPANS_PER_EXAMPLE = 1000
+# 같은 context를 공유하는 질문들이 많아서 단어 단위 WordPiece 결과를 캐시한다.
+TOKEN_CACHE_PATH = os.path.join(FLAGS.output_dir, "wordpiece_cache.pkl")
+
+_shard_tokenizer = None
+
+
+def squad_unique_id(example_index, doc_span_index):
+    assert doc_span_index < MAX_SPANS_PER_EXAMPLE, "too many doc spans: {}".format(doc_span_index)
+    return UNIQUE_ID_BASE + example_index * MAX_SPANS_PER_EXAMPLE + doc_span_index
+
+
+def shard_filenames(output_prefix, num_shards):
+    return ["{}-{:05d}-of-{:05d}".format(output_prefix, i, num_shards) for i in range(num_shards)]
+
+
+def _init_shard_worker(vocab_file, do_lower_case, cache_path, fingerprint):
+    # worker 마다 tokenizer를 하나씩 만든다.
+    global _shard_tokenizer
+    _shard_tokenizer = CachedTokenizer(
+        tokenization.FullTokenizer(vocab_file=vocab_file, do_lower_case=do_lower_case),
+        cache_path=cache_path, fingerprint=fingerprint)
+
+
+def _convert_shard(args):
+    (examples, example_offset, filename, is_training, keep_features,
+     max_seq_length, doc_stride, max_query_length) = args
+
+    writer = FeatureWriter(filename=filename, is_training=is_training)
+    features = []
+
+    def output_fn(feature):
+        # convert_examples_to_features는 shard 안에서 index / id를 새로 매기므로 전체 기준으로 바꿔준다.
+        feature.example_index += example_offset
+        feature.unique_id = squad_unique_id(feature.example_index, feature.doc_span_index)
+        writer.process_feature(feature)
+        if keep_features:
+            features.append(feature)
+
+    convert_examples_to_features(
+        examples=examples,
+        tokenizer=_shard_tokenizer,
+        max_seq_length=max_seq_length,
+        doc_stride=doc_stride,
+        max_query_length=max_query_length,
+        is_training=is_training,
+        output_fn=output_fn)
+    writer.close()
+
+    # 새로 tokenize 한 결과는 부모 process에서 디스크 캐시에 합친다.
+    new_entries = _shard_tokenizer.new_entries
+    _shard_tokenizer.new_entries = dict()
+    return writer.num_features, features, new_entries
+
+
+def convert_examples_to_sharded_features(examples, output_prefix, is_training, keep_features=False,
+                                         num_shards=NUM_FEATURE_SHARDS, num_workers=NUM_CONVERT_WORKERS):
+    """Convert examples in a process pool and write one TFRecord shard per chunk of examples.
+
+    Shards hold contiguous chunks of ``examples`` so the output only depends on
+    the example order. Returns (shard filenames, number of features, features);
+    features are only collected when ``keep_features`` (needed by write_predictions).
+    """
+    filenames = shard_filenames(output_prefix, num_shards)
+    bounds = np.linspace(0, len(examples), num_shards + 1).astype(int)
+    tasks = [(examples[bounds[i]:bounds[i + 1]], int(bounds[i]), filenames[i], is_training, keep_features,
+              FLAGS.max_seq_length, FLAGS.doc_stride, FLAGS.max_query_length) for i in range(num_shards)]
+
+    num_workers = min(num_workers or multiprocessing.cpu_count(), num_shards)
+    fingerprint = tokenizer_fingerprint(FLAGS.vocab_file, FLAGS.do_lower_case)
+    ctx = multiprocessing.get_context('spawn')
+    with ctx.Pool(num_workers, initializer=_init_shard_worker,
+                  initargs=(FLAGS.vocab_file, FLAGS.do_lower_case, TOKEN_CACHE_PATH, fingerprint)) as pool:
+        results = pool.map(_convert_shard, tasks, chunksize=1)
+
+    new_entries = dict()
+    for _, _, entries in results:
+        new_entries.update(entries)
+    if new_entries:
+        cache = CachedTokenizer(None, cache_path=TOKEN_CACHE_PATH, fingerprint=fingerprint)
+        cache.save_cache(new_entries)
+
+    num_features = sum(n for n, _, _ in results)
+    features = [f for _, shard_features, _ in results for f in shard_features]
+    return filenames, num_features, features
+
+
+def sharded_input_fn_builder(input_files, seq_length, is_training, drop_remainder, cycle_length=None):
+    """input_fn_builder for TFRecord shards, read with parallel interleave."""
+    name_to_features = {
+        "unique_ids": tf.FixedLenFeature([], tf.int64),
+        "input_ids": tf.FixedLenFeature([seq_length], tf.int64),
+        "input_mask": tf.FixedLenFeature([seq_length], tf.int64),
+        "segment_ids": tf.FixedLenFeature([seq_length], tf.int64),
+    }
+    if is_training:
+        name_to_features["start_positions"] = tf.FixedLenFeature([], tf.int64)
+        name_to_features["end_positions"] = tf.FixedLenFeature([], tf.int64)
+
+    def _decode_record(record):
+        example = tf.parse_single_example(record, name_to_features)
+        # tf.Example은 int64만 지원하므로 TPU 를 위해 int32로 바꾼다.
+        for name in list(example.keys()):
+            t = example[name]
+            if t.dtype == tf.int64:
+                t = tf.to_int32(t)
+            example[name] = t
+        return example
+
+    def input_fn(params):
+        batch_size = params["batch_size"]
+
+        d = tf.data.Dataset.from_tensor_slices(tf.constant(input_files))
+        if is_training:
+            d = d.shuffle(buffer_size=len(input_files))
+            d = d.repeat()
+        d = d.apply(tf.data.experimental.parallel_interleave(
+            tf.data.TFRecordDataset,
+            cycle_length=cycle_length or len(input_files),
+            sloppy=is_training))
+        if is_training:
+            d = d.shuffle(buffer_size=100)
+
+        d = d.apply(tf.data.experimental.map_and_batch(
+            _decode_record,
+            batch_size=batch_size,
+            drop_remainder=drop_remainder))
+        return d.prefetch(1)
+
+    return input_fn
+
 
 def main():
     tf.logging.set_verbosity(tf.logging.INFO)
@@ -89,30 +230,22 @@ def main():
         predict_batch_size=FLAGS.predict_batch_size)
 
     if FLAGS.do_train:
-        # We write to a temporary file to avoid storing very large constant tensors
+        # We write to temporary files to avoid storing very large constant tensors
         # in memory.
-        train_writer = FeatureWriter(
-            filename=os.path.join(FLAGS.output_dir, "train.tf_record"),
-            is_training=True)
-        convert_examples_to_features(
+        train_files, num_train_features, _ = convert_examples_to_sharded_features(
             examples=train_examples,
-            tokenizer=tokenizer,
-            max_seq_length=FLAGS.max_seq_length,
-            doc_stride=FLAGS.doc_stride,
-            max_query_length=FLAGS.max_query_length,
-            is_training=True,
-            output_fn=train_writer.process_feature)
-        train_writer.close()
+            output_prefix=os.path.join(FLAGS.output_dir, "train.tf_record"),
+            is_training=True)
 
         tf.logging.info("***** Running training *****")
         tf.logging.info("  Num orig examples = %d", len(train_examples))
-        tf.logging.info("  Num split examples = %d", train_writer.num_features)
+        tf.logging.info("  Num split examples = %d", num_train_features)
         tf.logging.info("  Batch size = %d", FLAGS.train_batch_size)
         tf.logging.info("  Num steps = %d", num_train_steps)
         del train_examples
 
-        train_input_fn = input_fn_builder(
-            input_file=train_writer.filename,
+        train_input_fn = sharded_input_fn_builder(
+            input_files=train_files,
             seq_length=FLAGS.max_seq_length,
             is_training=True,
             drop_remainder=True)
@@ -122,24 +255,12 @@ def main():
         eval_examples = read_squad_examples(
             input_file=FLAGS.predict_file, is_training=False)
 
-        eval_writer = FeatureWriter(
-            filename=os.path.join(FLAGS.output_dir, "eval.tf_record"),
-            is_training=False)
-        eval_features = []
-
-        def append_feature(feature):
-            eval_features.append(feature)
-            eval_writer.process_feature(feature)
-
-        convert_examples_to_features(
+        # 예측 결과는 unique_id로 feature와 다시 연결되므로 shard를 섞어 읽어도 된다.
+        eval_files, _, eval_features = convert_examples_to_sharded_features(
             examples=eval_examples,
-            tokenizer=tokenizer,
-            max_seq_length=FLAGS.max_seq_length,
-            doc_stride=FLAGS.doc_stride,
-            max_query_length=FLAGS.max_query_length,
+            output_prefix=os.path.join(FLAGS.output_dir, "eval.tf_record"),
             is_training=False,
-            output_fn=append_feature)
-        eval_writer.close()
+            keep_features=True)
 
         tf.logging.info("***** Running predictions *****")
         tf.logging.info("  Num orig examples = %d", len(eval_examples))
@@ -148,8 +269,8 @@ def main():
 
         all_results = []
 
-        predict_input_fn = input_fn_builder(
-            input_file=eval_writer.filename,
+        predict_input_fn = sharded_input_fn_builder(
+            input_files=eval_files,
             seq_length=FLAGS.max_seq_length,
             is_training=False,
             drop_remainder=False)
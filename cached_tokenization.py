@@ -0,0 +1,82 @@
+
+import collections
+import hashlib
+import os
+import pickle
+import threading
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def tokenizer_fingerprint(vocab_file, do_lower_case):
+    # 같은 text 라도 vocab / 대소문자 설정이 다르면 결과가 다르므로 디스크 캐시는 이 값이 같을 때만 쓴다.
+    h = hashlib.sha1()
+    with open(vocab_file, 'rb') as f:
+        h.update(f.read())
+    h.update(str(bool(do_lower_case)).encode('utf-8'))
+    return h.hexdigest()
+
+
+class CachedTokenizer:
+    """Memoizing wrapper around a BERT ``FullTokenizer``.
+
+    ``tokenize`` results are kept in a bounded LRU keyed by the text. With
+    ``cache_path`` the results are also looked up in (and can be saved to) an
+    on-disk dict keyed by the sha1 of the text. The file records
+    ``fingerprint`` (``tokenizer_fingerprint``) and a file written with another
+    fingerprint is ignored (and replaced on ``save_cache``). Every other attribute
+    (``vocab``, ``convert_tokens_to_ids``, ...) is forwarded to the wrapped tokenizer.
+    """
+    def __init__(self, tokenizer, max_size=100000, cache_path=None, fingerprint=None):
+        self.tokenizer = tokenizer
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.fingerprint = fingerprint
+        self._lru = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self._disk = dict()
+        # 이번 실행에서 새로 계산한 값 (save_cache 시 디스크 캐시에 합쳐진다.)
+        self.new_entries = dict()
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                saved = pickle.load(f)
+            # fingerprint 가 없는(이전 형식) 파일이나 다른 tokenizer 설정의 파일은 사용하지 않는다.
+            if isinstance(saved, dict) and saved.get('fingerprint') == fingerprint and 'entries' in saved:
+                self._disk = saved['entries']
+
+    def __getattr__(self, name):
+        return getattr(self.tokenizer, name)
+
+    def tokenize(self, text):
+        with self._lock:
+            tokens = self._lru.get(text)
+            if tokens is not None:
+                self._lru.move_to_end(text)
+                return list(tokens)
+
+        key = text_key(text) if self.cache_path is not None else None
+        tokens = self._disk.get(key) if key is not None else None
+        if tokens is None:
+            tokens = tuple(self.tokenizer.tokenize(text))
+            if key is not None:
+                self.new_entries[key] = tokens
+
+        with self._lock:
+            self._lru[text] = tokens
+            if len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+        return list(tokens)
+
+    def save_cache(self, entries=None):
+        # 디스크 캐시에 새로 계산된 값을 합쳐서 저장한다. (tmp 파일 후 교체)
+        if self.cache_path is None:
+            return
+        self._disk.update(self.new_entries if entries is None else entries)
+        self.new_entries = dict()
+        tmp_path = '{}.tmp{}'.format(self.cache_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'fingerprint': self.fingerprint, 'entries': self._disk}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.cache_path)
@@ -18,3 +18,17 @@ class Config:
         self.f_name = 'nlp_model_v1.0'
         self.tokenize_as_morph = False
         self.xavier_initializer = True
+        self.serve_host = '127.0.0.1'
+        self.serve_port = 8000
+        self.serve_batch_size = 32
+        self.serve_max_wait = 0.01
+        self.beam_size = 4
+        self.length_penalty_alpha = 0.6
+        self.use_xla = False            # train/predict step XLA compile
+        # 길이별 batch 구성. None 이면 max_sequence_length로 padding 한다.
+        self.bucket_boundaries = [6, 11, 16, 21, self.max_sequence_length + 1]
+        # quantize.py 로 만든 TFLite 모델 설정
+        self.quantize_mode = 'int8'
+        self.quantize_calibration_steps = 10
+        self.quantize_atol = 0.05
+        self.serve_quantized = False
@@ -5,6 +5,10 @@ import tensorflow as tf
 import tqdm
 import os
 import re
+import pickle
+import hashlib
+import atexit
+import multiprocessing
 from sklearn.model_selection import train_test_split
 import numpy as np
 
@@ -23,6 +27,20 @@ UNK_INDEX = 3
 MARKER = [PAD, STD, END, UNK]
 CHANGE_FILTER = re.compile(FILTERS)
 
+# 형태소 분석 결과를 저장해 두는 캐시 파일
+MORPH_CACHE_PATH = './data/morph_cache.pkl'
+# 캐시에 없는 문장이 이보다 적으면 프로세스 풀을 띄우지 않는다.
+MORPH_PARALLEL_MIN = 1000
+# 저장하지 않은 새 문장이 이만큼 쌓이면 캐시 파일을 다시 쓴다. (나머지는 종료시 저장)
+MORPH_SAVE_EVERY = 1000
+
+# 프로세스(워커)마다 하나씩만 만드는 형태소 분석기
+_morph_analyzer = None
+# 캐시 파일 경로별로 한번만 읽어 둔 캐시
+_morph_caches = dict()
+# 캐시 파일 경로별 아직 저장하지 않은 문장 수
+_morph_unsaved = dict()
+
 
 def load_data(data_path):
     # 판다스를 통해서 데이터를 불러온다.
@@ -37,24 +55,97 @@ def load_data(data_path):
     return train_input, train_label, eval_input, eval_label
 
 
-def prepro_like_morphlized(data):
-    # 형태소 분석 모듈 객체를
-    # 생성합니다.
+def _init_morph_analyzer():
+    # 형태소 분석 모듈 객체는 프로세스마다
+    # 한번만 생성합니다.
+    global _morph_analyzer
+    if _morph_analyzer is None:
+        _morph_analyzer = Twitter()
+
+
+def _morphlize(seq):
+    # Twitter.morphs 함수를 통해 토크나이즈 된
+    # 리스트 객체를 받고 다시 공백문자를 기준으로
+    # 하여 문자열로 재구성 해줍니다.
+    return " ".join(_morph_analyzer.morphs(seq))
+
+
+def _morph_key(seq):
+    # 문장 내용으로 캐시 키를 만듭니다.
+    return hashlib.sha1(seq.encode('utf-8')).hexdigest()
+
+
+def load_morph_cache(cache_path=MORPH_CACHE_PATH):
+    if cache_path not in _morph_caches:
+        cache = dict()
+        if cache_path is not None and os.path.exists(cache_path):
+            with open(cache_path, 'rb') as f:
+                cache = pickle.load(f)
+        _morph_caches[cache_path] = cache
+    return _morph_caches[cache_path]
+
 
-    morph_analyzer = Twitter()
-    # 형태소 토크나이즈 결과 문장을 받을
-    #  리스트를 생성합니다.
-    result_data = list()
-    # 데이터에 있는 매 문장에 대해 토크나이즈를
-    # 할 수 있도록 반복문을 선언합니다.
-    for seq in tqdm(data):
-        # Twitter.morphs 함수를 통해 토크나이즈 된
-        # 리스트 객체를 받고 다시 공백문자를 기준으로
-        # 하여 문자열로 재구성 해줍니다.
-        morphlized_seq = " ".join(morph_analyzer.morphs(seq.replace(' ', '')))
-        result_data.append(morphlized_seq)
+def save_morph_cache(cache, cache_path=MORPH_CACHE_PATH):
+    # 다른 프로세스가 반쯤 쓰인 파일을 읽지 않도록
+    # 임시 파일에 쓴 후 이름을 바꿉니다.
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, cache_path)
 
-    return result_data
+
+def flush_morph_caches():
+    # 아직 저장하지 않은 캐시를 모두 파일에 씁니다.
+    for cache_path, n_unsaved in list(_morph_unsaved.items()):
+        if n_unsaved > 0:
+            save_morph_cache(_morph_caches[cache_path], cache_path)
+            _morph_unsaved[cache_path] = 0
+
+
+atexit.register(flush_morph_caches)
+
+
+def prepro_like_morphlized(data, cache_path=MORPH_CACHE_PATH, num_workers=None):
+    # 형태소 분석 결과는 공백을 제거한 문장 기준으로
+    # 캐시에 저장되어 있습니다.
+    cache = load_morph_cache(cache_path)
+    seqs = [seq.replace(' ', '') for seq in data]
+    keys = [_morph_key(seq) for seq in seqs]
+
+    # 캐시에 없는 문장만 (중복 없이) 모읍니다.
+    missed = dict()
+    for key, seq in zip(keys, seqs):
+        if key not in cache:
+            missed[key] = seq
+
+    if len(missed) > 0:
+        missed_keys = list(missed.keys())
+        missed_seqs = [missed[key] for key in missed_keys]
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+
+        if num_workers > 1 and len(missed_seqs) >= MORPH_PARALLEL_MIN:
+            # konlpy는 JVM을 사용하므로 fork 대신 spawn으로
+            # 워커를 띄우고 워커마다 분석기를 하나씩 둡니다.
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(num_workers, initializer=_init_morph_analyzer) as pool:
+                morphlized = list(tqdm.tqdm(pool.imap(_morphlize, missed_seqs, chunksize=256),
+                                            total=len(missed_seqs)))
+        else:
+            _init_morph_analyzer()
+            morphlized = [_morphlize(seq) for seq in tqdm.tqdm(missed_seqs)]
+
+        cache.update(zip(missed_keys, morphlized))
+        if cache_path is not None:
+            # serve / predict 처럼 몇 문장씩 들어오는 경우 매번 전체 캐시를 다시 쓰지 않도록
+            # MORPH_SAVE_EVERY 문장마다 (그리고 종료시) 저장합니다.
+            _morph_unsaved[cache_path] = _morph_unsaved.get(cache_path, 0) + len(missed_keys)
+            if _morph_unsaved[cache_path] >= MORPH_SAVE_EVERY:
+                save_morph_cache(cache, cache_path)
+                _morph_unsaved[cache_path] = 0
+
+    # 형태소 토크나이즈 결과 문장 리스트를 돌려줍니다.
+    return [cache[key] for key in keys]
 
 
 # 인덱스화 할 value와 키가 워드이고
@@ -190,25 +281,109 @@ def dec_target_processing(value, dictionary, max_sequence_length, tokenize_as_mo
     return np.asarray(sequences_target_index)
 
 
+def sequences_to_index(value, dictionary, tokenize_as_morph=False):
+    # 형태소 토크나이징 사용 유무
+    if tokenize_as_morph:
+        value = prepro_like_morphlized(value)
+    # 필터 치환과 공백 분리는 문장마다 한번만 한다.
+    words_list = [CHANGE_FILTER.sub("", sequence).split() for sequence in value]
+    # 문장별 단어 개수
+    lengths = np.fromiter((len(words) for words in words_list), dtype=np.int32, count=len(words_list))
+    # 모든 문장의 단어 인덱스를 하나의 배열로 이어 붙인다.
+    # 딕셔너리에 없는 단어는 UNK로 넣어 준다.
+    unk_index = dictionary[UNK]
+    flat_index = np.fromiter((dictionary.get(word, unk_index) for words in words_list for word in words),
+                             dtype=np.int32, count=int(np.sum(lengths)))
+    return flat_index, lengths
+
+
+def _scatter_padded(flat_index, lengths, max_sequence_length, pad_index, offset=0):
+    # (N, max_sequence_length) 크기의 배열을 PAD로 미리 채워 둔다.
+    padded = np.full([len(lengths), max_sequence_length], pad_index, dtype=np.int32)
+    # 각 단어가 들어갈 (행, 열) 위치를 한번에 계산한다.
+    rows = np.repeat(np.arange(len(lengths), dtype=np.int32), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    cols = np.arange(len(flat_index), dtype=np.int32) - starts + offset
+    # 문장 제한 길이를 넘는 토큰은 버린다.
+    keep = cols < max_sequence_length
+    padded[rows[keep], cols[keep]] = flat_index[keep]
+    return padded
+
+
+# enc_processing, dec_output_processing, dec_target_processing 세가지를
+# 한번의 토크나이징으로 만들어 주는 함수이다.
+def enc_dec_processing(input_value, label_value, dictionary, max_sequence_length, tokenize_as_morph=False):
+    pad_index = dictionary[PAD]
+    # 질문과 답변은 각각 한번씩만 토크나이즈 한다.
+    input_index, input_lengths = sequences_to_index(input_value, dictionary, tokenize_as_morph)
+    label_index, label_lengths = sequences_to_index(label_value, dictionary, tokenize_as_morph)
+
+    # 인코딩 입력
+    input_enc = _scatter_padded(input_index, input_lengths, max_sequence_length, pad_index)
+    input_enc_length = np.minimum(input_lengths, max_sequence_length)
+
+    # 디코딩 입력은 처음에 START가 오므로 한칸 밀어서 넣는다.
+    output_dec = _scatter_padded(label_index, label_lengths, max_sequence_length, pad_index, offset=1)
+    output_dec[:, 0] = dictionary[STD]
+    output_dec_length = np.minimum(label_lengths + 1, max_sequence_length)
+
+    # 디코딩 출력은 마지막에 END를 넣는다.
+    # 문장이 길면 마지막 칸을 END로 덮어 쓴다.
+    target_dec = _scatter_padded(label_index, label_lengths, max_sequence_length, pad_index)
+    target_dec[np.arange(len(label_lengths)), np.minimum(label_lengths, max_sequence_length - 1)] = dictionary[END]
+
+    return input_enc, input_enc_length, output_dec, output_dec_length, target_dec
+
+
 def rearrange(input, output, target):
     features = {"input": input, "output": output}
     return features, target
 
 
+def trim_padding(input, output, target):
+    # 한 문장에서 뒤쪽 PAD를 잘라낸다. (bucket 별로 다시 padding 된다.)
+    input_length = tf.reduce_sum(tf.cast(tf.not_equal(input, PAD_INDEX), tf.int32))
+    dec_length = tf.maximum(tf.reduce_sum(tf.cast(tf.not_equal(output, PAD_INDEX), tf.int32)),
+                            tf.reduce_sum(tf.cast(tf.not_equal(target, PAD_INDEX), tf.int32)))
+    return input[:input_length], output[:dec_length], target[:dec_length]
+
+
+def sequence_bucket_length(input, output, target):
+    return tf.maximum(tf.shape(input)[0], tf.shape(output)[0])
+
+
 # 학습에 들어가 배치 데이터를 만드는 함수이다.
-def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_size, mode='train'):
+# bucket_boundaries를 주면 길이가 비슷한 문장끼리 묶고
+# bucket 경계 길이까지만 padding 한다. (예: [6, 11, 16, 21, 26])
+# 마지막 경계는 max_sequence_length + 1 이상이어야 한다.
+def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_size, mode='train',
+                    bucket_boundaries=None, shuffle_buffer_size=None):
     # Dataset을 생성하는 부분으로써 from_tensor_slices부분은
     # 각각 한 문장으로 자른다고 보면 된다.
     # train_input_enc, train_output_dec, train_target_dec
     # 3개를 각각 한문장으로 나눈다.
     dataset = tf.data.Dataset.from_tensor_slices((train_input_enc, train_output_dec, train_target_dec))
-    # 전체 데이터를 썩는다.
-    dataset = dataset.shuffle(buffer_size=len(train_input_enc))
+    # 데이터를 썩는다. buffer 크기를 주면 그 크기 만큼만 메모리에 올린다.
+    if shuffle_buffer_size is None:
+        shuffle_buffer_size = len(train_input_enc)
+    dataset = dataset.shuffle(buffer_size=min(shuffle_buffer_size, len(train_input_enc)))
     # 배치 인자 값이 없다면  에러를 발생 시킨다.
     assert batch_size is not None, "train batchSize must not be None"
     # from_tensor_slices를 통해 나눈것을
     # 배치크기 만큼 묶어 준다.
-    dataset = dataset.batch(batch_size, drop_remainder=True)
+    if bucket_boundaries is None:
+        dataset = dataset.batch(batch_size, drop_remainder=True)
+    else:
+        assert bucket_boundaries[-1] > np.shape(train_input_enc)[1], \
+            "last bucket boundary must be larger than max_sequence_length"
+        dataset = dataset.map(trim_padding)
+        dataset = dataset.apply(tf.data.experimental.bucket_by_sequence_length(
+            sequence_bucket_length,
+            bucket_boundaries=bucket_boundaries,
+            bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1),
+            padding_values=(PAD_INDEX, PAD_INDEX, PAD_INDEX),
+            pad_to_bucket_boundary=True,
+            drop_remainder=True))
     # 데이터 각 요소에 대해서 rearrange 함수를
     # 통해서 요소를 변환하여 맵으로 구성한다.
     dataset = dataset.map(rearrange)
@@ -220,6 +395,8 @@ def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_s
         dataset = dataset.repeat(1)
     else:
         dataset = dataset.repeat()
+    # 학습 step이 도는 동안 다음 배치를 미리 준비한다.
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     # make_one_shot_iterator를 통해 이터레이터를
     # 만들어 준다.
     # 이터레이터를 통해 다음 항목의 텐서
@@ -253,6 +430,23 @@ def pred_next_string(value, dictionary):
     return answer, is_finished
 
 
+def make_vocabulary_array(idx2char):
+    # 인덱스 -> 단어 변환을 배열 indexing 한번으로 처리하기 위한 배열
+    return np.array([idx2char[idx] for idx in range(len(idx2char))], dtype=object)
+
+
+def indices_to_string(value, vocabulary_array):
+    # pred_next_string의 batch 버전.
+    # END 이후와 PAD는 제외하고, 각 문장의 END 등장 여부를 함께 돌려준다.
+    value = np.asarray(value)
+    words = vocabulary_array[value]
+    is_end = value == END_INDEX
+    keep = (np.cumsum(is_end, axis=1) == 0) & (value != PAD_INDEX)
+
+    answers = [" ".join(row[mask]) for row, mask in zip(words, keep)]
+    return answers, is_end.any(axis=1)
+
+
 def data_tokenizer(data):
     words = []
     for sentence in data:
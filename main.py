@@ -4,8 +4,9 @@
 from model import NLPModel
 import data_process
 from data_process import dataset_process, load_vocabulary, load_data, \
-    enc_processing, dec_output_processing, dec_target_processing, pred_next_string
+    enc_processing, dec_output_processing, dec_target_processing, enc_dec_processing, pred_next_string
 from config import Config
+from tf_additional.checkpoint import checkpoint_exists
 
 import numpy as np
 import os
@@ -25,26 +26,24 @@ def main():
     # 훈련 데이터와 테스트 데이터를 가져온다.
     train_input, train_label, eval_input, eval_label = load_data(configs.data_path)
 
-    # 훈련셋 인코딩 만드는 부분이다.
-    train_input_enc, train_input_enc_length = enc_processing(train_input, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    # 훈련셋 디코딩 입력 부분 만드는 부분이다.
-    train_output_dec, train_output_dec_length = dec_output_processing(train_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    # 훈련셋 디코딩 출력 부분 만드는 부분이다.
-    train_target_dec = dec_target_processing(train_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
+    # 훈련셋 인코딩, 디코딩 입력, 디코딩 출력을 한번에 만드는 부분이다.
+    train_input_enc, train_input_enc_length, train_output_dec, train_output_dec_length, train_target_dec = \
+        enc_dec_processing(train_input, train_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
 
-    # 평가셋 인코딩 만드는 부분이다.
-    eval_input_enc, eval_input_enc_length = enc_processing(eval_input, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    # 평가셋 인코딩 만드는 부분이다.
-    eval_output_dec, eval_output_dec_length = dec_output_processing(eval_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    # 평가셋 인코딩 만드는 부분이다.
-    eval_target_dec = dec_target_processing(eval_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
+    # 평가셋 인코딩, 디코딩 입력, 디코딩 출력을 한번에 만드는 부분이다.
+    eval_input_enc, eval_input_enc_length, eval_output_dec, eval_output_dec_length, eval_target_dec = \
+        enc_dec_processing(eval_input, eval_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
 
-    dataset_train = dataset_process(train_input_enc, train_output_dec, train_target_dec, configs.batch_size)
-    dataset_eval = dataset_process(eval_input_enc, eval_output_dec, eval_target_dec, configs.batch_size)
+    dataset_train = dataset_process(train_input_enc, train_output_dec, train_target_dec, configs.batch_size,
+                                    bucket_boundaries=configs.bucket_boundaries,
+                                    shuffle_buffer_size=configs.shuffle_seek)
+    dataset_eval = dataset_process(eval_input_enc, eval_output_dec, eval_target_dec, configs.batch_size,
+                                   bucket_boundaries=configs.bucket_boundaries,
+                                   shuffle_buffer_size=configs.shuffle_seek)
 
 
     model = NLPModel(configs)
-    if os.path.exists(configs.f_name):
+    if checkpoint_exists(configs.f_name):
         model.load_model(configs.f_name)
 
     for i, (features, labels) in enumerate(dataset_train.take(configs.train_steps)):
@@ -53,27 +52,10 @@ def main():
             model.save_model(configs.f_name)
 
             predict_input_enc, predic_input_enc_length = enc_processing(["가끔 궁금해"], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-            # 학습 과정이 아니므로 디코딩 입력은
-            # 존재하지 않는다.(구조를 맞추기 위해 넣는다.)
-            predict_output_dec, predic_output_decLength = dec_output_processing([""], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-            # 학습 과정이 아니므로 디코딩 출력 부분도
-            # 존재하지 않는다.(구조를 맞추기 위해 넣는다.)
-            predict_target_dec = dec_target_processing([""], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-
-            for i in range(configs.max_sequence_length):
-                if i > 0:
-                    predict_output_dec, _ = dec_output_processing([answer], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-                    predict_target_dec = dec_target_processing([answer], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-                # 예측을 하는 부분이다.
-
-                dataset_test = dataset_process(predict_input_enc, predict_output_dec, predict_target_dec, 1)
-                for (feature, _) in dataset_test.take(1):
-                    predictions = model.predict(feature)
-
-                answer, finished = pred_next_string(predictions.numpy(), idx2char)
-
-                if finished:
-                    break
+            # 예측을 하는 부분이다.
+            predictions = model.generate(predict_input_enc, configs.max_sequence_length,
+                                         start_index=data_process.STD_INDEX, end_index=data_process.END_INDEX)
+            answer, finished = pred_next_string(predictions.numpy(), idx2char)
 
             # 예측한 값을 인지 할 수 있도록
             # 텍스트로 변경하는 부분이다.
@@ -1,5 +1,4 @@
 
-import pickle
 import numpy as np
 import tensorflow as tf
 import sys
@@ -7,29 +6,69 @@ import sys
 from tensorflow.keras import Model
 from tensorflow.keras.layers import Dense, Dropout, Embedding
 
+from tf_additional.checkpoint import save_checkpoint, load_checkpoint
+from tf_additional.positional_encoding import positional_encoding as _positional_encoding
+from tf_additional.normalization import LayerNormalization
+from tf_additional.quantization import convert_to_tflite, TFLiteFunction, check_tolerance, softmax
+from tf_additional.multitask import compile_step
+
 
 def positional_encoding(dim, sentence_length):
-    encoded_vec = np.array([pos / np.power(10000, 2 * i / dim) for pos in range(sentence_length) for i in range(dim)])
-    encoded_vec[::2] = np.sin(encoded_vec[::2])
-    encoded_vec[1::2] = np.cos(encoded_vec[1::2])
-    return tf.constant(encoded_vec.reshape([sentence_length, dim]), dtype=tf.float32)
+    # table은 tf_additional.positional_encoding 에 캐시되어 있다.
+    return tf.constant(_positional_encoding(dim, sentence_length), dtype=tf.float32)
+
+
+# data_process.PAD_INDEX
+PAD_INDEX = 0
+
+_causal_mask_cache = dict()
+
 
+def causal_mask_bias(length):
+    # 길이별 causal mask. 미래 위치에 더해줄 큰 음수값을 한번만 만들어 둔다.
+    # graph 간에 tensor를 공유하지 않도록 numpy로 보관한다.
+    if length not in _causal_mask_cache:
+        tril = np.tril(np.ones([length, length], dtype=np.float32))
+        _causal_mask_cache[length] = (1. - tril) * (-2 ** 32 + 1)
+    return _causal_mask_cache[length]
 
-def layer_norm(inputs, eps=1e-6):
+
+class SublayerConnection(Model):
     # LayerNorm(x + Sublayer(x))
-    feature_shape = inputs.get_shape()[-1:]
-    #  평균과 표준편차을 넘겨 준다.
-    mean = tf.math.reduce_mean(inputs, [-1], keepdims=True)
-    std = tf.math.reduce_std(inputs, [-1], keepdims=True)
-    beta = tf.Variable(tf.zeros(feature_shape), trainable=False)
-    gamma = tf.Variable(tf.ones(feature_shape), trainable=False)
+    # gamma / beta는 layer에 한번만 생성되고 학습된다.
+    def __init__(self, dropout=0.2, eps=1e-6):
+        super().__init__()
+        self.dropout = Dropout(dropout)
+        self.layer_norm = LayerNormalization(norm_axis=-1, epsilon=eps)
+
+    def call(self, inputs, sublayer):
+        return self.layer_norm(inputs + self.dropout(sublayer))
+
+
+def quantized_paths(f_name, mode):
+    return '{}.{}.encoder.tflite'.format(f_name, mode), '{}.{}.decoder.tflite'.format(f_name, mode)
 
-    return gamma * (inputs - mean) / (std + eps) + beta
 
+def _pad_to(x, length):
+    # bucket 으로 잘린 배치를 export signature 길이(max_sequence_length)로 맞춘다.
+    x = np.asarray(x, dtype=np.int32)[:, :length]
+    return np.pad(x, [(0, 0), (0, length - x.shape[1])], constant_values=PAD_INDEX)
 
-def sublayer_connection(inputs, sublayer, dropout=0.2):
-    outputs = layer_norm(inputs + Dropout(dropout)(sublayer))
-    return outputs
+
+def _set_weights(layer, weights):
+    # SublayerConnection 도입 이전 checkpoint에는 layer norm의 gamma/beta가 없다.
+    # 그 경우 layer norm은 초기값(gamma=1, beta=0)으로 두고 나머지 weight만 채운다.
+    if len(weights) == len(layer.weights):
+        layer.set_weights(weights)
+        return
+
+    norm_ids = set(id(v) for m in layer.submodules if isinstance(m, LayerNormalization) for v in m.weights)
+    variables = [v for v in layer.weights if id(v) not in norm_ids]
+    if len(weights) != len(variables):
+        raise ValueError('{}: checkpoint has {} weights, expected {} (or {} without layer norm)'.format(
+            layer.name, len(weights), len(layer.weights), len(variables)))
+    for v, w in zip(variables, weights):
+        v.assign(w)
 
 
 class FeedForward(Model):
@@ -53,35 +92,45 @@ class MultiHeadAttention(Model):
 
         self.output_layer = Dense(num_units, activation=tf.nn.relu)
 
-    def scaled_dot_product_attention(self, query, key, value, masked):
+    def scaled_dot_product_attention(self, query, key, value, masked, padding_mask=None):
         key_dim_size = float(key.get_shape().as_list()[-1])
         key = tf.transpose(key, perm=[0, 2, 1])
         outputs = tf.matmul(query, key) / tf.sqrt(key_dim_size)
 
         if masked:
-            diag_vals = tf.ones_like(outputs[0, :, :])
-            tril = tf.linalg.LinearOperatorLowerTriangular(diag_vals).to_dense()
-            masks = tf.tile(tf.expand_dims(tril, 0), [tf.shape(outputs)[0], 1, 1])
+            outputs += causal_mask_bias(outputs.get_shape().as_list()[-1])
 
-            paddings = tf.ones_like(masks) * (-2 ** 32 + 1)
-            outputs = tf.where(tf.equal(masks, 0), paddings, outputs)
+        if padding_mask is not None:
+            # padding_mask: [batch, key_length], PAD가 아닌 위치가 True
+            # head가 batch 축(axis 0)으로 쌓여 있으므로 head 수만큼 tile 한다.
+            padding_bias = (1. - tf.cast(padding_mask, tf.float32)) * (-2 ** 32 + 1)
+            outputs += tf.tile(padding_bias, [self.heads, 1])[:, tf.newaxis, :]
 
         attention_map = tf.nn.softmax(outputs)
 
         return tf.matmul(attention_map, value)
 
-    def call(self, query, key, value, masked=False):
-        query = tf.concat(tf.split(self.q_layer(query), self.heads, axis=-1), axis=0)
+    def project_key_value(self, key, value):
+        # head 별로 나눈 key/value projection. 디코딩 캐시에 그대로 쌓는다.
         key = tf.concat(tf.split(self.k_layer(key), self.heads, axis=-1), axis=0)
         value = tf.concat(tf.split(self.v_layer(value), self.heads, axis=-1), axis=0)
+        return key, value
+
+    def attend(self, query, key, value, masked=False, padding_mask=None):
+        # key, value는 project_key_value를 거친 값
+        query = tf.concat(tf.split(self.q_layer(query), self.heads, axis=-1), axis=0)
 
-        attention_map = self.scaled_dot_product_attention(query, key, value, masked=masked)
+        attention_map = self.scaled_dot_product_attention(query, key, value, masked=masked, padding_mask=padding_mask)
 
         attn_outputs = tf.concat(tf.split(attention_map, self.heads, axis=0), axis=-1)
         attn_outputs = self.output_layer(attn_outputs)
 
         return attn_outputs
 
+    def call(self, query, key, value, masked=False, padding_mask=None):
+        key, value = self.project_key_value(key, value)
+        return self.attend(query, key, value, masked=masked, padding_mask=padding_mask)
+
 
 class Encoder(Model):
     def __init__(self, dim_input, model_hidden_size, ffn_hidden_size, heads, num_layers):
@@ -94,12 +143,15 @@ class Encoder(Model):
         for i in range(num_layers):
             self.enc_layers['multihead_attn_' + str(i)] = MultiHeadAttention(model_hidden_size, heads)
             self.enc_layers['ff_' + str(i)] = FeedForward(dim_input, ffn_hidden_size)
+            self.enc_layers['sublayer_attn_' + str(i)] = SublayerConnection()
+            self.enc_layers['sublayer_ff_' + str(i)] = SublayerConnection()
 
-    def call(self, inputs):
+    def call(self, inputs, padding_mask=None):
         x = inputs
         for i in range(self.num_layers):
-            x = sublayer_connection(x, self.enc_layers['multihead_attn_' + str(i)](x, x, x))
-            x = sublayer_connection(x, self.enc_layers['ff_' + str(i)](x))
+            x = self.enc_layers['sublayer_attn_' + str(i)](
+                x, self.enc_layers['multihead_attn_' + str(i)](x, x, x, padding_mask=padding_mask))
+            x = self.enc_layers['sublayer_ff_' + str(i)](x, self.enc_layers['ff_' + str(i)](x))
 
         return x
 
@@ -115,18 +167,70 @@ class Decoder(Model):
             self.dec_layers['masked_multihead_attn_' + str(i)] = MultiHeadAttention(model_hidden_size, heads)
             self.dec_layers['multihead_attn_' + str(i)] = MultiHeadAttention(model_hidden_size, heads)
             self.dec_layers['ff_' + str(i)] = FeedForward(dim_input, ffn_hidden_size)
+            self.dec_layers['sublayer_masked_attn_' + str(i)] = SublayerConnection()
+            self.dec_layers['sublayer_attn_' + str(i)] = SublayerConnection()
+            self.dec_layers['sublayer_ff_' + str(i)] = SublayerConnection()
 
         self.logit_layer = Dense(dim_output)
 
-    def call(self, inputs, encoder_outputs):
+    def call(self, inputs, encoder_outputs, padding_mask=None):
+        # padding_mask는 encoder 입력의 mask (cross attention 에서 사용)
+        x = inputs
+        for i in range(self.num_layers):
+            x = self.dec_layers['sublayer_masked_attn_' + str(i)](
+                x, self.dec_layers['masked_multihead_attn_' + str(i)](x, x, x, masked=True))
+            x = self.dec_layers['sublayer_attn_' + str(i)](
+                x, self.dec_layers['multihead_attn_' + str(i)](x, encoder_outputs, encoder_outputs,
+                                                               padding_mask=padding_mask))
+            x = self.dec_layers['sublayer_ff_' + str(i)](x, self.dec_layers['ff_' + str(i)](x))
+
+        return self.logit_layer(x)
+
+    def init_cache(self, encoder_outputs, padding_mask=None):
+        # encoder 출력에 대한 key/value는 디코딩 동안 바뀌지 않으므로 한번만 계산한다.
+        cache = {'enc_mask': padding_mask}
+        for i in range(self.num_layers):
+            enc_key, enc_value = self.dec_layers['multihead_attn_' + str(i)].project_key_value(encoder_outputs,
+                                                                                             encoder_outputs)
+            cache['layer_' + str(i)] = {'key': None, 'value': None, 'enc_key': enc_key, 'enc_value': enc_value}
+        return cache
+
+    def step(self, inputs, cache):
+        # inputs: 새로 들어온 위치 하나 [batch, 1, dim]
+        # 이전 위치들의 self-attention key/value는 cache에 누적되어 있으므로
+        # 새 위치만 계산하면 된다. (새 위치는 이전 위치를 모두 볼 수 있으므로 mask 불필요)
         x = inputs
         for i in range(self.num_layers):
-            x = sublayer_connection(x, self.dec_layers['masked_multihead_attn_' + str(i)](x, x, x, masked=True))
-            x = sublayer_connection(x, self.dec_layers['multihead_attn_' + str(i)](x, encoder_outputs, encoder_outputs))
-            x = sublayer_connection(x, self.dec_layers['ff_' + str(i)](x))
+            layer_cache = cache['layer_' + str(i)]
+            self_attn = self.dec_layers['masked_multihead_attn_' + str(i)]
+            key, value = self_attn.project_key_value(x, x)
+            if layer_cache['key'] is not None:
+                key = tf.concat([layer_cache['key'], key], axis=1)
+                value = tf.concat([layer_cache['value'], value], axis=1)
+            layer_cache['key'], layer_cache['value'] = key, value
+
+            x = self.dec_layers['sublayer_masked_attn_' + str(i)](x, self_attn.attend(x, key, value))
+            x = self.dec_layers['sublayer_attn_' + str(i)](
+                x, self.dec_layers['multihead_attn_' + str(i)].attend(x, layer_cache['enc_key'],
+                                                                      layer_cache['enc_value'],
+                                                                      padding_mask=cache['enc_mask']))
+            x = self.dec_layers['sublayer_ff_' + str(i)](x, self.dec_layers['ff_' + str(i)](x))
 
         return self.logit_layer(x)
 
+    def reorder_cache(self, cache, beam_indices):
+        # beam search 에서 살아남은 hypothesis 순서대로 self-attention cache를 다시 모은다.
+        # head가 batch 축(axis 0)으로 쌓여 있으므로 head 별 offset을 더해서 gather 한다.
+        # encoder key/value는 같은 batch 안의 beam끼리 동일하므로 그대로 둔다.
+        heads = self.dec_layers['masked_multihead_attn_0'].heads
+        n = tf.shape(beam_indices)[0]
+        indices = tf.reshape(tf.range(heads)[:, tf.newaxis] * n + beam_indices[tf.newaxis, :], [-1])
+        for i in range(self.num_layers):
+            layer_cache = cache['layer_' + str(i)]
+            layer_cache['key'] = tf.gather(layer_cache['key'], indices)
+            layer_cache['value'] = tf.gather(layer_cache['value'], indices)
+        return cache
+
 
 class NLPModel:
     def __init__(self, configs):
@@ -136,6 +240,7 @@ class NLPModel:
             embeddings_initializer = 'uniform'
 
         self.vocabulary_length = configs.vocabulary_length
+        self.max_sequence_length = configs.max_sequence_length
 
         self.position_encode = positional_encoding(configs.embedding_size, configs.max_sequence_length)
 
@@ -161,19 +266,25 @@ class NLPModel:
 
         self._initialize(configs)
 
+        # 학습 / 예측 step은 graph로 compile 한다. (configs.use_xla 이면 XLA 사용)
+        self._train_step = compile_step(self._train_step, use_xla=configs.use_xla)
+        self._predict_step = compile_step(self._predict_step, use_xla=configs.use_xla)
+
     def _initialize(self, configs):
         feature_temp = tf.zeros([1, configs.max_sequence_length], dtype=tf.float32)
         embed_temp = self.embedding(feature_temp)
         enc_temp = self.encoder(embed_temp)
         _ = self.decoder(embed_temp, enc_temp)
 
-    def train(self, features, labels):
+    def _train_step(self, inputs, outputs, labels):
+        # bucket 별로 길이가 다를 수 있으므로 position encoding은 길이만큼 잘라서 쓴다.
+        padding_mask = tf.not_equal(inputs, PAD_INDEX)
         with tf.GradientTape() as tape:
-            x_embed = self.embedding(features['input']) + self.position_encode
-            y_embed = self.embedding(features['output']) + self.position_encode
+            x_embed = self.embedding(inputs) + self.position_encode[:inputs.shape[1]]
+            y_embed = self.embedding(outputs) + self.position_encode[:outputs.shape[1]]
 
-            encoder_output = self.encoder(x_embed)
-            logits = self.decoder(y_embed, encoder_output)
+            encoder_output = self.encoder(x_embed, padding_mask=padding_mask)
+            logits = self.decoder(y_embed, encoder_output, padding_mask=padding_mask)
 
             predict = tf.argmax(logits, 2)
 
@@ -185,39 +296,224 @@ class NLPModel:
         grad = tape.gradient(loss, var_lists)
         self.optimizer.apply_gradients(zip(grad, var_lists))
 
-        self.accuracy.update_state(labels, predict)
+        return predict
 
-    def predict(self, feature):
+    def train(self, features, labels):
+        predict = self._train_step(features['input'], features['output'], labels)
+        self.accuracy.update_state(labels, predict)
 
-        x_embed = self.embedding(feature['input']) + self.position_encode
-        y_embed = self.embedding(feature['output']) + self.position_encode
+    def _predict_step(self, inputs, outputs):
+        padding_mask = tf.not_equal(inputs, PAD_INDEX)
+        x_embed = self.embedding(inputs) + self.position_encode[:inputs.shape[1]]
+        y_embed = self.embedding(outputs) + self.position_encode[:outputs.shape[1]]
 
-        encoder_output = self.encoder(x_embed)
-        logits = self.decoder(y_embed, encoder_output)
+        encoder_output = self.encoder(x_embed, padding_mask=padding_mask)
+        logits = self.decoder(y_embed, encoder_output, padding_mask=padding_mask)
 
         predict = tf.argmax(logits, 2)
 
         return predict
 
+    def predict(self, feature):
+        return self._predict_step(feature['input'], feature['output'])
+
+    def generate(self, inputs, max_len=None, start_index=1, end_index=2):
+        # greedy decoding. start_index / end_index 는 data_process의 STD_INDEX / END_INDEX
+        # 입력은 한번만 encoding 하고, decoder는 매 step 새 위치 하나만 계산한다.
+        if max_len is None:
+            max_len = self.max_sequence_length
+        max_len = min(max_len, self.max_sequence_length)
+
+        padding_mask = tf.not_equal(inputs, PAD_INDEX)
+        x_embed = self.embedding(inputs) + self.position_encode[:inputs.shape[1]]
+        encoder_output = self.encoder(x_embed, padding_mask=padding_mask)
+        cache = self.decoder.init_cache(encoder_output, padding_mask)
+
+        batch_size = tf.shape(encoder_output)[0]
+        token = tf.fill([batch_size, 1], start_index)
+        finished = tf.zeros([batch_size], dtype=tf.bool)
+        predict = []
+        for t in range(max_len):
+            y_embed = self.embedding(token) + self.position_encode[t:(t + 1)]
+            logits = self.decoder.step(y_embed, cache)
+            token = tf.argmax(logits, 2, output_type=tf.int32)
+            predict.append(token)
+
+            finished = finished | tf.equal(token[:, 0], end_index)
+            if tf.reduce_all(finished):
+                break
+
+        return tf.concat(predict, axis=1)
+
+    def beam_search(self, inputs, beam_size=4, max_len=None, start_index=1, end_index=2, alpha=0.6):
+        # batch x beam 개의 hypothesis를 [batch * beam] 축으로 펼쳐서 한번에 decoding 한다.
+        # 점수는 log prob 합을 GNMT length penalty ((5 + len) / 6) ** alpha 로 나눈 값
+        if max_len is None:
+            max_len = self.max_sequence_length
+        max_len = min(max_len, self.max_sequence_length)
+
+        padding_mask = tf.not_equal(inputs, PAD_INDEX)
+        x_embed = self.embedding(inputs) + self.position_encode[:inputs.shape[1]]
+        encoder_output = self.encoder(x_embed, padding_mask=padding_mask)
+
+        batch_size = tf.shape(encoder_output)[0]
+        flat_size = batch_size * beam_size
+        batch_offset = tf.range(batch_size)[:, tf.newaxis] * beam_size
+
+        cache = self.decoder.init_cache(tf.repeat(encoder_output, beam_size, axis=0),
+                                        tf.repeat(padding_mask, beam_size, axis=0))
+
+        # 처음에는 모든 beam이 같은 입력이므로 첫번째 beam만 살려둔다.
+        scores = tf.tile(tf.constant([0.] + [-1e9] * (beam_size - 1)), [batch_size])
+        lengths = tf.zeros([flat_size], dtype=tf.float32)
+        finished = tf.zeros([flat_size], dtype=tf.bool)
+        sequences = tf.zeros([flat_size, 0], dtype=tf.int32)
+        token = tf.fill([flat_size, 1], start_index)
+
+        # 끝난 hypothesis는 점수 변화 없이 END만 이어 붙인다.
+        end_only = tf.one_hot(end_index, self.vocabulary_length, on_value=0., off_value=-1e9)
+
+        for t in range(max_len):
+            y_embed = self.embedding(token) + self.position_encode[t:(t + 1)]
+            log_probs = tf.nn.log_softmax(self.decoder.step(y_embed, cache)[:, 0, :])
+            log_probs = tf.where(finished[:, tf.newaxis], end_only[tf.newaxis, :], log_probs)
+
+            candidates = scores[:, tf.newaxis] + log_probs
+            new_lengths = lengths + tf.cast(tf.logical_not(finished), tf.float32)
+            penalty = ((5. + new_lengths) / 6.) ** alpha
+
+            normalized = tf.reshape(candidates / penalty[:, tf.newaxis], [batch_size, -1])
+            _, top_index = tf.math.top_k(normalized, k=beam_size)
+
+            parent = tf.reshape(batch_offset + top_index // self.vocabulary_length, [-1])
+            token = tf.reshape(top_index % self.vocabulary_length, [-1, 1])
+
+            scores = tf.reshape(tf.gather(tf.reshape(candidates, [batch_size, -1]), top_index, batch_dims=1), [-1])
+            lengths = tf.gather(new_lengths, parent)
+            finished = tf.gather(finished, parent) | tf.equal(token[:, 0], end_index)
+            sequences = tf.concat([tf.gather(sequences, parent), token], axis=1)
+            cache = self.decoder.reorder_cache(cache, parent)
+
+            if tf.reduce_all(finished):
+                break
+
+        # batch 별로 length normalize 된 점수가 가장 높은 hypothesis를 고른다.
+        final_scores = tf.reshape(scores / ((5. + lengths) / 6.) ** alpha, [batch_size, beam_size])
+        best = tf.argmax(final_scores, axis=1, output_type=tf.int32) + batch_offset[:, 0]
+
+        return tf.gather(sequences, best)
+
+    def _export_functions(self):
+        # 길이는 max_sequence_length로 고정, batch 크기만 가변
+        length = self.max_sequence_length
+        dim = self.position_encode.shape[-1]
+
+        @tf.function(input_signature=[tf.TensorSpec([None, length], tf.int32, name='enc_input')])
+        def encode(enc_input):
+            padding_mask = tf.not_equal(enc_input, PAD_INDEX)
+            x_embed = self.embedding(enc_input) + self.position_encode
+            return {'encoder_output': self.encoder(x_embed, padding_mask=padding_mask)}
+
+        @tf.function(input_signature=[tf.TensorSpec([None, length], tf.int32, name='enc_input'),
+                                      tf.TensorSpec([None, length, dim], tf.float32, name='encoder_output'),
+                                      tf.TensorSpec([None, length], tf.int32, name='dec_input')])
+        def decode(enc_input, encoder_output, dec_input):
+            padding_mask = tf.not_equal(enc_input, PAD_INDEX)
+            y_embed = self.embedding(dec_input) + self.position_encode
+            return {'logits': self.decoder(y_embed, encoder_output, padding_mask=padding_mask)}
+
+        return encode, decode
+
+    def export_quantized(self, f_name, calibration_features, mode='int8', atol=0.05):
+        # 학습된 weight로 encoder / decoder 를 각각 TFLite 모델로 변환한다.
+        # calibration_features: {'input', 'output'} 배치 몇개 (예: dataset_train.take(10)의 feature)
+        # 변환 후 calibration 배치에서 float32 모델과 softmax 출력 차이가 atol 이하인지 확인한다.
+        encode, decode = self._export_functions()
+        trackable = tf.Module()
+        trackable.embedding, trackable.encoder, trackable.decoder = self.embedding, self.encoder, self.decoder
+
+        enc_samples, dec_samples = [], []
+        for feature in calibration_features:
+            enc_input = _pad_to(feature['input'], self.max_sequence_length)
+            dec_input = _pad_to(feature['output'], self.max_sequence_length)
+            encoder_output = encode(enc_input)['encoder_output'].numpy()
+            enc_samples.append({'enc_input': enc_input})
+            dec_samples.append({'enc_input': enc_input, 'encoder_output': encoder_output, 'dec_input': dec_input})
+
+        enc_path, dec_path = quantized_paths(f_name, mode)
+        for path, fn, samples in [(enc_path, encode, enc_samples), (dec_path, decode, dec_samples)]:
+            with open(path, 'wb') as f:
+                f.write(convert_to_tflite(trackable, fn.get_concrete_function(), mode, samples))
+
+        quantized = QuantizedNLPModel(f_name, mode)
+
+        def reference_fn(enc_input, dec_input):
+            encoder_output = encode(enc_input)['encoder_output']
+            return {'logits': decode(enc_input, encoder_output, dec_input)['logits'].numpy()}
+
+        max_diff = check_tolerance(reference_fn, quantized.logits, [{'enc_input': d['enc_input'], 'dec_input': d['dec_input']} for d in dec_samples], atol,
+                                   transform=softmax)
+        print("quantized model exported. (mode: {}, max prob diff: {:.5f}, path: {}, {})".format(
+            mode, max_diff['logits'], enc_path, dec_path))
+
+        return max_diff
+
     def save_model(self, f_name):
         w_dict = {}
         w_dict['embedding'] = self.embedding.get_weights()
         w_dict['encoder'] = self.encoder.get_weights()
         w_dict['decoder'] = self.decoder.get_weights()
 
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'wb') as f:
-            pickle.dump(w_dict, f)
+        # 저장은 background thread에서 진행된다.
+        save_checkpoint(f_name, w_dict)
 
         print("model saved. (path: {})".format(f_name))
 
     def load_model(self, f_name):
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'rb') as f:
-            w_dict = pickle.load(f)
+        w_dict = load_checkpoint(f_name)
 
         self.embedding.set_weights(w_dict['embedding'])
-        self.encoder.set_weights(w_dict['encoder'])
-        self.decoder.set_weights(w_dict['decoder'])
+        _set_weights(self.encoder, w_dict['encoder'])
+        _set_weights(self.decoder, w_dict['decoder'])
 
         print("model loaded. (path: {})".format(f_name))
+
+
+class QuantizedNLPModel:
+    # export_quantized 로 만든 TFLite 모델로 greedy decoding 한다. (float32 weight는 올리지 않는다.)
+    # decoder는 고정 길이 입력을 받으므로 매 step 전체 길이를 계산하지만,
+    # causal mask 때문에 t 위치의 출력은 t 이후의 입력에 영향을 받지 않는다.
+    def __init__(self, f_name, mode='int8', num_threads=None):
+        enc_path, dec_path = quantized_paths(f_name, mode)
+        self.encode = TFLiteFunction(model_path=enc_path, num_threads=num_threads)
+        self.decode = TFLiteFunction(model_path=dec_path, num_threads=num_threads)
+
+    def logits(self, enc_input, dec_input):
+        encoder_output = self.encode(enc_input=enc_input)['encoder_output']
+        return self.decode(enc_input=enc_input, encoder_output=encoder_output, dec_input=dec_input)
+
+    def generate(self, inputs, max_len=None, start_index=1, end_index=2):
+        inputs = np.asarray(inputs, dtype=np.int32)
+        batch_size, length = inputs.shape
+        if max_len is None:
+            max_len = length
+        max_len = min(max_len, length)
+
+        encoder_output = self.encode(enc_input=inputs)['encoder_output']
+
+        dec_input = np.full([batch_size, length], PAD_INDEX, dtype=np.int32)
+        dec_input[:, 0] = start_index
+        predict = np.full([batch_size, max_len], PAD_INDEX, dtype=np.int32)
+        finished = np.zeros([batch_size], dtype=bool)
+        for t in range(max_len):
+            logits = self.decode(enc_input=inputs, encoder_output=encoder_output, dec_input=dec_input)['logits']
+            token = np.argmax(logits[:, t], axis=-1)
+            predict[:, t] = token
+            if t + 1 < length:
+                dec_input[:, t + 1] = token
+
+            finished |= token == end_index
+            if finished.all():
+                return predict[:, :(t + 1)]
+
+        return predict
@@ -14,6 +14,7 @@ from timeseries.model import TSModel
 # from timeseries.data_process import DataScheduler
 from timeseries.data_process_v2_0 import DataScheduler
 from timeseries.rl import MyEnv
+from tf_additional.checkpoint import checkpoint_exists
 
 import os
 import pathlib
@@ -44,7 +45,7 @@ def main():
     # ts_configs.f_name = 'ts_model_test_info_mtl_us_1_2'  #: us every
     ts_configs.f_name = 'kr_mtl_dg_dynamic_1_0_mlarge4'  #: kr every
 
-    if os.path.exists(ts_configs.f_name + '.pkl'):
+    if checkpoint_exists(ts_configs.f_name):
         model.load_model(ts_configs.f_name)
 
     ds.set_idx(4000)
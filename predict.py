@@ -1,10 +1,12 @@
 
 
 from config import Config
+from tf_additional.checkpoint import checkpoint_exists
 from model import NLPModel
 import data_process
 from data_process import dataset_process, load_vocabulary, load_data, \
-    enc_processing, dec_output_processing, dec_target_processing, pred_next_string
+    enc_processing, dec_output_processing, dec_target_processing, pred_next_string, \
+    make_vocabulary_array, indices_to_string
 
 
 
@@ -24,27 +26,22 @@ if __name__ == '__main__':
     input = " ".join(sys.argv[1:])
     print(input)
     predict_input_enc, predict_input_enc_length = enc_processing([input], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    predict_output_dec, predict_output_dec_length = dec_output_processing([""], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-    predict_target_dec = dec_target_processing([""], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
 
     model = NLPModel(configs)
-    if os.path.exists(configs.f_name):
+    if checkpoint_exists(configs.f_name):
         model.load_model(configs.f_name)
 
-    for i in range(configs.max_sequence_length):
-        if i > 0:
-            predict_output_dec, predict_output_decLength = dec_output_processing([answer], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-            predict_target_dec = dec_target_processing([answer], char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
-        # 예측을 하는 부분이다.
-
-        dataset_test = dataset_process(predict_input_enc, predict_output_dec, predict_target_dec, 1)
-        for (feature, _) in dataset_test.take(1):
-            predictions = model.predict(feature)
-
-        answer, finished = pred_next_string(predictions.numpy(), idx2char)
-
-        if finished:
-            break
+    # 입력은 한번만 인코딩하고 디코더는 새 위치만 계산한다.
+    if configs.beam_size > 1:
+        predictions = model.beam_search(predict_input_enc, configs.beam_size, configs.max_sequence_length,
+                                        start_index=data_process.STD_INDEX, end_index=data_process.END_INDEX,
+                                        alpha=configs.length_penalty_alpha)
+    else:
+        predictions = model.generate(predict_input_enc, configs.max_sequence_length,
+                                     start_index=data_process.STD_INDEX, end_index=data_process.END_INDEX)
+
+    answers, finished = indices_to_string(predictions.numpy(), make_vocabulary_array(idx2char))
+    answer = answers[0]
 
     # 예측한 값을 인지 할 수 있도록
     # 텍스트로 변경하는 부분이다.
@@ -0,0 +1,30 @@
+
+from config import Config
+from model import NLPModel
+from data_process import load_vocabulary, load_data, enc_dec_processing, dataset_process
+from tf_additional.checkpoint import checkpoint_exists
+
+import sys
+
+
+# 학습된 NLPModel 을 CPU 추론용 TFLite 모델(int8 / float16)로 변환한다.
+# 사용법: python quantize.py [int8|float16]
+if __name__ == '__main__':
+    configs = Config()
+    mode = sys.argv[1] if len(sys.argv) >= 2 else configs.quantize_mode
+
+    char2idx, idx2char, configs.vocabulary_length = load_vocabulary(configs.vocabulary_path, configs.data_path, configs.tokenize_as_morph)
+    train_input, train_label, eval_input, eval_label = load_data(configs.data_path)
+
+    # calibration 에는 학습 배치 일부를 사용한다.
+    train_input_enc, _, train_output_dec, _, train_target_dec = \
+        enc_dec_processing(train_input, train_label, char2idx, configs.max_sequence_length, configs.tokenize_as_morph)
+    dataset_train = dataset_process(train_input_enc, train_output_dec, train_target_dec, configs.batch_size,
+                                    shuffle_buffer_size=configs.shuffle_seek)
+    calibration_features = [features for features, _ in dataset_train.take(configs.quantize_calibration_steps)]
+
+    model = NLPModel(configs)
+    assert checkpoint_exists(configs.f_name), "trained model not found. (path: {})".format(configs.f_name)
+    model.load_model(configs.f_name)
+
+    model.export_quantized(configs.f_name, calibration_features, mode=mode, atol=configs.quantize_atol)
@@ -0,0 +1,192 @@
+
+from config import Config
+from tf_additional.checkpoint import checkpoint_exists
+from model import NLPModel, QuantizedNLPModel
+import data_process
+from data_process import load_vocabulary, enc_processing, make_vocabulary_array, indices_to_string
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+
+# 로컬 추론 서버
+# 모델과 사전은 한번만 로드하고, 동시에 들어온 요청들을 모아서 하나의 batch로 decoding 한다.
+#
+# 사용법:
+#   python serve.py                      # http://127.0.0.1:8000
+#   curl -d '{"text": "안녕하세요"}' http://127.0.0.1:8000/predict
+#   curl -d '{"texts": ["안녕", "뭐해"]}' http://127.0.0.1:8000/predict
+#   python serve.py --stdin              # 한 줄에 하나씩 JSON({"text": ...}) 또는 문장을 받는다.
+
+
+class _Request:
+    def __init__(self, text):
+        self.text = text
+        self.answer = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class BatchPredictor:
+    def __init__(self, configs, max_batch_size=None, max_wait=None):
+        self.configs = configs
+        self.max_batch_size = max_batch_size or configs.serve_batch_size
+        self.max_wait = configs.serve_max_wait if max_wait is None else max_wait
+
+        self.char2idx, self.idx2char, configs.vocabulary_length = load_vocabulary(
+            configs.vocabulary_path, configs.data_path, configs.tokenize_as_morph)
+        self.vocabulary_array = make_vocabulary_array(self.idx2char)
+
+        if configs.serve_quantized:
+            # quantize.py 로 만든 TFLite 모델 (greedy decoding만 지원)
+            self.model = QuantizedNLPModel(configs.f_name, configs.quantize_mode)
+        else:
+            self.model = NLPModel(configs)
+            if checkpoint_exists(configs.f_name):
+                self.model.load_model(configs.f_name)
+
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def _decode(self, input_enc):
+        if self.configs.serve_quantized:
+            return self.model.generate(input_enc, self.configs.max_sequence_length,
+                                       start_index=data_process.STD_INDEX, end_index=data_process.END_INDEX)
+        if self.configs.beam_size > 1:
+            predictions = self.model.beam_search(input_enc, self.configs.beam_size, self.configs.max_sequence_length,
+                                                 start_index=data_process.STD_INDEX,
+                                                 end_index=data_process.END_INDEX,
+                                                 alpha=self.configs.length_penalty_alpha)
+        else:
+            predictions = self.model.generate(input_enc, self.configs.max_sequence_length,
+                                              start_index=data_process.STD_INDEX, end_index=data_process.END_INDEX)
+        return predictions.numpy()
+
+    def _collect(self):
+        # 첫 요청은 기다리고, 이후로는 max_batch_size 또는 max_wait 까지만 모은다.
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                input_enc, _ = enc_processing([r.text for r in batch], self.char2idx,
+                                              self.configs.max_sequence_length, self.configs.tokenize_as_morph)
+                answers, _ = indices_to_string(self._decode(input_enc), self.vocabulary_array)
+                for r, answer in zip(batch, answers):
+                    r.answer = answer
+            except Exception as e:
+                for r in batch:
+                    r.error = str(e)
+            for r in batch:
+                r.done.set()
+
+    def predict(self, texts, timeout=None):
+        requests = [_Request(text) for text in texts]
+        for r in requests:
+            self._queue.put(r)
+        answers = []
+        for r in requests:
+            if not r.done.wait(timeout):
+                raise TimeoutError("prediction timed out")
+            if r.error is not None:
+                raise RuntimeError(r.error)
+            answers.append(r.answer)
+        return answers
+
+
+def _parse_texts(payload):
+    if 'texts' in payload:
+        return [str(t) for t in payload['texts']]
+    return [str(payload['text'])]
+
+
+def make_handler(predictor):
+    class PredictHandler(BaseHTTPRequestHandler):
+        def _send(self, code, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                payload = json.loads(self.rfile.read(length).decode('utf-8'))
+                texts = _parse_texts(payload)
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {'error': 'bad request: {}'.format(e)})
+                return
+
+            try:
+                answers = predictor.predict(texts)
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+                return
+
+            if 'texts' in payload:
+                self._send(200, {'answers': answers})
+            else:
+                self._send(200, {'answer': answers[0]})
+
+        def log_message(self, format, *args):
+            pass
+
+    return PredictHandler
+
+
+def serve_http(predictor, host='127.0.0.1', port=8000):
+    server = ThreadingHTTPServer((host, port), make_handler(predictor))
+    print("serving on http://{}:{}/predict".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve_stdin(predictor):
+    # 입력 줄마다 응답 한 줄(JSON)을 출력한다.
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            payload = json.loads(line) if line.startswith('{') else {'text': line}
+            answers = predictor.predict(_parse_texts(payload))
+            out = {'answers': answers} if 'texts' in payload else {'answer': answers[0]}
+        except Exception as e:
+            out = {'error': str(e)}
+        print(json.dumps(out, ensure_ascii=False), flush=True)
+
+
+if __name__ == '__main__':
+    configs = Config()
+    predictor = BatchPredictor(configs)
+
+    if '--stdin' in sys.argv[1:]:
+        serve_stdin(predictor)
+    else:
+        serve_http(predictor, configs.serve_host, configs.serve_port)
@@ -0,0 +1,211 @@
+"""Flat binary checkpoints for lists/dicts of numpy weights.
+
+A checkpoint ``<name>.ckpt/`` holds one blob per top-level group
+(``encoder.<stamp>.bin``, ...) and an ``index.json`` describing where every
+tensor lives inside its blob. Tensors are aligned to ``ALIGNMENT`` bytes so
+they can be handed out as zero-copy ``np.memmap`` views.
+
+Writes go through a single background thread: blobs are written first, the
+index is swapped in atomically with ``os.replace`` and only then are the
+blobs of the previous checkpoint removed, so a reader never sees a partial
+checkpoint. Legacy pickle files (``<name>`` / ``<name>.pkl``) are still read.
+"""
+
+import atexit
+import json
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ALIGNMENT = 64
+INDEX_NAME = 'index.json'
+VERSION = 1
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = []
+
+
+def checkpoint_dir(f_name):
+    if f_name.endswith('.pkl'):
+        f_name = f_name[:-4]
+    return f_name + '.ckpt'
+
+
+def _legacy_paths(f_name):
+    base = f_name[:-4] if f_name.endswith('.pkl') else f_name
+    return [base + '.pkl', base]
+
+
+def checkpoint_exists(f_name):
+    if os.path.exists(os.path.join(checkpoint_dir(f_name), INDEX_NAME)):
+        return True
+    return any(os.path.isfile(p) for p in _legacy_paths(f_name))
+
+
+def _encode(value, tensors):
+    # 중첩된 list / dict 구조는 json으로, array는 tensors 목록으로 분리한다.
+    if isinstance(value, dict):
+        return {'type': 'dict', 'items': {str(k): _encode(v, tensors) for k, v in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {'type': 'list', 'items': [_encode(v, tensors) for v in value]}
+    if isinstance(value, (np.ndarray, np.generic)) or hasattr(value, 'numpy'):
+        # 복사본을 잡아두므로 저장 중에 weight가 바뀌어도 괜찮다.
+        tensors.append(np.array(value, order='C', copy=True))
+        return {'type': 'array', 'index': len(tensors) - 1}
+    return {'type': 'value', 'value': value}
+
+
+def _decode(spec, arrays):
+    if spec['type'] == 'dict':
+        return {k: _decode(v, arrays) for k, v in spec['items'].items()}
+    if spec['type'] == 'list':
+        return [_decode(v, arrays) for v in spec['items']]
+    if spec['type'] == 'array':
+        return arrays[spec['index']]
+    return spec['value']
+
+
+def _write_atomic(path, write_fn):
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _write_blob(f, tensors):
+    entries = []
+    offset = 0
+    for arr in tensors:
+        pad = (-offset) % ALIGNMENT
+        if pad:
+            f.write(b'\0' * pad)
+            offset += pad
+        f.write(arr.tobytes())
+        entries.append({'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset})
+        offset += arr.nbytes
+    return entries
+
+
+def _write_checkpoint(path, groups):
+    os.makedirs(path, exist_ok=True)
+    stamp = '{}_{}'.format(int(time.time() * 1e6), os.getpid())
+
+    index = {'version': VERSION, 'groups': dict()}
+    for group, (structure, tensors) in groups.items():
+        file_name, entries = None, []
+        if tensors:
+            file_name = '{}.{}.bin'.format(group, stamp)
+            _write_atomic(os.path.join(path, file_name), lambda f: entries.extend(_write_blob(f, tensors)))
+        index['groups'][group] = {'file': file_name, 'tensors': entries, 'structure': structure}
+
+    _write_atomic(os.path.join(path, INDEX_NAME), lambda f: f.write(json.dumps(index).encode('utf-8')))
+
+    # 새 index에서 참조하지 않는 이전 blob은 지운다.
+    in_use = set(g['file'] for g in index['groups'].values() if g['file'] is not None)
+    for name in os.listdir(path):
+        if name.endswith('.bin') and name not in in_use:
+            try:
+                os.remove(os.path.join(path, name))
+            except OSError:
+                pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # 저장 순서가 유지되도록 writer는 하나만 둔다.
+            _executor = ThreadPoolExecutor(max_workers=1)
+            atexit.register(wait_for_pending)
+        return _executor
+
+
+def wait_for_pending():
+    # 백그라운드 저장이 모두 끝날 때까지 기다린다. (에러가 있으면 여기서 올라온다.)
+    while _pending:
+        _pending.pop(0).result()
+
+
+def save_checkpoint(f_name, w_dict, background=True):
+    """Save a dict of (nested lists/dicts of) arrays under ``checkpoint_dir(f_name)``.
+
+    The arrays are copied before returning, so the caller may keep training
+    while the write happens in the background.
+    """
+    groups = dict()
+    for group, value in w_dict.items():
+        tensors = []
+        structure = _encode(value, tensors)
+        groups[str(group)] = (structure, tensors)
+
+    path = checkpoint_dir(f_name)
+    if not background:
+        _write_checkpoint(path, groups)
+        return None
+
+    # 이전 저장에서 난 에러는 다음 저장 시점에 알린다.
+    while _pending and _pending[0].done():
+        _pending.pop(0).result()
+
+    future = _get_executor().submit(_write_checkpoint, path, groups)
+    _pending.append(future)
+    return future
+
+
+def _load_pickle(f_name):
+    for path in _legacy_paths(f_name):
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+    raise FileNotFoundError('checkpoint not found: {}'.format(f_name))
+
+
+def load_checkpoint(f_name, mmap=True):
+    """Load a checkpoint saved by ``save_checkpoint``; falls back to legacy pickle files.
+
+    With ``mmap=True`` the arrays are read-only ``np.memmap`` views into the blobs.
+    """
+    path = checkpoint_dir(f_name)
+    index_path = os.path.join(path, INDEX_NAME)
+    if not os.path.exists(index_path):
+        return _load_pickle(f_name)
+
+    with open(index_path, 'rb') as f:
+        index = json.loads(f.read().decode('utf-8'))
+
+    w_dict = dict()
+    for group, info in index['groups'].items():
+        arrays = []
+        if info['file'] is None:
+            w_dict[group] = _decode(info['structure'], arrays)
+            continue
+
+        blob_path = os.path.join(path, info['file'])
+        if mmap and os.path.getsize(blob_path) > 0:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        else:
+            with open(blob_path, 'rb') as f:
+                blob = np.frombuffer(f.read(), dtype=np.uint8)
+        for entry in info['tensors']:
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape'], dtype=np.int64))
+            nbytes = count * dtype.itemsize
+            arr = blob[entry['offset']:entry['offset'] + nbytes].view(dtype).reshape(entry['shape'])
+            arrays.append(arr)
+        w_dict[group] = _decode(info['structure'], arrays)
+
+    return w_dict
+
+
+def migrate_pickle(f_name):
+    """Convert a legacy pickle checkpoint to the flat format next to it."""
+    w_dict = _load_pickle(f_name)
+    save_checkpoint(f_name, w_dict, background=False)
+    return checkpoint_dir(f_name)
@@ -0,0 +1,46 @@
+"""Helpers for graph-compiled multi-task train / eval steps.
+
+``compile_step`` wraps a step function in ``tf.function`` (optionally XLA
+compiled, with ``jit_compile`` or the older ``experimental_compile``); the
+NLP model uses it for its train / predict steps as well. ``fused_heads``
+evaluates a fixed list of two-layer heads (``in_layer`` -> ``out_layer``
+Dense, e.g. ``FeedForward``) with one matmul
+per layer: the first kernels are concatenated and the second ones placed on
+a block diagonal. The heads keep their own variables, so checkpoints and
+``get_weights`` / ``set_weights`` per head are unchanged.
+"""
+
+import tensorflow as tf
+
+
+def compile_step(fn, use_xla=False):
+    if not use_xla:
+        return tf.function(fn)
+    try:
+        return tf.function(fn, jit_compile=True)
+    except TypeError:
+        # jit_compile 이전 버전
+        return tf.function(fn, experimental_compile=True)
+
+
+def _dense(x, kernel, bias):
+    return tf.tensordot(x, kernel, [[x.shape.rank - 1], [0]]) + bias
+
+
+def fused_heads(heads, x):
+    """[head(x) for head in heads] with a single matmul per layer (heads share the hidden activation)."""
+    hidden = _dense(x,
+                    tf.concat([h.in_layer.kernel for h in heads], axis=1),
+                    tf.concat([h.in_layer.bias for h in heads], axis=0))
+    hidden = heads[0].in_layer.activation(hidden)
+
+    # 두번째 layer 는 block diagonal kernel [sum(hidden) x sum(dim_out)]
+    dims_out = [h.out_layer.kernel.shape[-1] for h in heads]
+    total_out = sum(dims_out)
+    kernels, offset = [], 0
+    for h, dim_out in zip(heads, dims_out):
+        kernels.append(tf.pad(h.out_layer.kernel, [[0, 0], [offset, total_out - offset - dim_out]]))
+        offset += dim_out
+    out = _dense(hidden, tf.concat(kernels, axis=0), tf.concat([h.out_layer.bias for h in heads], axis=0))
+
+    return [h.out_layer.activation(o) for h, o in zip(heads, tf.split(out, dims_out, axis=-1))]
@@ -0,0 +1,42 @@
+"""Sinusoidal positional encodings shared by the transformer models.
+
+Tables are built with numpy broadcasting and kept in a process-wide cache per
+``(dim, dtype)``. A request for a shorter length is a slice of the cached
+table; a longer length rebuilds the table once at the new length.
+"""
+
+import threading
+
+import numpy as np
+
+_cache = dict()
+_cache_lock = threading.Lock()
+
+
+def _build(dim, length):
+    pos = np.arange(length, dtype=np.float64)[:, np.newaxis]
+    i = np.arange(dim, dtype=np.float64)[np.newaxis, :]
+    encoded_vec = (pos / np.power(10000, 2 * i / dim)).reshape(-1)
+    # 기존 구현과 같이 펼친 배열의 짝수/홀수 위치에 sin/cos 를 적용한다.
+    encoded_vec[::2] = np.sin(encoded_vec[::2])
+    encoded_vec[1::2] = np.cos(encoded_vec[1::2])
+    return encoded_vec.reshape([length, dim])
+
+
+def positional_encoding(dim, length, dtype=np.float32):
+    """Return a read-only ``[length, dim]`` positional encoding table."""
+    dtype = np.dtype(dtype)
+    key = (dim, dtype)
+    with _cache_lock:
+        table = _cache.get(key)
+        if table is None or len(table) < length:
+            table = _build(dim, length).astype(dtype)
+            table.setflags(write=False)
+            _cache[key] = table
+
+    return table[:length]
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,90 @@
+"""Quantized CPU inference through TFLite.
+
+``convert_to_tflite`` saves a ``tf.function`` signature together with the
+layers it uses and converts it with post-training quantization:
+
+- ``'int8'``: int8 weights (per-channel where the TFLite kernel supports it)
+  and int8 activations calibrated on ``representative_data``;
+- ``'float16'``: float16 weights, computed in float32 on CPU.
+
+``TFLiteFunction`` runs the converted signature and ``check_tolerance``
+compares it with the float32 function on the calibration samples.
+"""
+
+import tempfile
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+QUANTIZE_MODES = ('int8', 'float16')
+
+
+def convert_to_tflite(trackable, concrete_fn, mode='int8', representative_data=None):
+    """Convert ``concrete_fn`` (whose variables live in ``trackable``) to a TFLite flatbuffer.
+
+    representative_data: list of dicts {input name: array} used for int8 calibration.
+    """
+    if mode not in QUANTIZE_MODES:
+        raise ValueError("mode must be one of {}. (given: {})".format(QUANTIZE_MODES, mode))
+
+    with tempfile.TemporaryDirectory() as saved_model_dir:
+        tf.saved_model.save(trackable, saved_model_dir, signatures=concrete_fn)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if mode == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif representative_data is not None:
+            def representative_dataset():
+                for sample in representative_data:
+                    yield {k: np.asarray(v) for k, v in sample.items()}
+            converter.representative_dataset = representative_dataset
+
+        return converter.convert()
+
+
+class TFLiteFunction:
+    """Callable wrapper of the default signature of a TFLite model.
+
+    Inputs / outputs are passed by name. Batch size may differ per call.
+    """
+    def __init__(self, model_path=None, model_content=None, num_threads=None):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path, model_content=model_content,
+                                               num_threads=num_threads)
+        self.runner = self.interpreter.get_signature_runner()
+        # interpreter는 thread-safe 하지 않다.
+        self._lock = threading.Lock()
+
+    def __call__(self, **inputs):
+        with self._lock:
+            outputs = self.runner(**{k: np.asarray(v) for k, v in inputs.items()})
+        return {k: np.array(v) for k, v in outputs.items()}
+
+
+def check_tolerance(reference_fn, quantized_fn, samples, atol, transform=None):
+    """Compare float32 and quantized outputs on ``samples``; raise ValueError when max |diff| > atol.
+
+    transform: applied to every output before comparing (e.g. softmax for logits).
+    Returns the max abs difference per output name.
+    """
+    max_diff = dict()
+    for sample in samples:
+        expected = reference_fn(**sample)
+        actual = quantized_fn(**sample)
+        for key in expected.keys():
+            e, a = np.asarray(expected[key], dtype=np.float32), np.asarray(actual[key], dtype=np.float32)
+            if transform is not None:
+                e, a = transform(e), transform(a)
+            max_diff[key] = max(max_diff.get(key, 0.), float(np.max(np.abs(e - a))))
+
+    exceeded = {k: v for k, v in max_diff.items() if v > atol}
+    if exceeded:
+        raise ValueError("quantized outputs differ from float32 by more than {}: {}".format(atol, exceeded))
+
+    return max_diff
+
+
+def softmax(x, axis=-1):
+    x = x - np.max(x, axis=axis, keepdims=True)
+    e = np.exp(x)
+    return e / np.sum(e, axis=axis, keepdims=True)
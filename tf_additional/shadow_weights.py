@@ -0,0 +1,77 @@
+"""Best-weights (and EMA) tracking with shadow ``tf.Variable``s.
+
+``ShadowWeights`` keeps a non-trainable copy of a nested structure (dicts /
+lists) of variables. ``save`` / ``restore`` copy between the live variables
+and the copy with in-graph ``assign``s, so early stopping does not round-trip
+every weight through numpy. ``numpy()`` returns the copy in the same nested
+structure (e.g. for ``save_checkpoint``).
+
+With ``ema_decay`` an exponential moving average of the weights is kept as
+well: ``update_ema`` is meant to be called inside the train step and
+``swap_ema`` exchanges the live weights with the average (call it again to
+swap back), so the average can be evaluated and saved as the best weights.
+"""
+
+import tensorflow as tf
+
+
+def _copy_variables(structure, name):
+    return tf.nest.map_structure(lambda v: tf.Variable(v, trainable=False, name=name), structure)
+
+
+class ShadowWeights:
+    def __init__(self, variables, ema_decay=None):
+        self.variables = variables
+        self.shadow = _copy_variables(variables, 'shadow')
+
+        self.ema_decay = ema_decay
+        self.ema = None if ema_decay is None else _copy_variables(variables, 'ema')
+
+        self._save = tf.function(lambda: self._assign(self.shadow, self.variables))
+        self._restore = tf.function(lambda: self._assign(self.variables, self.shadow))
+        self._swap_ema = tf.function(self._swap_ema_fn)
+
+    @staticmethod
+    def _assign(dst, src):
+        for d, s in zip(tf.nest.flatten(dst), tf.nest.flatten(src)):
+            d.assign(s)
+
+    def save(self):
+        # 현재 weight -> shadow
+        self._save()
+
+    def restore(self):
+        # shadow -> 현재 weight
+        self._restore()
+
+    def update_ema(self):
+        # train step (graph) 안에서 호출
+        for e, v in zip(tf.nest.flatten(self.ema), tf.nest.flatten(self.variables)):
+            e.assign(self.ema_decay * e + (1. - self.ema_decay) * v)
+
+    def _swap_ema_fn(self):
+        for e, v in zip(tf.nest.flatten(self.ema), tf.nest.flatten(self.variables)):
+            tmp = tf.identity(v)
+            v.assign(e)
+            e.assign(tmp)
+
+    def swap_ema(self):
+        self._swap_ema()
+
+    def numpy(self):
+        return tf.nest.map_structure(lambda v: v.numpy(), self.shadow)
+
+    def load(self, values):
+        """Assign (a sub-structure of) ``numpy()`` values to the shadow and the live variables."""
+        def assign(variables, shadow, values):
+            if isinstance(values, dict):
+                for key in values.keys():
+                    assign(variables[key], shadow[key], values[key])
+            else:
+                for v, s, value in zip(tf.nest.flatten(variables), tf.nest.flatten(shadow), values):
+                    v.assign(value)
+                    s.assign(value)
+
+        assign(self.variables, self.shadow, values)
+        if self.ema is not None:
+            self._assign(self.ema, self.variables)
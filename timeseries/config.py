@@ -9,6 +9,18 @@ class Config:
 
         self.sampling_days = 5          # get data every 'sampling_days' days
         self.trainset_rate = 0.6
+        self.use_feature_cube = False   # 전체 기간 feature 를 미리 계산해두고 윈도우는 잘라서 사용
+        self.feature_cube_path = './data/feature_cube/'
+        self.panel_cache_path = './data/panel_cache/'     # csv 원천 데이터의 npy 캐시
+        self.use_xla = False            # multi-task train/eval step XLA compile
+        self.ema_decay = None           # weight EMA 를 early stopping 대상으로 사용 (ex. 0.999, None: 사용 안함)
+        self.predict_batch_size = 1024  # test / plot 예측 batch 크기
+        self.n_dataset_workers = 1      # base date 별 샘플링 프로세스 수 (1: 순차)
+        self.dataset_seed = None        # base date 별 np.random seed 의 기준값 (None: 전역 random 상태 사용)
+        self.n_walk_forward_workers = 1     # window 별 재학습 프로세스 수 (1: 순차)
+        self.walk_forward_threads = None    # worker 당 TF / BLAS thread 수 (None: 제한 안함)
+        self.warm_start = False             # 이전 window 모델에서 이어서 학습
+        self.pipeline_depth = 1             # warm start 시 window k 는 window k - pipeline_depth 모델에서 시작
 
         self.max_sequence_length_in = self.m_days // self.sampling_days
         self.max_sequence_length_out = self.k_days // self.sampling_days
@@ -1,6 +1,11 @@
 
 from timeseries.utils import *
-from timeseries.features import processing
+from timeseries.features import processing, processing_log_p, CUBE_SPECS
+from timeseries.feature_cube import FeatureCube
+from timeseries.window_clean import PanelWindows
+from timeseries.panel_cache import cached_frames, DEFAULT_CACHE_DIR
+from timeseries.parallel_dataset import sample_base_dates
+from timeseries.rolling import rolling_std, drawdown
 
 import pandas as pd
 import tensorflow as tf
@@ -26,7 +31,10 @@ class DataScheduler:
         self.data_out_path = os.path.join(os.getcwd(), configs.data_out_path)
         os.makedirs(self.data_out_path, exist_ok=True)
 
-        self.data_generator = DataGenerator(data_type)    # infocode
+        self.data_generator = DataGenerator(data_type,
+                                            use_feature_cube=configs.use_feature_cube,
+                                            cube_dir=configs.feature_cube_path,
+                                            panel_cache_dir=configs.panel_cache_path)    # infocode
         # self.data_generator = DataGeneratorDynamic(data_type)    # infocode
 
         self.train_set_length = configs.train_set_length
@@ -40,6 +48,13 @@ class DataScheduler:
         self.train_batch_size = configs.batch_size
         self.trainset_rate = configs.trainset_rate
 
+        # base date 별 샘플링 병렬 처리
+        self.n_dataset_workers = configs.n_dataset_workers
+        self.dataset_seed = configs.dataset_seed
+
+        # test / plot 예측은 batch 단위로 한번에
+        self.predict_batch_size = configs.predict_batch_size
+
         self._initialize()
 
     def _initialize(self):
@@ -130,8 +145,12 @@ class DataScheduler:
 
         code_dict = self.get_code_dict(codes_list)
 
-        for i, d in enumerate(range(start_idx, end_idx, self.sampling_days)):
-            _sampled_data = self.data_generator.sample_inputdata(d, **data_params, **code_dict)
+        sampled_list = sample_base_dates(self.data_generator, 'sample_inputdata',
+                                         range(start_idx, end_idx, self.sampling_days),
+                                         dict(data_params, **code_dict),
+                                         n_workers=self.n_dataset_workers,
+                                         seed=self.dataset_seed)
+        for _sampled_data in sampled_list:
             if _sampled_data is False:
                 continue
             else:
@@ -166,29 +185,12 @@ class DataScheduler:
         assert np.sum(train_input_enc[:, -1, :] - train_output_dec[:, 0, :]) == 0
         train_new_output = np.zeros_like(train_output_dec)
         train_new_output[:, 0, :] = train_output_dec[:, 0, :]
-        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=self.train_batch_size)
+        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=self.train_batch_size,
+                                        label_fn=mtl_label_fn(features_list))
 
-        for i, (features, labels) in enumerate(train_dataset.take(train_steps)):
+        for i, (features, labels_mtl) in enumerate(train_dataset.take(train_steps)):
             print_loss = True
 
-            labels_mtl = {'ret': np.stack([labels[:, :, features_list.index('log_y')],
-                                                 labels[:, :, features_list.index('log_20y')],
-                                                 labels[:, :, features_list.index('log_60y')],
-                                                 labels[:, :, features_list.index('log_120y')]], axis=-1),
-                          'pos': (np.concatenate([labels[:, :, features_list.index('positive')].numpy() > 0,
-                                                  labels[:, :, features_list.index('positive')].numpy() <= 0], axis=1)
-                                  * 1.).reshape([-1, 1, 2]),
-                          'pos20': (np.concatenate([labels[:, :, features_list.index('positive20')].numpy() > 0,
-                                                  labels[:, :, features_list.index('positive20')].numpy() <= 0], axis=1)
-                                  * 1.).reshape([-1, 1, 2]),
-                          'std': np.stack([labels[:, :, features_list.index('std_20')],
-                                                 labels[:, :, features_list.index('std_60')],
-                                                 labels[:, :, features_list.index('std_120')]], axis=-1),
-                          'mdd': np.stack([labels[:, :, features_list.index('mdd_20')],
-                                                 labels[:, :, features_list.index('mdd_60')]], axis=-1),
-                          'fft': np.stack([labels[:, :, features_list.index('fft_3com')],
-                                           labels[:, :, features_list.index('fft_100com')]], axis=-1)}
-
             model.finetune_mtl(features, labels_mtl, print_loss=print_loss)
 
     def train(self,
@@ -222,10 +224,13 @@ class DataScheduler:
         eval_new_output = np.zeros_like(eval_output_dec)
         eval_new_output[:, 0, :] = eval_output_dec[:, 0, :]
 
-        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=self.train_batch_size)
-        train_dataset_plot = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=1)
-        eval_dataset = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, batch_size=self.train_batch_size)
-        eval_dataset_plot = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, batch_size=1)
+        # mtl 이면 라벨(labels_mtl)은 dataset.map 에서 만들어진다.
+        label_fn = mtl_label_fn(features_list) if mtl else None
+        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=self.train_batch_size, label_fn=label_fn)
+        # plot 용 dataset 은 plot 한번에 batch 하나 (250 sample)
+        train_dataset_plot = dataset_process(train_input_enc, train_new_output, train_target_dec, batch_size=min(250, len(train_input_enc)))
+        eval_dataset = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, batch_size=self.train_batch_size, label_fn=label_fn)
+        eval_dataset_plot = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, batch_size=min(250, len(eval_input_enc)))
         for i, (features, labels) in enumerate(train_dataset.take(train_steps)):
             print_loss = False
             if i % save_steps == 0:
@@ -233,19 +238,19 @@ class DataScheduler:
                 if plot_train:
                     if mtl:
                         predict_plot_mtl(model, train_dataset_plot, features_list, 250,
-                                     save_dir='{}/train_{}.png'.format(train_out_path, i))
+                                     save_dir='{}/train_{}.png'.format(train_out_path, i), batch_size=self.predict_batch_size)
                         predict_plot_mtl(model, eval_dataset_plot, features_list, 250,
-                                     save_dir='{}/eval_{}.png'.format(train_out_path, i))
+                                     save_dir='{}/eval_{}.png'.format(train_out_path, i), batch_size=self.predict_batch_size)
                     else:
                         predict_plot(model, train_dataset_plot, features_list, 250,
-                                     save_dir='{}/train_{}.png'.format(train_out_path, i))
+                                     save_dir='{}/train_{}.png'.format(train_out_path, i), batch_size=self.predict_batch_size)
                         predict_plot(model, eval_dataset_plot, features_list, 250,
-                                     save_dir='{}/eval_{}.png'.format(train_out_path, i))
+                                     save_dir='{}/eval_{}.png'.format(train_out_path, i), batch_size=self.predict_batch_size)
 
             if i % eval_steps == 0:
                 print_loss = True
                 if mtl:
-                    model.evaluate_mtl(eval_dataset, features_list, steps=50)
+                    model.evaluate_mtl(eval_dataset, steps=50)
                 else:
                     model.evaluate(eval_dataset, steps=20)
                 print("[t: {} / i: {}] min_eval_loss:{} / count:{}".format(self.base_idx, i, model.eval_loss, model.eval_count))
@@ -256,25 +261,8 @@ class DataScheduler:
                     break
 
             if mtl is True:
-                labels_mtl = {'ret': np.stack([labels[:, :, features_list.index('log_y')],
-                                                     labels[:, :, features_list.index('log_20y')],
-                                                     labels[:, :, features_list.index('log_60y')],
-                                                     labels[:, :, features_list.index('log_120y')]], axis=-1),
-                              'pos': (np.concatenate([labels[:, :, features_list.index('positive')].numpy() > 0,
-                                                      labels[:, :, features_list.index('positive')].numpy() <= 0], axis=1)
-                                      * 1.).reshape([-1, 1, 2]),
-                              'pos20': (np.concatenate([labels[:, :, features_list.index('positive20')].numpy() > 0,
-                                                      labels[:, :, features_list.index('positive20')].numpy() <= 0], axis=1)
-                                      * 1.).reshape([-1, 1, 2]),
-                              'std': np.stack([labels[:, :, features_list.index('std_20')],
-                                                     labels[:, :, features_list.index('std_60')],
-                                                     labels[:, :, features_list.index('std_120')]], axis=-1),
-                              'mdd': np.stack([labels[:, :, features_list.index('mdd_20')],
-                                                     labels[:, :, features_list.index('mdd_60')]], axis=-1),
-                              'fft': np.stack([labels[:, :, features_list.index('fft_3com')],
-                                               labels[:, :, features_list.index('fft_100com')]], axis=-1)}
-
-                model.train_mtl(features, labels_mtl, print_loss=print_loss)
+                # labels: mtl_label_fn 으로 만든 labels_mtl
+                model.train_mtl(features, labels, print_loss=print_loss)
             else:
                 model.train(features, labels, print_loss=print_loss)
 
@@ -313,8 +301,12 @@ class DataScheduler:
             # predict_plot_mtl_test(model, _dataset_list,  save_dir=save_file_name, ylog=ylog, eval_type='pos')
             # predict_plot_mtl_test(model, _dataset_list,  save_dir=save_file_name_ret, ylog=ylog, eval_type='ret')
             # predict_plot_mtl_test(model, _dataset_list,  save_dir=save_file_name_ir, ylog=ylog, eval_type='ir')
-            predict_plot_mtl_cross_section_test(model, _dataset_list,  save_dir=save_file_name, ylog=ylog, eval_type='pos')
-            predict_plot_mtl_cross_section_test(model, _dataset_list, save_dir=save_file_name_pos20, ylog=ylog, eval_type='pos20')
+            # 전체 날짜의 cross-section 예측은 한번만 (eval_type 별로 재사용)
+            predictions_list = None
+            if _dataset_list is not False:
+                predictions_list = predict_cross_sections(model, _dataset_list[0], _dataset_list[1], batch_size=self.predict_batch_size)
+            predict_plot_mtl_cross_section_test(model, _dataset_list,  save_dir=save_file_name, ylog=ylog, eval_type='pos', predictions_list=predictions_list)
+            predict_plot_mtl_cross_section_test(model, _dataset_list, save_dir=save_file_name_pos20, ylog=ylog, eval_type='pos20', predictions_list=predictions_list)
             # predict_plot_mtl_cross_section_test(model, _dataset_list,  save_dir=save_file_name_ret, ylog=ylog, eval_type='ret')
             # predict_plot_mtl_cross_section_test(model, _dataset_list,  save_dir=save_file_name_ir, ylog=ylog, eval_type='ir20')
 
@@ -322,8 +314,10 @@ class DataScheduler:
                 print('plot for all done. ')
                 return True
 
+        size = self.retrain_days // self.sampling_days
         dataset_list = list()
         features_list = list()
+        test_codes = list()
         for code_ in codes_list:
             _dataset = self._dataset('test', codes_list=[code_])
             if _dataset is False:
@@ -332,36 +326,41 @@ class DataScheduler:
                 input_enc, output_dec, target_dec, features_list, _, _ = _dataset
 
             assert np.sum(input_enc[:, -1, :] - output_dec[:, 0, :]) == 0
-            new_output = np.zeros_like(output_dec)
-            new_output[:, 0, :] = output_dec[:, 0, :]
-
-            if actor is not None:
-                # for t in range(self.max_seq_len_out):
-                #     if t > 0:
-                #         new_output[:, t, :] = obs[:, t - 1, :]
-                #     features_pred = {'input': input_enc, 'output': new_output}
-                #     obs = model.predict(features_pred)
-
-                test_dataset = dataset_process(input_enc, new_output, target_dec, batch_size=1, mode='test')
-
+            new_output = teacher_forcing_output(output_dec)
+
+            test_codes.append(code_)
+            dataset_list.append(({'input': input_enc[:size], 'output': new_output[:size]}, target_dec[:size]))
+
+        if len(dataset_list) == 0:
+            return dataset_list, features_list
+
+        if actor is not None:
+            # for t in range(self.max_seq_len_out):
+            #     if t > 0:
+            #         new_output[:, t, :] = obs[:, t - 1, :]
+            #     features_pred = {'input': input_enc, 'output': new_output}
+            #     obs = model.predict(features_pred)
+            for code_, (features, target_dec) in zip(test_codes, dataset_list):
+                test_dataset = dataset_process(features['input'], features['output'], target_dec, batch_size=1, mode='test')
                 predict_plot_with_actor(model, actor, test_dataset, features_list,
-                             size=self.retrain_days // self.sampling_days,
+                             size=size,
                              save_dir='{}/actor_{}.png'.format(test_out_path, code_))
+            return dataset_list, features_list
+
+        # 전체 종목의 test 구간을 큰 batch 로 한번에 예측하고 종목별로 나눠서 그린다.
+        predictions = predict_in_batches(model.predict_mtl if mtl else model.predict,
+                                         np.concatenate([features['input'] for features, _ in dataset_list], axis=0),
+                                         np.concatenate([features['output'] for features, _ in dataset_list], axis=0),
+                                         batch_size=self.predict_batch_size)
+        predictions_list = split_predictions(predictions, [len(target_dec) for _, target_dec in dataset_list])
+        for code_, (_, target_dec), predictions_code in zip(test_codes, dataset_list, predictions_list):
+            if mtl:
+                plot_predictions_mtl(predictions_code, target_dec, features_list,
+                                     save_dir='{}/{}.png'.format(test_out_path, code_))
             else:
-
-                test_dataset = dataset_process(input_enc, new_output, target_dec, batch_size=1, mode='test')
-                # test_dataset = dataset_process(input_enc, output_dec, target_dec, batch_size=1, mode='test')
-
-                if mtl:
-                    predict_plot_mtl(model, test_dataset, features_list,
-                                 size=self.retrain_days // self.sampling_days,
-                                 save_dir='{}/{}.png'.format(test_out_path, code_))
-                else:
-                    predict_plot(model, test_dataset, features_list,
-                                 size=self.retrain_days // self.sampling_days,
+                plot_predictions(predictions_code, target_dec, features_list,
                                  save_dir='{}/{}.png'.format(test_out_path, code_))
 
-            dataset_list.append(test_dataset)
         return dataset_list, features_list
 
     def train_tickers(self,
@@ -436,20 +435,52 @@ class DataScheduler:
             return False
 
 
+def read_cum_y(data_path):
+    data_df = pd.read_csv(data_path)
+    data_df = data_df[data_df.infocode > 0]  # null 제거
+    data_df['y'] = data_df['y'] + 1
+    data_df['cum_y'] = data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
+    return data_df
+
+
+def pivot_cum_y(data_df):
+    df_pivoted = data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
+    df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
+    return df_pivoted
+
+
+def load_stock_panel(data_path, code_path, eval_d):
+    # eval_d 기준 유니버스의 [date x infocode] 누적수익률 (panel_cache 에서 한번만 실행된다.)
+    data_df = read_cum_y(data_path)
+
+    data_code = pd.read_csv(code_path)
+    codes = list(data_code[data_code.eval_d == eval_d]['infocode'].to_numpy(dtype=np.int32))
+
+    df_pivoted = pivot_cum_y(data_df)
+    return {'cum_y': df_pivoted[np.sum(~df_pivoted.isna(), axis=1) >= 10][codes]}  # 최소 10종목 이상 존재 하는 날짜만
+
+
+def load_dynamic_frames(data_path, code_path):
+    data_df = read_cum_y(data_path)
+    return {'cum_y': pivot_cum_y(data_df),
+            'date_': pd.DataFrame({'date_': data_df['date_'].unique()}),
+            'data_code': pd.read_csv(code_path)}
+
+
 class DataGeneratorDynamic:
-    def __init__(self, data_type='kr_stock'):
+    def __init__(self, data_type='kr_stock', panel_cache_dir=DEFAULT_CACHE_DIR):
         if data_type == 'kr_stock':
             data_path = './data/kr_close_y.csv'
-            data_df = pd.read_csv(data_path)
-            self.data_df = data_df[data_df.infocode > 0]  # null 제거
-            self.data_df['y'] = self.data_df['y'] + 1
-            self.data_df['cum_y'] = self.data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
-
-            self.data_code = pd.read_csv('./data/kr_sizeinfo.csv')
+            code_path = './data/kr_sizeinfo.csv'
+            frames = cached_frames('dynamic_kr_stock', [data_path, code_path],
+                                   lambda: load_dynamic_frames(data_path, code_path),
+                                   cache_dir=panel_cache_dir)
+            self.df_pivoted_all = frames['cum_y']
+            self.data_code = frames['data_code']
 
             self.univ_idx = -1
 
-        self.date_ = list(self.data_df['date_'].unique())
+        self.date_ = list(frames['date_']['date_'])
 
     def _set_df_pivoted(self, univ_idx):
         if self.univ_idx != univ_idx:
@@ -458,8 +489,7 @@ class DataGeneratorDynamic:
 
             kr_codes = list(self.data_code[self.data_code.eval_d == self.date_[univ_idx]]['infocode'].to_numpy(dtype=np.int32))
 
-            df_pivoted = self.data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
-            df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
+            df_pivoted = self.df_pivoted_all
             self.df_pivoted = df_pivoted[np.sum(~df_pivoted.isna(), axis=1) >= 10][kr_codes]  # 최소 10종목 이상 존재 하는 날짜만
 
     def sample_inputdata(self, base_idx, codes_list=None, sampling_days=5, m_days=60, k_days=20,
@@ -527,24 +557,18 @@ class DataGeneratorDynamic:
 
 class DataGenerator:
     # v3: korea stocks data with fft
-    def __init__(self, data_type='kr_stock'):
+    def __init__(self, data_type='kr_stock', use_feature_cube=False, cube_dir=None, panel_cache_dir=DEFAULT_CACHE_DIR):
         if data_type == 'kr_stock':
             # data_path = './data/kr_close_.csv'
             # data_df = pd.read_csv(data_path, index_col=0)
             # self.df_pivoted = data_df[np.sum(~data_df.isna(), axis=1) >= 10]  # 최소 10종목 이상 존재 하는 날짜만
 
             data_path = './data/kr_close_y.csv'
-            data_df = pd.read_csv(data_path)
-            data_df = data_df[data_df.infocode > 0]
-            data_df['y'] = data_df['y'] + 1
-            data_df['cum_y'] = data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
-
-            data_kr_code = pd.read_csv('./data/kr_sizeinfo.csv')
-            kr_codes = list(data_kr_code[data_kr_code.eval_d == '2005-12-31']['infocode'].to_numpy(dtype=np.int32))
-
-            df_pivoted = data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
-            df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
-            self.df_pivoted = df_pivoted[np.sum(~df_pivoted.isna(), axis=1) >= 10][kr_codes]  # 최소 10종목 이상 존재 하는 날짜만
+            code_path = './data/kr_sizeinfo.csv'
+            frames = cached_frames('kr_stock', [data_path, code_path],
+                                   lambda: load_stock_panel(data_path, code_path, '2005-12-31'),
+                                   cache_dir=panel_cache_dir)
+            self.df_pivoted = frames['cum_y']
         elif data_type == 'kr_factor':
             data_path = './data/data_for_metarl.csv'
             data_df = pd.read_csv(data_path, index_col=0)
@@ -556,59 +580,72 @@ class DataGenerator:
             self.df_pivoted.columns = self.df_pivoted.columns.droplevel(0)
         elif data_type == 'us_stock':
             data_path = './data/us_close_y.csv'
-            data_df = pd.read_csv(data_path)
-            data_df = data_df[data_df.infocode > 0]
-            data_df['y'] = data_df['y'] + 1
-            data_df['cum_y'] = data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
-
-            data_us_code = pd.read_csv('./data/us_sizeinfo.csv')
-            us_codes = list(data_us_code[data_us_code.eval_d == '1999-12-31']['infocode'].to_numpy(dtype=np.int32))
-
-            df_pivoted = data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
-            df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
-            self.df_pivoted = df_pivoted[np.sum(~df_pivoted.isna(), axis=1) >= 10][us_codes]  # 최소 10종목 이상 존재 하는 날짜만
+            code_path = './data/us_sizeinfo.csv'
+            frames = cached_frames('us_stock', [data_path, code_path],
+                                   lambda: load_stock_panel(data_path, code_path, '1999-12-31'),
+                                   cache_dir=panel_cache_dir)
+            self.df_pivoted = frames['cum_y']
         else:
             print('data_type: [kr_stock, kr_factor, bb_index]')
             raise NotImplementedError
 
         self.date_ = list(self.df_pivoted.index)
 
-    def get_full_dataset(self, start_d, end_d):
-        df_selected = self.df_pivoted[(self.df_pivoted.index > start_d) & (self.df_pivoted.index <= end_d)]
-        df_selected = df_selected.ix[:, np.sum(~df_selected.isna(), axis=0) >= len(df_selected.index) * 0.9]  # 90% 이상 데이터 존재
-        df_selected.ffill(axis=0, inplace=True)   # 먼저 중간 na 처리
-        df_selected.bfill(axis=0, inplace=True)   # 이후 맨 앞의 NA 처리
-        return df_selected
+        # 윈도우 정제용 (유효값 누적 개수, 이전/다음 유효 행)
+        self.panel_windows = PanelWindows(self.df_pivoted.values)
 
-    def sample_inputdata(self, base_idx, codes_list=None, sampling_days=5, m_days=60, k_days=20,
-                         max_seq_len_in=12,
-                         max_seq_len_out=4,
-                         balance_class=True,
-                         **kwargs):
+        # 전체 기간 feature 를 한번만 계산해두고 sample_inputdata 에서는 잘라서 쓴다.
+        self.feature_cube = None
+        if use_feature_cube:
+            self.feature_cube = FeatureCube(self.df_pivoted.values, CUBE_SPECS, cache_dir=cube_dir)
 
-        df_selected = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx-m_days])
-                                      & (self.df_pivoted.index <= self.date_[base_idx+k_days])]
-        df_not_null = df_selected.ix[:, np.sum(~df_selected.isna(), axis=0) >= len(df_selected.index) * 0.9]  # 90% 이상 데이터 존재
-        df_not_null.ffill(axis=0, inplace=True)
-        df_not_null.bfill(axis=0, inplace=True)
-        df_not_null = df_not_null.ix[:, np.sum(df_not_null.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+    def get_full_dataset(self, start_d, end_d):
+        rows = np.where((self.df_pivoted.index > start_d) & (self.df_pivoted.index <= end_d))[0]
+        if len(rows) == 0:
+            return self.df_pivoted.iloc[0:0]
+
+        start_idx, end_idx = rows[0], rows[-1]
+        col_idx = self.panel_windows.covered(start_idx, end_idx)  # 90% 이상 데이터 존재
+        values = self.panel_windows.fill(start_idx, end_idx, col_idx)   # 중간 na 는 ffill, 맨 앞의 NA 는 bfill
+        return pd.DataFrame(values, index=self.df_pivoted.index[start_idx:(end_idx + 1)], columns=self.df_pivoted.columns[col_idx])
+
+    def _clean_window(self, start_idx, end_idx, codes_list=None):
+        # 90% 이상 데이터 존재 종목 -> ffill -> bfill -> 맨 앞쪽 NA 종목 제거 (numpy, pandas 정제와 같은 결과)
+        # 데이터 끝을 넘는 window 는 잘라서 쓰지 않고 샘플을 만들지 않는다.
+        if end_idx >= len(self.panel_windows):
+            return False
+        col_idx, prices = self.panel_windows.clean(start_idx, end_idx)
 
         if codes_list is not None:
             assert type(codes_list) == list
-            codes_exist = []
-            for code in codes_list:
-                if code in df_not_null.columns:
-                    codes_exist.append(code)
+            col_pos = dict(zip(self.df_pivoted.columns[col_idx], range(len(col_idx))))
+            selected = [col_pos[code] for code in codes_list if code in col_pos]
 
-            if len(codes_exist) >= 1:
-                df_not_null = df_not_null[codes_exist]
+            if len(selected) >= 1:
+                col_idx, prices = col_idx[selected], prices[:, selected]
             else:
                 return False
 
-        if df_not_null.empty:
+        if prices.size == 0:
             return False
 
-        features_list, features_data = processing(df_not_null, m_days=m_days)
+        return col_idx, prices
+
+    def sample_inputdata(self, base_idx, codes_list=None, sampling_days=5, m_days=60, k_days=20,
+                         max_seq_len_in=12,
+                         max_seq_len_out=4,
+                         balance_class=True,
+                         **kwargs):
+
+        start_idx, end_idx = base_idx - m_days, base_idx + k_days
+        cleaned = self._clean_window(start_idx, end_idx, codes_list)
+        if cleaned is False:
+            return False
+        col_idx, prices = cleaned
+
+        log_p = np.log(prices, dtype=np.float32)
+        cube_view = None if self.feature_cube is None else self.feature_cube.view(start_idx, col_idx)
+        features_list, features_data = processing_log_p(log_p, m_days, cube_view=cube_view)
 
         assert features_data.shape[0] == m_days + k_days + 1
 
@@ -984,19 +1021,14 @@ class DataGenerator_v1:
 
 
 def std_arr(arr_x, n):
-    stdarr = np.zeros_like(arr_x)
-    for t in range(1, len(arr_x)):
-        stdarr[t] = np.std(arr_x[max(0, t-n):(t+1)])
+    stdarr = rolling_std(arr_x, n)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def mdd_arr(logcumarr_x, n):
-    mddarr = np.zeros_like(logcumarr_x)
-    for t in range(len(logcumarr_x)):
-        mddarr[t] = logcumarr_x[t] - np.max(logcumarr_x[max(0, t-n):(t+1)])
-
-    return mddarr
+    return drawdown(logcumarr_x, n)
 
 
 def load_data(data_path, name='kospi', token_length=5):
@@ -1056,8 +1088,35 @@ def rearrange(input, output, target):
     return features, target
 
 
+# multi-task 라벨: {key: features_list 이름 목록} (pos 류는 [x > 0, x <= 0] 2 class)
+MTL_LABELS = {'ret': ['log_y', 'log_20y', 'log_60y', 'log_120y'],
+              'pos': ['positive'],
+              'pos20': ['positive20'],
+              'std': ['std_20', 'std_60', 'std_120'],
+              'mdd': ['mdd_20', 'mdd_60'],
+              'fft': ['fft_3com', 'fft_100com']}
+MTL_CLASS_LABELS = ['pos', 'pos20']
+
+
+def mtl_label_fn(features_list):
+    # features_list 에서 라벨 위치는 한번만 찾아두고 dataset.map 에서 batch 단위로 gather 한다.
+    label_idx = {key: [features_list.index(nm) for nm in names] for key, names in MTL_LABELS.items()}
+
+    def to_labels_mtl(features, labels):
+        labels_mtl = dict()
+        for key, idx in label_idx.items():
+            if key in MTL_CLASS_LABELS:
+                x = labels[:, :, idx[0]]
+                labels_mtl[key] = tf.reshape(tf.cast(tf.concat([x > 0, x <= 0], axis=1), tf.float32), [-1, 1, 2])
+            else:
+                labels_mtl[key] = tf.gather(labels, idx, axis=-1)
+        return features, labels_mtl
+
+    return to_labels_mtl
+
+
 # 학습에 들어가 배치 데이터를 만드는 함수이다.
-def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_size, mode='train'):
+def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_size, mode='train', label_fn=None):
     # Dataset을 생성하는 부분으로써 from_tensor_slices부분은
     # 각각 한 문장으로 자른다고 보면 된다.
     # train_input_enc, train_output_dec, train_target_dec
@@ -1074,12 +1133,16 @@ def dataset_process(train_input_enc, train_output_dec, train_target_dec, batch_s
     # 데이터 각 요소에 대해서 rearrange 함수를
     # 통해서 요소를 변환하여 맵으로 구성한다.
     dataset = dataset.map(rearrange)
+    # label_fn (ex. mtl_label_fn) 이 있으면 라벨도 여기서 만든다.
+    if label_fn is not None:
+        dataset = dataset.map(label_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
     # repeat()함수에 원하는 에포크 수를 넣을수 있으면
     # 아무 인자도 없다면 무한으로 이터레이터 된다.
     if batch_size == 1:
         dataset = dataset.repeat(1)
     else:
         dataset = dataset.repeat()
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     # make_one_shot_iterator를 통해 이터레이터를
     # 만들어 준다.
     # 이터레이터를 통해 다음 항목의 텐서
@@ -0,0 +1,180 @@
+"""On-disk LRU cache of materialized datasets.
+
+``DatasetCache.get(key, build_fn)`` returns ``build_fn()`` and stores it under
+``cache_dir/<sha1 of key>/``: every array of the (nested tuple / list / dict)
+result is written to one ``data.bin`` blob, aligned to ``ALIGNMENT`` bytes,
+and ``index.json`` keeps the structure and the offsets. A hit opens the blob
+once as a read-only memmap and hands out zero-copy views, so a rerun (or
+another sweep combination with the same key) skips the sampling entirely.
+
+``key`` must hold everything the result depends on (mode, index range, data
+parameters, feature structure, source fingerprint, ...). Entries are evicted
+least recently used first when the cache grows over ``max_bytes``.
+Random draws inside ``build_fn`` (class balancing, oversampling) are replayed
+from the cache, so only use it when they are seeded and the seed is part of
+``key``.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+ALIGNMENT = 64
+INDEX_NAME = 'index.json'
+BLOB_NAME = 'data.bin'
+VERSION = 1
+
+
+def cache_key(key):
+    return hashlib.sha1(json.dumps({'version': VERSION, 'key': key}, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _encode(value, tensors):
+    # 중첩된 tuple / list / dict 구조는 json으로, array는 tensors 목록으로 분리한다.
+    if isinstance(value, dict):
+        return {'type': 'dict', 'items': [[_encode(k, tensors), _encode(v, tensors)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return {'type': type(value).__name__, 'items': [_encode(v, tensors) for v in value]}
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            raise TypeError('object array can not be cached')
+        tensors.append(np.ascontiguousarray(value))
+        return {'type': 'array', 'index': len(tensors) - 1}
+    if isinstance(value, np.generic):
+        return {'type': 'scalar', 'dtype': value.dtype.str, 'value': value.item()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return {'type': 'value', 'value': value}
+    raise TypeError('{} can not be cached'.format(type(value)))
+
+
+def _decode(spec, arrays):
+    if spec['type'] == 'dict':
+        return {_decode(k, arrays): _decode(v, arrays) for k, v in spec['items']}
+    if spec['type'] == 'list':
+        return [_decode(v, arrays) for v in spec['items']]
+    if spec['type'] == 'tuple':
+        return tuple(_decode(v, arrays) for v in spec['items'])
+    if spec['type'] == 'array':
+        return arrays[spec['index']]
+    if spec['type'] == 'scalar':
+        return np.array(spec['value'], dtype=np.dtype(spec['dtype']))[()]
+    return spec['value']
+
+
+def _write_blob(f, tensors):
+    entries = []
+    offset = 0
+    for arr in tensors:
+        pad = (-offset) % ALIGNMENT
+        if pad:
+            f.write(b'\0' * pad)
+            offset += pad
+        f.write(arr.tobytes())
+        entries.append({'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset})
+        offset += arr.nbytes
+    return entries, offset
+
+
+def _read_blob(path, entries):
+    if os.path.getsize(path) == 0:
+        blob = np.zeros([0], dtype=np.uint8)
+    else:
+        blob = np.memmap(path, dtype=np.uint8, mode='r')
+
+    arrays = []
+    for e in entries:
+        dtype = np.dtype(e['dtype'])
+        nbytes = int(np.prod(e['shape'], dtype=np.int64)) * dtype.itemsize
+        arrays.append(blob[e['offset']:(e['offset'] + nbytes)].view(dtype).reshape(e['shape']))
+    return arrays
+
+
+class DatasetCache:
+    """Size-bounded (``max_bytes``) LRU cache of dataset builds under ``cache_dir``."""
+    def __init__(self, cache_dir, max_bytes=20 * (1 << 30)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _entries(self):
+        # (마지막 사용 시각, 크기, 경로)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            index_path = os.path.join(self.cache_dir, name, INDEX_NAME)
+            if not os.path.exists(index_path):
+                continue
+            with open(index_path, 'r') as f:
+                nbytes = json.load(f)['nbytes']
+            entries.append((os.path.getmtime(index_path), nbytes, os.path.join(self.cache_dir, name)))
+        return entries
+
+    def _evict(self, keep_path):
+        entries = sorted(self._entries())
+        total = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep_path:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= nbytes
+
+    def _load(self, path):
+        index_path = os.path.join(path, INDEX_NAME)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        if index.get('version') != VERSION:
+            return False, None
+
+        # 마지막 사용 시각 (LRU)
+        os.utime(index_path, None)
+        arrays = _read_blob(os.path.join(path, BLOB_NAME), index['tensors'])
+        return True, _decode(index['structure'], arrays)
+
+    def _save(self, path, value):
+        tensors = []
+        structure = _encode(value, tensors)
+
+        # 임시 디렉토리에 다 쓴 후 교체한다.
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            with open(os.path.join(tmp_path, BLOB_NAME), 'wb') as f:
+                entries, nbytes = _write_blob(f, tensors)
+            index = {'version': VERSION, 'structure': structure, 'tensors': entries, 'nbytes': nbytes,
+                     'created': time.time()}
+            with open(os.path.join(tmp_path, INDEX_NAME), 'w') as f:
+                json.dump(index, f)
+        except BaseException:
+            # (ex. json 으로 저장할 수 없는 값) 임시 디렉토리를 남기지 않는다.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # 다른 프로세스가 먼저 만든 경우
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def get(self, key, build_fn):
+        """``build_fn()``, served from the cache when an entry for ``key`` exists."""
+        path = os.path.join(self.cache_dir, cache_key(key))
+        if os.path.exists(os.path.join(path, INDEX_NAME)):
+            found, value = self._load(path)
+            if found:
+                return value
+
+        value = build_fn()
+        try:
+            self._save(path, value)
+        except TypeError as e:
+            print('[dataset_cache] not cached: {}'.format(e))
+            return value
+
+        self._evict(keep_path=path)
+        return value
@@ -0,0 +1,129 @@
+"""Full-history feature cube so sampled windows become slices.
+
+A sampled window rebases ``log_p - log_p[0]`` and starts every rolling window
+at its first row, so a causal feature (row t only uses rows <= t) only depends
+on the window origin for its first ``lookback`` rows (``n`` for ``log_y_nd``,
+``n + 1`` for ``std_nd``, ...). After that it is equal to the same feature
+computed once on the whole price history.
+
+``FeatureCube`` computes those features once per price panel (``[dates x
+assets]``, NaN = missing) and keeps them as memory-mapped ``.npy`` files under
+``cache_dir/<panel hash>/`` when ``cache_dir`` is given. ``FeatureCubeView.get``
+serves a window by slicing the cube and recomputing only the first
+``lookback`` rows from the window itself. Window dependent features (fft,
+cross-asset mdd, cross-sectional ranks, ...) are still computed by the caller.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from timeseries.window_clean import last_valid_index
+
+MANIFEST_NAME = 'manifest.json'
+VERSION = 2
+
+
+def _save_atomic(path, arr):
+    tmp_path = '{}.tmp{}.npy'.format(path[:-4], os.getpid())
+    np.save(tmp_path, arr)
+    os.replace(tmp_path, path)
+
+
+def panel_key(prices, specs):
+    h = hashlib.sha1()
+    h.update(json.dumps({'version': VERSION, 'shape': list(prices.shape), 'dtype': prices.dtype.str,
+                         'specs': sorted([name, lookback] for name, (_, lookback) in specs.items())}).encode('utf-8'))
+    h.update(np.ascontiguousarray(prices).tobytes())
+    return h.hexdigest()
+
+
+class FeatureCube:
+    """Rolling features of a whole price panel.
+
+    prices: [T x N] array of prices (NaN = missing).
+    specs: {name: (fn, lookback)}. ``fn(log_p)`` is a causal feature of a
+        [length x assets] log price array and ``lookback`` the number of
+        leading rows that depend on the window origin.
+    """
+    def __init__(self, prices, specs, cache_dir=None):
+        prices = np.asarray(prices)
+        assert prices.ndim == 2
+        self.specs = specs
+        self.key = panel_key(prices, specs)
+
+        path = None if cache_dir is None else os.path.join(cache_dir, self.key)
+        if path is not None and os.path.exists(os.path.join(path, MANIFEST_NAME)):
+            arrays = self._load(path)
+        else:
+            arrays = self._build(prices)
+            if path is not None:
+                self._save(path, arrays)
+                arrays = self._load(path)
+
+        self.last_valid = arrays.pop('last_valid')
+        self.features = arrays
+
+    def _build(self, prices):
+        log_p = np.log(prices, dtype=np.float32)
+
+        # 전체 이력 기준 ffill (유효 여부는 window_clean 과 같이 원래 가격의 NaN 기준)
+        last_valid = last_valid_index(~np.isnan(prices))
+        log_p = np.take_along_axis(log_p, np.maximum(last_valid, 0), axis=0)
+        log_p[last_valid < 0] = np.nan
+
+        arrays = {'last_valid': last_valid}
+        for name, (fn, _) in self.specs.items():
+            arrays[name] = np.asarray(fn(log_p))
+        return arrays
+
+    def _save(self, path, arrays):
+        os.makedirs(path, exist_ok=True)
+        for name, arr in arrays.items():
+            _save_atomic(os.path.join(path, '{}.npy'.format(name)), arr)
+
+        manifest = {'version': VERSION, 'arrays': sorted(arrays.keys())}
+        tmp_path = os.path.join(path, '{}.tmp{}'.format(MANIFEST_NAME, os.getpid()))
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+
+    def _load(self, path):
+        with open(os.path.join(path, MANIFEST_NAME), 'r') as f:
+            manifest = json.load(f)
+        return {name: np.load(os.path.join(path, '{}.npy'.format(name)), mmap_mode='r')
+                for name in manifest['arrays']}
+
+    def __len__(self):
+        return len(self.last_valid)
+
+    def view(self, start, col_idx):
+        return FeatureCubeView(self, start, col_idx)
+
+
+class FeatureCubeView:
+    """Features of the window starting at row ``start`` for the assets ``col_idx``."""
+    def __init__(self, cube, start, col_idx):
+        self.cube = cube
+        self.start = start
+        self.col_idx = np.asarray(col_idx)
+        # 윈도우 첫 행에 값이 있는 종목만 전체 이력 ffill 값과 윈도우 ffill/bfill 값이 같다.
+        self.clean = np.asarray(cube.last_valid[start, self.col_idx]) == start
+
+    def get(self, name, log_p):
+        """Same as ``fn(log_p)`` for the window log prices ``log_p`` (rebased or not)."""
+        fn, lookback = self.cube.specs[name]
+        length = len(log_p)
+        head = min(lookback, length)
+        assert self.start + length <= len(self.cube)
+
+        cached = self.cube.features[name]
+        out = np.empty(log_p.shape, dtype=cached.dtype)
+        out[:head] = fn(log_p[:head])
+        out[head:] = cached[(self.start + head):(self.start + length), self.col_idx]
+        if not self.clean.all():
+            out[:, ~self.clean] = fn(log_p[:, ~self.clean])
+
+        return out
@@ -1,8 +1,12 @@
 
+import functools
+
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
+from timeseries.rolling import rolling_std, rolling_max
+
 # data_path = './data/kr_close_.csv'
 # data_df = pd.read_csv(data_path, index_col=0)
 # df =data_df
@@ -23,19 +27,30 @@ def fft(log_p, n, m_days):
 
 def std_nd(log_p, n):
     y = np.exp(log_y_nd(log_p, 1)) - 1.
-    stdarr = np.zeros_like(y)
-    for t in range(1, len(y)):
-        stdarr[t, :] = np.std(y[max(0, t - n):(t + 1), :], axis=0)
+    stdarr = rolling_std(y, n)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def mdd_nd(log_p, n):
-    mddarr = np.zeros_like(log_p)
-    for t in range(len(log_p)):
-        mddarr[t, :] = log_p[t, :] - np.max(log_p[max(0, t - n):(t + 1), :])
+    # 윈도우 안의 전체 종목 최대값 기준 (종목별 최대값이 아님)
+    return log_p - rolling_max(np.max(log_p, axis=1), n)[:, np.newaxis]
+
+
+# 윈도우 원점과 무관한 feature: {name: (fn, lookback)} (timeseries.feature_cube 참고)
+CUBE_SPECS = dict()
+for _n in [5, 20, 60, 120]:
+    CUBE_SPECS['log_y_{}'.format(_n)] = (functools.partial(log_y_nd, n=_n), _n)
+for _n in [20, 60, 120]:
+    CUBE_SPECS['std_{}'.format(_n)] = (functools.partial(std_nd, n=_n), _n + 1)
 
-    return mddarr
+
+def _cube_feature(cube_view, name, log_p):
+    if cube_view is None:
+        fn, _ = CUBE_SPECS[name]
+        return fn(log_p)
+    return cube_view.get(name, log_p)
 
 
 def processing(df_not_null, m_days):
@@ -43,21 +58,26 @@ def processing(df_not_null, m_days):
     #     df.columns = df.columns.droplevel(0)
 
     log_p = np.log(df_not_null.values, dtype=np.float32)
+    return processing_log_p(log_p, m_days)
+
+
+def processing_log_p(log_p, m_days, cube_view=None):
+    # cube_view: FeatureCubeView 가 주어지면 CUBE_SPECS 의 feature 는 미리 계산된 값을 잘라서 쓴다.
     log_p = log_p - log_p[0, :]
 
-    log_5y = log_y_nd(log_p, 5)
-    log_20y = log_y_nd(log_p, 20)
-    log_60y = log_y_nd(log_p, 60)
-    log_120y = log_y_nd(log_p, 120)
+    log_5y = _cube_feature(cube_view, 'log_y_5', log_p)
+    log_20y = _cube_feature(cube_view, 'log_y_20', log_p)
+    log_60y = _cube_feature(cube_view, 'log_y_60', log_p)
+    log_120y = _cube_feature(cube_view, 'log_y_120', log_p)
     # log_240y = log_y_nd(log_p, 240)
 
     fft_3com = fft(log_p, 3, m_days)
     fft_6com = fft(log_p, 6, m_days)
     fft_100com = fft(log_p, 100, m_days)
 
-    std_20 = std_nd(log_p, 20)
-    std_60 = std_nd(log_p, 60)
-    std_120 = std_nd(log_p, 120)
+    std_20 = _cube_feature(cube_view, 'std_20', log_p)
+    std_60 = _cube_feature(cube_view, 'std_60', log_p)
+    std_120 = _cube_feature(cube_view, 'std_120', log_p)
 
     mdd_20 = mdd_nd(log_p, 20)
     mdd_60 = mdd_nd(log_p, 60)
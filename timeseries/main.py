@@ -5,6 +5,8 @@ from timeseries.model import TSModel
 from timeseries.data_process import dataset_process, load_data, DataGenerator, DataScheduler
 
 from timeseries.rl import MyEnv, PPO
+from tf_additional.checkpoint import checkpoint_exists
+from timeseries.walk_forward import scheduler_windows, set_window, model_path, run_walk_forward
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -35,7 +37,7 @@ def main_all_asset_dataprocess_modified():
         while not ds.done:
             model = TSModel(configs)
             configs.f_name = 'ts_model_test1.4'
-            if os.path.exists(configs.f_name):
+            if checkpoint_exists(configs.f_name):
                 model.load_model(configs.f_name)
 
             # ds.set_idx(3000)
@@ -80,6 +82,53 @@ def main_all_asset_dataprocess_modified():
                 break
 
 
+def setup_walk_forward():
+    # walk forward worker 마다 한번: 데이터는 panel cache memmap 으로 공유된다.
+    configs = Config()
+    configs.f_name = 'ts_model_wf'
+    ds = DataScheduler(configs)
+    return configs, ds
+
+
+def train_test_window(context, window, window_dir, init_model):
+    configs, ds = context
+    set_window(ds, window)
+    ds.data_out_path = window_dir
+
+    model = TSModel(configs)
+    if init_model is not None:
+        model.load_model(init_model)
+
+    is_trained = ds.train(model,
+                          train_steps=configs.train_steps,
+                          eval_steps=10,
+                          save_steps=50,
+                          early_stopping_count=5,
+                          model_name=model_path(window_dir))
+    if is_trained is False:
+        return {'trained': False}
+
+    model.weight_to_optim()
+    model.save_model(model_path(window_dir))
+    ds.test(model, out_dir=os.path.join(window_dir, 'test'), each_plot=False)
+    return {'trained': True, 'eval_loss': float(model.eval_loss)}
+
+
+def main_walk_forward():
+    configs = Config()
+    # worker 들이 읽을 panel cache 는 여기서 먼저 만들어진다.
+    ds = DataScheduler(configs)
+    ds.set_idx(4000)
+
+    out_dir = os.path.join(ds.data_out_path, 'ts_model_wf')
+    scores = run_walk_forward(setup_walk_forward, train_test_window, scheduler_windows(ds), out_dir,
+                              n_workers=configs.n_walk_forward_workers,
+                              threads_per_worker=configs.walk_forward_threads,
+                              warm_start=configs.warm_start,
+                              pipeline_depth=configs.pipeline_depth)
+    print(scores)
+
+
 def main_all_asset():
     configs = Config()
 
@@ -88,7 +137,7 @@ def main_all_asset():
 
     # initiate and load model
     model = TSModel(configs)
-    if os.path.exists(configs.f_name):
+    if checkpoint_exists(configs.f_name):
         model.load_model(configs.f_name)
 
     # get data for all assets and dates
@@ -186,7 +235,7 @@ def main_single_asset():
     dataset_eval = dataset_process(eval_input_enc, eval_output_dec, eval_target_dec, 1, mode='test')
 
     model = TSModel(configs)
-    if os.path.exists(configs.f_name):
+    if checkpoint_exists(configs.f_name):
         model.load_model(configs.f_name)
 
     for i, (features, labels) in enumerate(dataset_train.take(configs.train_steps)):
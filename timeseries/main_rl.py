@@ -3,6 +3,7 @@ from timeseries.config import Config
 from timeseries.model import TSModel
 from timeseries.data_process import dataset_process, load_data, DataGenerator, DataScheduler
 from timeseries.rl import MyEnv, MyActor, PPO
+from tf_additional.checkpoint import checkpoint_exists
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -70,7 +71,7 @@ def main():
     for _ in range(1):
         model = TSModel(configs)
         configs.f_name = 'ts_model_test1.3'
-        if os.path.exists(configs.f_name):
+        if checkpoint_exists(configs.f_name):
             model.load_model(configs.f_name)
 
         ds.set_idx(5750)
@@ -92,7 +93,7 @@ def main():
 
         ppo = PPO(env)
         f_name = './{}.pkl'.format('actor_v1.0_new3')
-        if os.path.exists(f_name):
+        if checkpoint_exists(f_name):
             ppo.load_model(f_name)
 
         EP_MAX = 100000
@@ -0,0 +1,229 @@
+"""Columnar binary cache for the raw data frames loaded by the data generators.
+
+``cached_frames(name, source_paths, build_fn)`` runs the (slow) csv parsing /
+cumprod / pivot in ``build_fn`` once and stores every resulting DataFrame
+under ``cache_dir/<name>/``:
+
+- ``'panel'`` frames (numeric ``[dates x codes]``): one ``values.npy`` opened
+  as a read-only memmap, plus ``index.npy`` / ``columns.npy``;
+- ``'table'`` frames (long format): one ``.npy`` per column.
+
+``manifest.json`` records the sha1 (and size / mtime, to skip re-hashing
+unchanged files) of every source file. The cache is rebuilt when a source
+changes.
+
+Every build is written to a new ``cache_dir/<name>/build_<stamp>/`` directory
+and published by atomically replacing the ``current.json`` pointer, so readers
+in other processes (dataset / walk forward workers) never see a half written
+or removed build. Rebuilds are serialized with a file lock next to the cache
+directory; a process that waited on the lock reuses the build made meanwhile.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # windows: lock 없이 (pointer 교체만으로) 동작
+    fcntl = None
+
+DEFAULT_CACHE_DIR = './data/panel_cache/'
+MANIFEST_NAME = 'manifest.json'
+POINTER_NAME = 'current.json'
+BUILD_PREFIX = 'build_'
+VERSION = 2
+
+
+def file_hash(path, chunk_size=1 << 24):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _to_array(values):
+    arr = np.asarray(values)
+    if arr.dtype == object:
+        # object(문자열) 컬럼은 pickle 없이 저장되도록 고정 길이 unicode 로 바꾼다.
+        arr = arr.astype(str)
+    return arr
+
+
+def _save(path, arr):
+    tmp_path = '{}.tmp{}.npy'.format(path[:-4], os.getpid())
+    np.save(tmp_path, _to_array(arr))
+    os.replace(tmp_path, path)
+
+
+def _frame_kind(df):
+    if len(df.dtypes.unique()) == 1 and np.issubdtype(df.dtypes.iloc[0], np.number):
+        return 'panel'
+    return 'table'
+
+
+def _source_info(paths, old_sources=None):
+    old_sources = old_sources or dict()
+    sources = dict()
+    for path in paths:
+        stat = os.stat(path)
+        old = old_sources.get(path)
+        if old is not None and old['size'] == stat.st_size and old['mtime_ns'] == stat.st_mtime_ns:
+            sha1 = old['sha1']
+        else:
+            sha1 = file_hash(path)
+        sources[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha1}
+    return sources
+
+
+def _is_valid(manifest, sources):
+    if manifest is None or manifest.get('version') != VERSION:
+        return False
+    old = manifest['sources']
+    return set(old.keys()) == set(sources.keys()) and all(old[k]['sha1'] == v['sha1'] for k, v in sources.items())
+
+
+@contextmanager
+def _build_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _current_build(path):
+    # current.json 이 가리키는 build 디렉토리 (없으면 None)
+    pointer_path = os.path.join(path, POINTER_NAME)
+    if not os.path.exists(pointer_path):
+        return None
+    with open(pointer_path, 'r') as f:
+        return os.path.join(path, json.load(f)['build'])
+
+
+def _read_manifest(path):
+    if path is None:
+        return None
+    manifest_path = os.path.join(path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def _remove_old_builds(path, keep):
+    # 이전 build 하나는 남겨둔다. (pointer 를 읽고 아직 파일을 열지 않은 reader)
+    for name in os.listdir(path):
+        name_path = os.path.join(path, name)
+        if name.startswith(BUILD_PREFIX) and name not in keep:
+            shutil.rmtree(name_path, ignore_errors=True)
+        elif name == MANIFEST_NAME or name.endswith('.npy'):
+            # build 디렉토리 도입 이전 형식의 파일
+            os.remove(name_path)
+
+
+def _write_frames(path, frames, sources):
+    # 새 build 디렉토리에 다 쓴 후 current.json 을 교체해서 공개한다.
+    os.makedirs(path, exist_ok=True)
+    previous = _current_build(path)
+    build = '{}{}_{}'.format(BUILD_PREFIX, int(time.time() * 1e6), os.getpid())
+    build_path = os.path.join(path, build)
+    os.makedirs(build_path)
+
+    manifest = {'version': VERSION, 'sources': sources, 'frames': dict()}
+    for key, df in frames.items():
+        kind = _frame_kind(df)
+        _save(os.path.join(build_path, '{}.index.npy'.format(key)), df.index)
+        if kind == 'panel':
+            _save(os.path.join(build_path, '{}.columns.npy'.format(key)), df.columns)
+            _save(os.path.join(build_path, '{}.values.npy'.format(key)), df.values)
+            manifest['frames'][key] = {'kind': kind}
+        else:
+            for i, col in enumerate(df.columns):
+                _save(os.path.join(build_path, '{}.col{}.npy'.format(key, i)), df[col].values)
+            manifest['frames'][key] = {'kind': kind, 'columns': [str(col) for col in df.columns]}
+
+    with open(os.path.join(build_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+
+    pointer_tmp = os.path.join(path, '{}.tmp{}'.format(POINTER_NAME, os.getpid()))
+    with open(pointer_tmp, 'w') as f:
+        json.dump({'build': build}, f)
+    os.replace(pointer_tmp, os.path.join(path, POINTER_NAME))
+
+    _remove_old_builds(path, keep={build, None if previous is None else os.path.basename(previous)})
+    return build_path
+
+
+def _update_sources(path, manifest, sources):
+    # 내용은 같고 mtime 만 바뀐 경우 다음 실행에서 다시 hash 하지 않도록 기록해둔다.
+    manifest = dict(manifest, sources=sources)
+    tmp_path = os.path.join(path, '{}.tmp{}'.format(MANIFEST_NAME, os.getpid()))
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+    return manifest
+
+
+def _read_frames(path, manifest):
+    def load(file_name, mmap_mode=None):
+        return np.load(os.path.join(path, file_name), mmap_mode=mmap_mode)
+
+    frames = dict()
+    for key, info in manifest['frames'].items():
+        index = pd.Index(load('{}.index.npy'.format(key)))
+        if info['kind'] == 'panel':
+            frames[key] = pd.DataFrame(load('{}.values.npy'.format(key), mmap_mode='r'),
+                                       index=index,
+                                       columns=load('{}.columns.npy'.format(key)),
+                                       copy=False)
+        else:
+            frames[key] = pd.DataFrame({col: load('{}.col{}.npy'.format(key, i))
+                                        for i, col in enumerate(info['columns'])},
+                                       index=index)
+    return frames
+
+
+def cached_frames(name, source_paths, build_fn, cache_dir=DEFAULT_CACHE_DIR):
+    """Return ``build_fn()`` (a dict of DataFrames), served from ``cache_dir/name`` when the sources are unchanged."""
+    path = os.path.join(cache_dir, name)
+    build_path = _current_build(path)
+    manifest = _read_manifest(build_path)
+    sources = _source_info(source_paths, None if manifest is None else manifest.get('sources'))
+
+    if not _is_valid(manifest, sources):
+        os.makedirs(cache_dir, exist_ok=True)
+        with _build_lock(path):
+            # lock 을 기다리는 동안 다른 프로세스가 만들었을 수 있다.
+            build_path = _current_build(path)
+            manifest = _read_manifest(build_path)
+            if not _is_valid(manifest, sources):
+                print('[panel_cache] building {} from {}'.format(name, source_paths))
+                build_path = _write_frames(path, build_fn(), sources)
+                manifest = _read_manifest(build_path)
+    elif manifest['sources'] != sources:
+        manifest = _update_sources(build_path, manifest, sources)
+
+    return _read_frames(build_path, manifest)
+
+
+def source_fingerprint(name, cache_dir=DEFAULT_CACHE_DIR):
+    """sha1 of the source files (and cache version) behind ``cached_frames(name, ...)``."""
+    manifest = _read_manifest(_current_build(os.path.join(cache_dir, name)))
+    assert manifest is not None, 'cached_frames({}) has not been built'.format(name)
+    h = hashlib.sha1()
+    h.update(json.dumps({'version': manifest['version'],
+                         'sources': sorted([path, info['sha1']] for path, info in manifest['sources'].items())}).encode('utf-8'))
+    return h.hexdigest()
@@ -0,0 +1,88 @@
+"""Sample base dates of a data generator in parallel.
+
+Every base date of ``DataScheduler._dataset`` is sampled independently, so the
+date range is split into contiguous shards (the ``base_d`` / universe cache
+of ``DataGeneratorDynamic`` stays warm inside a shard) and sampled in a
+``fork`` process pool. The workers inherit the generator of the parent: the
+raw panels are read-only memmaps of the panel cache (and the feature cube),
+so all workers share the same pages instead of receiving pickled copies.
+
+``np.random`` is seeded per base date from ``(seed, base_idx)`` and its
+previous state is restored after the date, so the caller's random state is
+left untouched. The ``balance_class`` sampling then does not depend on the
+number of workers or on which worker samples the date, and the serial path
+gives the same result when a seed is given. Draws made after the sampling
+(e.g. the 'once' balancing) should use ``seeded_rng``.
+"""
+
+import multiprocessing as mp
+
+import numpy as np
+
+# fork 된 worker 에서 사용하는 (generator, 함수 이름, 파라미터)
+_worker_state = dict()
+
+
+def date_seed(seed, base_idx):
+    return int(np.random.SeedSequence([seed, base_idx]).generate_state(1)[0])
+
+
+def seeded_rng(seed, *keys):
+    # seed 가 None 이면 전역 np.random 을 그대로 쓴다.
+    if seed is None:
+        return np.random
+    return np.random.RandomState(int(np.random.SeedSequence([seed] + [int(k) for k in keys]).generate_state(1)[0]))
+
+
+def _sample(generator, sample_fn_name, params, base_idx, seed):
+    if seed is None:
+        return getattr(generator, sample_fn_name)(base_idx, **params)
+
+    # sampler 는 전역 np.random 을 쓰므로 날짜마다 seed 하고 끝나면 이전 상태로 되돌린다.
+    state = np.random.get_state()
+    np.random.seed(date_seed(seed, base_idx))
+    try:
+        return getattr(generator, sample_fn_name)(base_idx, **params)
+    finally:
+        np.random.set_state(state)
+
+
+def _init_worker(generator, sample_fn_name, params):
+    _worker_state['generator'] = generator
+    _worker_state['sample_fn_name'] = sample_fn_name
+    _worker_state['params'] = params
+
+
+def _sample_shard(args):
+    base_idx_list, seed = args
+    return [_sample(_worker_state['generator'], _worker_state['sample_fn_name'], _worker_state['params'], d, seed)
+            for d in base_idx_list]
+
+
+def _shards(base_idx_list, n_shards):
+    bounds = np.linspace(0, len(base_idx_list), n_shards + 1).astype(int)
+    return [base_idx_list[s:e] for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+def sample_base_dates(generator, sample_fn_name, base_idx_list, params, n_workers=1, seed=None, shards_per_worker=4):
+    """[generator.<sample_fn_name>(d, **params) for d in base_idx_list] with ``n_workers`` processes.
+
+    seed: base seed of the per-date ``np.random`` seeds. None keeps the global
+        random state in the serial case; with workers a base seed is drawn from it.
+    """
+    base_idx_list = list(base_idx_list)
+    # pool worker (ex. walk_forward 의 window worker) 안에서는 다시 process 를 만들 수 없다.
+    if n_workers <= 1 or len(base_idx_list) <= 1 or 'fork' not in mp.get_all_start_methods() \
+            or mp.current_process().daemon:
+        return [_sample(generator, sample_fn_name, params, d, seed) for d in base_idx_list]
+
+    if seed is None:
+        seed = int(np.random.randint(0, 2 ** 31 - 1))
+
+    n_workers = min(n_workers, len(base_idx_list))
+    shards = _shards(base_idx_list, n_workers * shards_per_worker)
+    ctx = mp.get_context('fork')
+    with ctx.Pool(n_workers, initializer=_init_worker, initargs=(generator, sample_fn_name, params)) as pool:
+        # imap 은 순서를 유지하므로 결과는 base_idx_list 순서
+        results = pool.imap(_sample_shard, [(shard, seed) for shard in shards])
+        return [sampled for shard_result in results for sampled in shard_result]
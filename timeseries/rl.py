@@ -11,11 +11,12 @@ import gym
 import tensorflow as tf
 from time import time
 import pandas as pd
-import pickle
 from tensorflow.keras import Model
 from tensorflow.keras.layers import Dense, Conv2D, Flatten
 from tensorflow.keras.regularizers import l2
 
+from tf_additional.checkpoint import save_checkpoint, load_checkpoint
+
 
 LR = 1e-4
 L2_REG = 0.001
@@ -165,16 +166,13 @@ class PPO:
         w_dict['log_sigma'] = self.log_sigma.numpy()
         w_dict['global_step'] = self.global_step
 
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'wb') as f:
-            pickle.dump(w_dict, f)
+        # 저장은 background thread에서 진행된다.
+        save_checkpoint(f_name, w_dict)
 
         print("model saved. (path: {})".format(f_name))
 
     def load_model(self, f_name):
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'rb') as f:
-            w_dict = pickle.load(f)
+        w_dict = load_checkpoint(f_name)
         self.actor.set_weights(w_dict['actor'])
         self.log_sigma.assign(w_dict['log_sigma'])
         self.global_step = w_dict['global_step']
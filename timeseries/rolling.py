@@ -0,0 +1,110 @@
+"""O(T) rolling-window kernels for [T x assets] panels (or 1-D series).
+
+Windows are trailing and inclusive: the value at t uses ``x[max(0, t - n):(t + 1)]``,
+i.e. up to ``n + 1`` rows, which is what the feature functions have always used.
+A window that contains NaN (or inf) gives NaN, as ``np.std`` / ``np.max`` do.
+"""
+
+import numpy as np
+
+
+def _window_sums(x, n):
+    # 윈도우 합을 누적합의 차이로 구한다. (앞쪽은 0 을 붙여서 부분 윈도우 처리)
+    c = np.cumsum(x, axis=0)
+    c = np.concatenate([np.zeros_like(c[:1]), c], axis=0)
+    t = np.arange(len(x))
+    start = np.maximum(0, t - n)
+    return c[t + 1] - c[start]
+
+
+def rolling_std(x, n, ddof=0):
+    """np.std(x[max(0, t - n):(t + 1)], axis=0, ddof=ddof) for every t."""
+    x = np.asarray(x)
+    out_dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+    x64 = x.astype(np.float64)
+
+    bad = ~np.isfinite(x64)
+    # 윈도우 안에서 상쇄 오차가 커지지 않도록 열의 첫 유효값 만큼 빼고 누적한다.
+    # (앞쪽 행만 보는 값이라 x[:k] 에 대한 결과가 x 에 대한 결과의 앞부분과 정확히 같다.)
+    z = np.where(bad, 0., x64)
+    if len(x) > 0:
+        first = np.take_along_axis(z, np.argmax(~bad, axis=0)[np.newaxis], axis=0)
+        z = np.where(bad, 0., z - first)
+
+    count = (np.minimum(np.arange(len(x)), n) + 1.).reshape((-1,) + (1,) * (x.ndim - 1))
+    s1 = _window_sums(z, n)
+    s2 = _window_sums(z * z, n)
+    n_bad = _window_sums(bad.astype(np.int64), n)
+
+    mean = s1 / count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (s2 - s1 * mean) / (count - ddof)
+    # 누적합 차이의 반올림 오차로 생기는 음수 보정
+    var = np.where(var < 0., 0., var)
+    var = np.where((n_bad > 0) | (count - ddof <= 0), np.nan, var)
+
+    return np.sqrt(var).astype(out_dtype)
+
+
+def rolling_std_strided(x, n, n_steps=12, ddof=0):
+    """np.std(x[max(0, t - n * n_steps):(t + 1)][::n], axis=0, ddof=ddof) for every t.
+
+    The stride starts from the window start, so once the window is full it takes
+    every n-th row ending at t; before that (t < n * n_steps) it takes rows
+    0, n, 2n, ... <= t.
+    """
+    x = np.asarray(x)
+    out = np.empty(x.shape, dtype=x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64)
+    t = np.arange(len(x))
+    full = t >= n * n_steps
+
+    # 같은 나머지(t mod n)를 가진 행끼리 모으면 stride 윈도우가 일반 rolling 윈도우가 된다.
+    for r in range(min(n, len(x))):
+        std_r = rolling_std(x[r::n], n_steps, ddof=ddof)
+        idx = t[r::n]
+        out[idx[full[r::n]]] = std_r[full[r::n]]
+        if r == 0:
+            std_0 = std_r
+
+    # 윈도우가 다 차기 전에는 0, n, 2n, ... 행에 대한 누적 std
+    if len(x) > 0:
+        early = t[~full]
+        out[early] = std_0[early // n]
+
+    return out
+
+
+def rolling_max(x, n):
+    """np.max(x[max(0, t - n):(t + 1)], axis=0) for every t.
+
+    Van Herk / Gil-Werman: block-wise prefix and suffix maxima, so every window
+    is the max of two precomputed values (O(T) and vectorized across columns).
+    """
+    x = np.asarray(x)
+    w = n + 1
+    length = len(x)
+    if length == 0:
+        return x.copy()
+
+    if np.issubdtype(x.dtype, np.floating):
+        fill = -np.inf
+    else:
+        fill = np.iinfo(x.dtype).min
+
+    # 앞에 n 행을 붙이면 원래 t 의 윈도우는 padded[t:(t + w)] 가 된다.
+    pad_back = (-(length + n)) % w
+    padded = np.concatenate([np.full((n,) + x.shape[1:], fill, dtype=x.dtype), x,
+                             np.full((pad_back,) + x.shape[1:], fill, dtype=x.dtype)], axis=0)
+    blocks = padded.reshape((-1, w) + x.shape[1:])
+
+    prefix = np.maximum.accumulate(blocks, axis=1).reshape(padded.shape)
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+
+    t = np.arange(length)
+    return np.maximum(suffix[t], prefix[t + n])
+
+
+def drawdown(x, n):
+    """x[t] - rolling_max(x, n)[t]"""
+    x = np.asarray(x)
+    return x - rolling_max(x, n)
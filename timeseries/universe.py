@@ -0,0 +1,91 @@
+"""Precomputed universe membership over the columns of a price panel.
+
+``UniverseIndex`` turns long ``[eval_d, infocode, ...]`` tables (universe
+constituents, daily market cap) into dense boolean matrices of
+``[sorted dates x panel columns]``. Resolving the eligible assets of a date is
+then an ``np.searchsorted`` on the dates plus an AND of matrix rows, and the
+result is an integer index array into the panel columns.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class Membership:
+    """Membership matrix of one long table (``eval_d``, ``infocode`` and optionally ``mktcap``)."""
+    def __init__(self, df, codes):
+        eval_d = np.asarray(df['eval_d'])
+        col = pd.Index(codes).get_indexer(np.asarray(df['infocode']))
+        in_panel = col >= 0
+
+        self.dates = np.unique(eval_d)
+        row = np.searchsorted(self.dates, eval_d)
+        self.member = np.zeros([len(self.dates), len(codes)], dtype=bool)
+        self.member[row[in_panel], col[in_panel]] = True
+
+        # 날짜별로 정렬된 (열 인덱스, mktcap) - 선택된 종목의 mktcap 조회용
+        self.has_mktcap = 'mktcap' in df.columns
+        if self.has_mktcap:
+            order = np.argsort(row, kind='stable')
+            self._row_start = np.searchsorted(row[order], np.arange(len(self.dates) + 1))
+            self._col_sorted = col[order]
+            self._mktcap_sorted = np.asarray(df['mktcap'])[order]
+
+    def last_pos(self, d):
+        # d 이전(포함) 마지막 날짜의 위치 (없으면 -1)
+        return int(np.searchsorted(self.dates, d, side='right')) - 1
+
+    def exact_pos(self, d):
+        pos = int(np.searchsorted(self.dates, d, side='left'))
+        if pos < len(self.dates) and self.dates[pos] == d:
+            return pos
+        return -1
+
+    def row(self, pos):
+        if pos < 0:
+            return np.zeros(self.member.shape[1], dtype=bool)
+        return self.member[pos]
+
+    def get_mktcap(self, pos, col_idx):
+        # 같은 날짜에 같은 종목이 여러번 있으면 마지막 값
+        values = np.full(len(col_idx), np.nan)
+        if pos < 0 or not self.has_mktcap:
+            return values
+        rows = slice(self._row_start[pos], self._row_start[pos + 1])
+        lookup = pd.Series(self._mktcap_sorted[rows], index=self._col_sorted[rows])
+        lookup = lookup[~lookup.index.duplicated(keep='last')]
+        return lookup.reindex(col_idx).to_numpy(dtype=np.float64)
+
+
+class UniverseIndex:
+    """Universe of ``data_code`` (rebalance dates) and ``size_data`` (daily) over the panel ``codes``.
+
+    codes: panel columns (sorted infocodes).
+    size_data: optional daily table; when None only ``data_code`` is used.
+    """
+    def __init__(self, codes, data_code, size_data=None):
+        self.codes = np.asarray(codes)
+        assert np.all(self.codes[1:] > self.codes[:-1]), 'panel columns must be sorted and unique'
+
+        self.univ = Membership(data_code, self.codes)
+        self.size = None if size_data is None else Membership(size_data, self.codes)
+        self.has_data = np.ones(len(self.codes), dtype=bool)
+
+    def require_columns(self, columns):
+        # 추가 panel(beta, ivol, ...)에 없는 종목 제외
+        self.has_data &= np.isin(self.codes, np.asarray(columns))
+
+    def rebalance_pos(self, d):
+        return self.univ.last_pos(d)
+
+    def select(self, base_pos, univ_pos, size_d=None):
+        """Column indices of the assets in the universe at both rebalance dates (and in size_data at size_d)."""
+        mask = self.univ.row(base_pos) & self.univ.row(univ_pos) & self.has_data
+        if self.size is not None:
+            mask &= self.size.row(self.size.exact_pos(size_d))
+        return np.where(mask)[0]
+
+    def mktcap(self, col_idx, base_pos, size_d=None):
+        if self.size is not None:
+            return self.size.get_mktcap(self.size.exact_pos(size_d), col_idx)
+        return self.univ.get_mktcap(base_pos, col_idx)
@@ -30,115 +30,155 @@ def dict_to_list(dict, key_list=None):
     return np.stack(arr, axis=-1), ordered_key_list
 
 
-def predict_plot(model, dataset, columns_list, size=250, save_dir='out.png'):
+def predict_in_batches(predict_fn, input_enc, output_dec, batch_size=1024):
+    """predict_fn({'input': ..., 'output': ...}) over the first axis in batches of ``batch_size``.
+
+    Returns an array (or a dict of arrays, e.g. ``predict_mtl``) aligned with ``input_enc``.
+    """
+    n = len(input_enc)
+    batch_size = max(1, min(batch_size, n))
+    outputs = list()
+    for s in range(0, n, batch_size):
+        input_b, output_b = input_enc[s:(s + batch_size)], output_dec[s:(s + batch_size)]
+        n_b = len(input_b)
+        if n_b < batch_size:
+            # 마지막 batch 는 padding 해서 shape 를 고정한다. (tf.function retracing 방지)
+            pad = [[0, batch_size - n_b]] + [[0, 0]] * (input_b.ndim - 1)
+            input_b, output_b = np.pad(input_b, pad), np.pad(output_b, pad)
+        pred = predict_fn({'input': input_b, 'output': output_b})
+        if isinstance(pred, dict):
+            outputs.append({key: np.asarray(val)[:n_b] for key, val in pred.items()})
+        else:
+            outputs.append(np.asarray(pred)[:n_b])
 
-    cost_rate = 0.000
-    idx_y = columns_list.index('log_y')
-    idx_pos = columns_list.index('positive')
+    if isinstance(outputs[0], dict):
+        return {key: np.concatenate([o[key] for o in outputs], axis=0) for key in outputs[0].keys()}
+    return np.concatenate(outputs, axis=0)
 
-    true_y = np.zeros(size)
-    pred_both = np.zeros_like(true_y)
-    pred_pos = np.zeros_like(true_y)
-    pred_y = np.zeros_like(true_y)
-    pred_avg = np.zeros_like(true_y)
 
-    pred_chart = np.zeros_like(true_y)
-    pred_pos_val = np.zeros_like(true_y)
-    pred_y_val = np.zeros_like(true_y)
-    real_pos_val = np.zeros_like(true_y)
-    real_y_val = np.zeros_like(true_y)
+def split_predictions(predictions, lengths):
+    # predict_in_batches 결과를 lengths 단위(ex. 날짜별 cross-section, 종목별)로 다시 나눈다.
+    bounds = np.cumsum(lengths)[:-1]
+    if isinstance(predictions, dict):
+        split = {key: np.split(val, bounds, axis=0) for key, val in predictions.items()}
+        return [{key: split[key][i] for key in split.keys()} for i in range(len(lengths))]
+    return np.split(predictions, bounds, axis=0)
 
-    prev_w_both = 0
-    prev_w_pos = 0
-    prev_w_y = 0
-    for j, (features, labels) in enumerate(dataset.take(size)):
-        predictions = model.predict(features)
-        true_y[j] = labels[0, 0, idx_y]
-        pred_chart[j] = predictions[0, 0, idx_y]
-        pred_pos_val[j] = predictions[0, 0, idx_pos]
-        pred_y_val[j] = predictions[0, 0, idx_y]
-        real_pos_val[j] = labels[0, 0, idx_pos]
-        real_y_val[j] = labels[0, 0, idx_y]
 
-        if predictions[0, 0, idx_y] > 0:
-            pred_y[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_y)
-            prev_w_y = 1
-        else:
-            pred_y[j] = - cost_rate * prev_w_y
-            prev_w_y = 0
-        if predictions[0, 0, idx_pos] > 0:
-            pred_pos[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_pos)
-            prev_w_pos = 1
-        else:
-            pred_pos[j] = - cost_rate * prev_w_pos
-            prev_w_pos = 0
-        if (predictions[0, 0, idx_y] > 0) and (predictions[0, 0, idx_pos] > 0):
-            pred_both[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_both)
-            prev_w_both = 1
-        else:
-            pred_both[j] = - cost_rate * prev_w_both
-            prev_w_both = 0
+def teacher_forcing_output(output_dec):
+    # 예측시 decoder 입력은 첫 step 만 남긴다.
+    new_output = np.zeros_like(output_dec)
+    new_output[:, 0, :] = output_dec[:, 0, :]
+    return new_output
 
-        pred_avg[j] = (pred_y[j] + pred_pos[j]) / 2.
 
-    data = pd.DataFrame({'true_y': np.cumsum(np.log(1. + true_y[:(j+1)])),
-                         'pred_both': np.cumsum(np.log(1. + pred_both[:(j+1)])),
-                         'pred_pos': np.cumsum(np.log(1. + pred_pos[:(j+1)])),
-                         'pred_y': np.cumsum(np.log(1. + pred_y[:(j+1)])),
-                         'pred_avg': np.cumsum(np.log(1. + pred_avg[:(j+1)])),
-                         # 'pred_chart': np.cumsum(np.log(1. + pred_chart)),
-    })
+def predict_cross_sections(model, input_enc_list, output_dec_list, batch_size=1024):
+    """model.predict_mtl of every date's cross-section, run over all dates in large batches."""
+    for input_enc_t, output_dec_t in zip(input_enc_list, output_dec_list):
+        assert np.sum(input_enc_t[:, -1, :] - output_dec_t[:, 0, :]) == 0
 
-    pos_acc = np.sum((pred_pos_val[:(j+1)] > 0) == (real_pos_val[:(j+1)] > 0)) / (j+1)
-    pos_recall_p = np.sum((pred_pos_val[:(j+1)] > 0) & (real_pos_val[:(j+1)] > 0)) / np.sum(real_pos_val[:(j+1)] > 0)
-    pos_precision_p = np.sum((pred_pos_val[:(j+1)] > 0) & (real_pos_val[:(j+1)] > 0)) / np.sum(pred_pos_val[:(j + 1)] > 0)
-    pos_recall_n = np.sum((pred_pos_val[:(j+1)] < 0) & (real_pos_val[:(j+1)] < 0)) / np.sum(real_pos_val[:(j+1)] < 0)
-    pos_precision_n = np.sum((pred_pos_val[:(j+1)] < 0) & (real_pos_val[:(j+1)] < 0)) / np.sum(pred_pos_val[:(j + 1)] < 0)
+    predictions = predict_in_batches(model.predict_mtl,
+                                     np.concatenate(input_enc_list, axis=0),
+                                     teacher_forcing_output(np.concatenate(output_dec_list, axis=0)),
+                                     batch_size=batch_size)
+    return split_predictions(predictions, [len(x) for x in input_enc_list])
+
+
+def dataset_to_arrays(dataset, size=None):
+    # dataset 의 앞쪽 size 개 sample 을 (features, labels) numpy array 로 모은다. (batch 크기 무관)
+    input_enc, output_dec, labels = list(), list(), list()
+    n = 0
+    for features, labels_b in dataset:
+        input_enc.append(np.asarray(features['input']))
+        output_dec.append(np.asarray(features['output']))
+        labels.append(np.asarray(labels_b))
+        n += len(input_enc[-1])
+        if size is not None and n >= size:
+            break
+
+    features = {'input': np.concatenate(input_enc, axis=0)[:size],
+                'output': np.concatenate(output_dec, axis=0)[:size]}
+    return features, np.concatenate(labels, axis=0)[:size]
+
+
+def _position_returns(weight, y, cost_rate=0.):
+    # weight(0 / 1) 포지션의 수익률 (포지션 변경시 비용 차감)
+    prev_w = np.concatenate([[0.], weight[:-1]])
+    return weight * y - cost_rate * np.abs(weight - prev_w)
+
+
+def _print_sign_stats(name, pred_val, real_val):
+    acc = np.sum((pred_val > 0) == (real_val > 0)) / len(real_val)
+    recall_p = np.sum((pred_val > 0) & (real_val > 0)) / np.sum(real_val > 0)
+    precision_p = np.sum((pred_val > 0) & (real_val > 0)) / np.sum(pred_val > 0)
+    recall_n = np.sum((pred_val < 0) & (real_val < 0)) / np.sum(real_val < 0)
+    precision_n = np.sum((pred_val < 0) & (real_val < 0)) / np.sum(pred_val < 0)
+    print("[[{}]] acc: {:.4f} / [recall] p: {:.4f}, n: {:.4f} / [precision] p: {:.4f}, n: {:.4f}".format(name, acc,
+                                                                                           recall_p, recall_n,
+                                                                                           precision_p, precision_n))
+
+
+def plot_sign_strategies(true_y, real_pos_val, pred_y_val, pred_pos_val, save_dir='out.png', cost_rate=0.000):
+    """Plot long / flat strategies on the sign of the predicted return and positive (all arrays [n_samples])."""
+    w_y = (pred_y_val > 0).astype(np.float64)
+    w_pos = (pred_pos_val > 0).astype(np.float64)
+    pred_y = _position_returns(w_y, true_y, cost_rate)
+    pred_pos = _position_returns(w_pos, true_y, cost_rate)
+    pred_both = _position_returns(w_y * w_pos, true_y, cost_rate)
+    pred_avg = (pred_y + pred_pos) / 2.
 
-    y_acc = np.sum((pred_y_val[:(j+1)] > 0) == (real_y_val[:(j+1)] > 0)) / (j+1)
-    y_recall_p = np.sum((pred_y_val[:(j+1)] > 0) & (real_y_val[:(j+1)] > 0)) / np.sum(real_y_val[:(j+1)] > 0)
-    y_precision_p = np.sum((pred_y_val[:(j+1)] > 0) & (real_y_val[:(j+1)] > 0)) / np.sum(pred_y_val[:(j + 1)] > 0)
-    y_recall_n = np.sum((pred_y_val[:(j+1)] < 0) & (real_y_val[:(j+1)] < 0)) / np.sum(real_y_val[:(j+1)] < 0)
-    y_precision_n = np.sum((pred_y_val[:(j+1)] < 0) & (real_y_val[:(j+1)] < 0)) / np.sum(pred_y_val[:(j + 1)] < 0)
+    data = pd.DataFrame({'true_y': np.cumsum(np.log(1. + true_y)),
+                         'pred_both': np.cumsum(np.log(1. + pred_both)),
+                         'pred_pos': np.cumsum(np.log(1. + pred_pos)),
+                         'pred_y': np.cumsum(np.log(1. + pred_y)),
+                         'pred_avg': np.cumsum(np.log(1. + pred_avg)),
+    })
 
     print("n_pos: {} / n_neg: {}".format(np.sum(true_y > 0), np.sum(true_y < 0)))
-    print("[[positive]] acc: {:.4f} / [recall] p: {:.4f}, n: {:.4f} / [precision] p: {:.4f}, n: {:.4f}".format(pos_acc,
-                                                                                           pos_recall_p, pos_recall_n,
-                                                                                           pos_precision_p, pos_precision_n))
-
-    print("[[return]] acc: {:.4f} / [recall] p: {:.4f}, n: {:.4f} / [precision] p: {:.4f}, n: {:.4f}".format(y_acc,
-                                                                                           y_recall_p, y_recall_n,
-                                                                                           y_precision_p, y_precision_n))
-
-    # plt.plot(data['true_y'], label='real')
-    # plt.plot(data['pred_chart'], label='pred')
-    # plt.plot(data['pred_y'], label='pred_y')
-    # plt.legend()
+    _print_sign_stats('positive', pred_pos_val, real_pos_val)
+    _print_sign_stats('return', pred_y_val, true_y)
 
     fig = plt.figure()
     plt.plot(data)
     plt.legend(data.columns)
     fig.savefig(save_dir)
+    print("figure saved. (dir: {})".format(save_dir))
     plt.close(fig)
 
-    #
-    # for j, (features, labels) in enumerate(dataset.take(size)):
-    #     predictions = model.predict(features)
-    #     true_y[j] = labels[0, 0, columns_list.index('log_cum_y')]
-    #     pred_chart[j] = predictions[0, 0, columns_list.index('log_cum_y')]
-    #
-    # plt.plot(true_y, label='real')
-    # plt.plot(pred_chart, label='pred')
-    # plt.legend()
 
+def plot_predictions(predictions, labels, columns_list, save_dir='out.png'):
+    # predictions: model.predict 결과 [n_samples, seq_len, n_features] (labels 와 정렬)
+    idx_y = columns_list.index('log_y')
+    idx_pos = columns_list.index('positive')
+    plot_sign_strategies(labels[:, 0, idx_y], labels[:, 0, idx_pos],
+                         predictions[:, 0, idx_y], predictions[:, 0, idx_pos], save_dir=save_dir)
 
 
-def predict_plot_mtl_cross_section_test(model, dataset_list, save_dir='out.png', ylog=False, eval_type='pos'):
+def plot_predictions_mtl(predictions, labels, columns_list, save_dir='out.png'):
+    # predictions: model.predict_mtl 결과 {key: [n_samples, seq_len, dim]} (labels 와 정렬)
+    idx_y = columns_list.index('log_y')
+    idx_pos = columns_list.index('positive')
+    plot_sign_strategies(labels[:, 0, idx_y], labels[:, 0, idx_pos],
+                         predictions['ret'][:, 0, 0], predictions['pos'][:, 0, 0] - 0.5, save_dir=save_dir)
+
+
+def predict_plot(model, dataset, columns_list, size=250, save_dir='out.png', batch_size=1024):
+    features, labels = dataset_to_arrays(dataset, size)
+    predictions = predict_in_batches(model.predict, features['input'], features['output'], batch_size=batch_size)
+    plot_predictions(predictions, labels, columns_list, save_dir=save_dir)
+
+
+def predict_plot_mtl_cross_section_test(model, dataset_list, save_dir='out.png', ylog=False, eval_type='pos',
+                                        predictions_list=None, batch_size=1024):
     if dataset_list is False:
         return False
     else:
         input_enc_list, output_dec_list, target_dec_list, features_list, additional_infos, start_date, end_date = dataset_list
 
+    # predictions_list: predict_cross_sections 결과 (eval_type 만 바꿔 여러번 그릴 때 재사용)
+    if predictions_list is None:
+        predictions_list = predict_cross_sections(model, input_enc_list, output_dec_list, batch_size=batch_size)
+
     idx_y = features_list.index('log_y')
 
     true_y = np.zeros(len(input_enc_list) + 1)
@@ -151,17 +191,8 @@ def predict_plot_mtl_cross_section_test(model, dataset_list, save_dir='out.png',
     pred_q5 = np.zeros_like(true_y)
 
     # df_infos = pd.DataFrame(columns={'start_d', 'base_d', 'infocode', 'score'})
-    for i, (input_enc_t, output_dec_t, target_dec_t) in enumerate(zip(input_enc_list, output_dec_list, target_dec_list)):
+    for i, (labels, predictions) in enumerate(zip(target_dec_list, predictions_list)):
         t = i + 1
-        assert np.sum(input_enc_t[:, -1, :] - output_dec_t[:, 0, :]) == 0
-        new_output_t = np.zeros_like(output_dec_t)
-        new_output_t[:, 0, :] = output_dec_t[:, 0, :]
-
-        features = {'input': input_enc_t, 'output': new_output_t}
-        labels = target_dec_t
-
-        predictions = model.predict_mtl(features)
-        # p_ret, p_pos, p_vol, p_mdd = predictions
 
         true_y[t] = np.mean(labels[:, 0, idx_y])
         # additional_infos[i]['score'] = predictions['pos'][:, 0, 0]
@@ -223,12 +254,17 @@ def predict_plot_mtl_cross_section_test(model, dataset_list, save_dir='out.png',
     plt.close(fig)
 
 
-def predict_plot_mtl_test(model, dataset_list, save_dir='out.png', ylog=False, eval_type='pos'):
+def predict_plot_mtl_test(model, dataset_list, save_dir='out.png', ylog=False, eval_type='pos',
+                          predictions_list=None, batch_size=1024):
     if dataset_list is False:
         return False
     else:
         input_enc_list, output_dec_list, target_dec_list, features_list, start_date, end_date = dataset_list
 
+    # predictions_list: predict_cross_sections 결과 (eval_type 만 바꿔 여러번 그릴 때 재사용)
+    if predictions_list is None:
+        predictions_list = predict_cross_sections(model, input_enc_list, output_dec_list, batch_size=batch_size)
+
     idx_y = features_list.index('log_y')
 
     true_y = np.zeros(len(input_enc_list) + 1)
@@ -249,17 +285,8 @@ def predict_plot_mtl_test(model, dataset_list, save_dir='out.png', ylog=False, e
     pred_q4 = np.zeros_like(true_y)
     pred_q5 = np.zeros_like(true_y)
 
-    for i, (input_enc_t, output_dec_t, target_dec_t) in enumerate(zip(input_enc_list, output_dec_list, target_dec_list)):
+    for i, (labels, predictions) in enumerate(zip(target_dec_list, predictions_list)):
         t = i + 1
-        assert np.sum(input_enc_t[:, -1, :] - output_dec_t[:, 0, :]) == 0
-        new_output_t = np.zeros_like(output_dec_t)
-        new_output_t[:, 0, :] = output_dec_t[:, 0, :]
-
-        features = {'input': input_enc_t, 'output': new_output_t}
-        labels = target_dec_t
-
-        predictions = model.predict_mtl(features)
-        # p_ret, p_pos, p_vol, p_mdd = predictions
 
         true_y[t] = np.mean(labels[:, 0, idx_y])
 
@@ -359,95 +386,10 @@ def predict_plot_mtl_test(model, dataset_list, save_dir='out.png', ylog=False, e
     plt.close(fig)
 
 
-def predict_plot_mtl(model, dataset, columns_list, size=250, save_dir='out.png'):
-
-    cost_rate = 0.000
-    idx_y = columns_list.index('log_y')
-    idx_pos = columns_list.index('positive')
-
-    true_y = np.zeros(size)
-    pred_both = np.zeros_like(true_y)
-    pred_pos = np.zeros_like(true_y)
-    pred_y = np.zeros_like(true_y)
-    pred_avg = np.zeros_like(true_y)
-
-    pred_chart = np.zeros_like(true_y)
-    pred_pos_val = np.zeros_like(true_y)
-    pred_y_val = np.zeros_like(true_y)
-    real_pos_val = np.zeros_like(true_y)
-    real_y_val = np.zeros_like(true_y)
-
-    prev_w_both = 0
-    prev_w_pos = 0
-    prev_w_y = 0
-    for j, (features, labels) in enumerate(dataset.take(size)):
-        predictions = model.predict_mtl(features)
-        # p_ret, p_pos, p_vol, p_mdd = predictions
-
-        true_y[j] = labels[0, 0, idx_y]
-        pred_chart[j] = predictions['ret'][0, 0, 0]
-        pred_pos_val[j] = predictions['pos'][0, 0, 0] - 0.5
-        pred_y_val[j] = predictions['ret'][0, 0, 0]
-        real_pos_val[j] = labels[0, 0, idx_pos]
-        real_y_val[j] = labels[0, 0, idx_y]
-
-        if predictions['ret'][0, 0, 0] > 0:
-            pred_y[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_y)
-            prev_w_y = 1
-        else:
-            pred_y[j] = - cost_rate * prev_w_y
-            prev_w_y = 0
-        if predictions['pos'][0, 0, 0] > 0.5:
-            pred_pos[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_pos)
-            prev_w_pos = 1
-        else:
-            pred_pos[j] = - cost_rate * prev_w_pos
-            prev_w_pos = 0
-        if (predictions['ret'][0, 0, 0] > 0) and (predictions['pos'][0, 0, 0] > 0.5):
-            pred_both[j] = labels[0, 0, idx_y] - cost_rate * (1. - prev_w_both)
-            prev_w_both = 1
-        else:
-            pred_both[j] = - cost_rate * prev_w_both
-            prev_w_both = 0
-
-        pred_avg[j] = (pred_y[j] + pred_pos[j]) / 2.
-
-    data = pd.DataFrame({'true_y': np.cumsum(np.log(1. + true_y[:(j+1)])),
-                         'pred_both': np.cumsum(np.log(1. + pred_both[:(j+1)])),
-                         'pred_pos': np.cumsum(np.log(1. + pred_pos[:(j+1)])),
-                         'pred_y': np.cumsum(np.log(1. + pred_y[:(j+1)])),
-                         'pred_avg': np.cumsum(np.log(1. + pred_avg[:(j+1)])),
-                         # 'pred_chart': np.cumsum(np.log(1. + pred_chart)),
-    })
-
-    pos_acc = np.sum((pred_pos_val[:(j+1)] > 0) == (real_pos_val[:(j+1)] > 0)) / (j+1)
-    pos_recall_p = np.sum((pred_pos_val[:(j+1)] > 0) & (real_pos_val[:(j+1)] > 0)) / np.sum(real_pos_val[:(j+1)] > 0)
-    pos_precision_p = np.sum((pred_pos_val[:(j+1)] > 0) & (real_pos_val[:(j+1)] > 0)) / np.sum(pred_pos_val[:(j + 1)] > 0)
-    pos_recall_n = np.sum((pred_pos_val[:(j+1)] < 0) & (real_pos_val[:(j+1)] < 0)) / np.sum(real_pos_val[:(j+1)] < 0)
-    pos_precision_n = np.sum((pred_pos_val[:(j+1)] < 0) & (real_pos_val[:(j+1)] < 0)) / np.sum(pred_pos_val[:(j + 1)] < 0)
-
-    y_acc = np.sum((pred_y_val[:(j+1)] > 0) == (real_y_val[:(j+1)] > 0)) / (j+1)
-    y_recall_p = np.sum((pred_y_val[:(j+1)] > 0) & (real_y_val[:(j+1)] > 0)) / np.sum(real_y_val[:(j+1)] > 0)
-    y_precision_p = np.sum((pred_y_val[:(j+1)] > 0) & (real_y_val[:(j+1)] > 0)) / np.sum(pred_y_val[:(j + 1)] > 0)
-    y_recall_n = np.sum((pred_y_val[:(j+1)] < 0) & (real_y_val[:(j+1)] < 0)) / np.sum(real_y_val[:(j+1)] < 0)
-    y_precision_n = np.sum((pred_y_val[:(j+1)] < 0) & (real_y_val[:(j+1)] < 0)) / np.sum(pred_y_val[:(j + 1)] < 0)
-
-    print("n_pos: {} / n_neg: {}".format(np.sum(true_y > 0), np.sum(true_y < 0)))
-    print("[[positive]] acc: {:.4f} / [recall] p: {:.4f}, n: {:.4f} / [precision] p: {:.4f}, n: {:.4f}".format(pos_acc,
-                                                                                           pos_recall_p, pos_recall_n,
-                                                                                           pos_precision_p, pos_precision_n))
-
-    print("[[return]] acc: {:.4f} / [recall] p: {:.4f}, n: {:.4f} / [precision] p: {:.4f}, n: {:.4f}".format(y_acc,
-                                                                                           y_recall_p, y_recall_n,
-                                                                                           y_precision_p, y_precision_n))
-
-    fig = plt.figure()
-    plt.plot(data)
-    plt.legend(data.columns)
-    fig.savefig(save_dir)
-    print("figure saved. (dir: {})".format(save_dir))
-    plt.close(fig)
-
+def predict_plot_mtl(model, dataset, columns_list, size=250, save_dir='out.png', batch_size=1024):
+    features, labels = dataset_to_arrays(dataset, size)
+    predictions = predict_in_batches(model.predict_mtl, features['input'], features['output'], batch_size=batch_size)
+    plot_predictions_mtl(predictions, labels, columns_list, save_dir=save_dir)
 
 
 def predict_plot_with_actor(model, actor, dataset, columns_list, size=250, save_dir='out.png'):
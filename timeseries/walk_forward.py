@@ -0,0 +1,180 @@
+"""Walk-forward retraining of many windows in a process pool.
+
+``scheduler_windows(ds)`` lists the windows a ``DataScheduler`` walks through
+with ``next()`` (its index state per window), ``set_window`` puts a
+scheduler on one of them. ``run_walk_forward`` runs
+``window_fn(context, window, window_dir, init_model)`` for every window,
+where ``context = setup_fn()`` is built once per worker process (configs,
+scheduler, ...). Every window writes its model (``model_path(window_dir)``),
+plots and ``scores.json`` under its own ``out_dir/<base_idx>/``, so finished
+windows are skipped when the run is restarted.
+
+The workers are ``spawn``-ed (TensorFlow is not fork safe) and the TF / BLAS
+thread pools of every worker are limited to ``threads_per_worker``. BLAS
+reads its thread variables when numpy is loaded, which already happens while
+a worker unpickles ``setup_fn``, so they are set in the parent environment
+the workers inherit; the TF thread pools are set in the worker initializer.
+The raw panels and the feature cube are read-only memmaps of the panel cache,
+so the workers share the same page cache for them. The index arrays derived
+from the panels in ``setup_fn`` (``PanelWindows``, ``UniverseIndex``, ...)
+are rebuilt by every worker in its own memory.
+
+With ``warm_start`` window ``k`` starts from the model of window
+``k - pipeline_depth``: depth 1 is the serial chain, a larger depth keeps up
+to ``pipeline_depth`` windows in flight with a less recent starting point.
+Without ``warm_start`` every window is trained from scratch and all windows
+are independent.
+"""
+
+import copy
+import json
+import multiprocessing as mp
+import os
+from contextlib import contextmanager
+
+from tf_additional.checkpoint import checkpoint_exists, wait_for_pending
+
+SCORES_NAME = 'scores.json'
+WINDOW_KEYS = ['base_idx', 'train_begin_idx', 'eval_begin_idx', 'test_begin_idx', 'test_end_idx']
+
+# spawn 된 worker 의 setup_fn() 결과와 window_fn
+_worker_state = dict()
+
+
+def scheduler_windows(ds):
+    """Index state of every window ``ds`` visits with ``next()`` until ``done`` (``ds`` is not moved)."""
+    ds = copy.copy(ds)
+    windows = list()
+    while not ds.done:
+        windows.append({key: int(getattr(ds, key)) for key in WINDOW_KEYS})
+        ds.next()
+    return windows
+
+
+def set_window(ds, window):
+    for key in WINDOW_KEYS:
+        setattr(ds, key, window[key])
+
+
+def window_dir_of(out_dir, window):
+    return os.path.join(out_dir, str(window['base_idx']))
+
+
+def model_path(window_dir):
+    return os.path.join(window_dir, 'model')
+
+
+THREAD_ENV_KEYS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS']
+
+
+@contextmanager
+def thread_env(n_threads):
+    # 이 안에서 만든 process 는 BLAS thread 제한을 물려받는다. (부모 환경변수는 나올 때 복원)
+    if n_threads is None:
+        yield
+        return
+
+    old = {key: os.environ.get(key) for key in THREAD_ENV_KEYS}
+    os.environ.update({key: str(n_threads) for key in THREAD_ENV_KEYS})
+    try:
+        yield
+    finally:
+        for key, value in old.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def limit_threads(n_threads):
+    # tensorflow 를 처음 사용하기 전에 호출해야 한다.
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(n_threads)
+
+
+def _init_worker(setup_fn, window_fn, threads_per_worker):
+    if threads_per_worker is not None:
+        limit_threads(threads_per_worker)
+    _worker_state['context'] = setup_fn()
+    _worker_state['window_fn'] = window_fn
+
+
+def _read_scores(window_dir):
+    # (끝난 window 여부, scores)
+    path = os.path.join(window_dir, SCORES_NAME)
+    if not os.path.exists(path):
+        return False, None
+    with open(path, 'r') as f:
+        return True, json.load(f)
+
+
+def _run_window(window, window_dir, init_model):
+    os.makedirs(window_dir, exist_ok=True)
+    scores = _worker_state['window_fn'](_worker_state['context'], window, window_dir, init_model)
+
+    # 다음 window 가 warm start 로 읽기 전에 background 저장을 마친다.
+    wait_for_pending()
+
+    # scores.json 은 마지막에 쓴다. (있으면 끝난 window)
+    tmp_path = os.path.join(window_dir, '{}.tmp{}'.format(SCORES_NAME, os.getpid()))
+    with open(tmp_path, 'w') as f:
+        json.dump(scores, f, default=float)
+    os.replace(tmp_path, os.path.join(window_dir, SCORES_NAME))
+    return scores
+
+
+def run_walk_forward(setup_fn, window_fn, windows, out_dir, n_workers=1, threads_per_worker=None,
+                     warm_start=False, pipeline_depth=1, resume=True):
+    """Run ``window_fn`` for every window; returns the scores aligned with ``windows``.
+
+    setup_fn / window_fn: module level functions (the workers are spawned and import them).
+    window_fn(context, window, window_dir, init_model) trains / tests one window (``set_window``),
+        saves its model to ``model_path(window_dir)`` and returns json serializable scores.
+        init_model is the model path to warm start from, or None.
+    resume: skip windows that already have ``scores.json``.
+    """
+    n = len(windows)
+    window_dirs = [window_dir_of(out_dir, w) for w in windows]
+    # scores 는 None 일 수도 있으므로 끝난 window 는 done 으로 따로 표시한다.
+    done, scores = [False] * n, [None] * n
+    if resume:
+        for k, d in enumerate(window_dirs):
+            done[k], scores[k] = _read_scores(d)
+
+    def init_model(k):
+        if not warm_start or k < pipeline_depth:
+            return None
+        path = model_path(window_dirs[k - pipeline_depth])
+        return path if checkpoint_exists(path) else None
+
+    todo = [k for k in range(n) if not done[k]]
+    if n_workers <= 1 or len(todo) <= 1:
+        _init_worker(setup_fn, window_fn, None)
+        for k in todo:
+            scores[k] = _run_window(windows[k], window_dirs[k], init_model(k))
+            done[k] = True
+        return scores
+
+    ctx = mp.get_context('spawn')
+    with thread_env(threads_per_worker), \
+            ctx.Pool(min(n_workers, len(todo)), initializer=_init_worker,
+                     initargs=(setup_fn, window_fn, threads_per_worker)) as pool:
+        pending = dict()
+        i = 0
+        while i < len(todo) or pending:
+            # warm start 대상 window 가 끝난 window 까지 제출한다.
+            while i < len(todo):
+                k = todo[i]
+                if warm_start and k >= pipeline_depth and not done[k - pipeline_depth]:
+                    break
+                pending[k] = pool.apply_async(_run_window, (windows[k], window_dirs[k], init_model(k)))
+                i += 1
+
+            # 앞쪽 window 부터 기다린다. (worker 에러는 get() 에서 올라온다)
+            k = min(pending.keys())
+            scores[k] = pending.pop(k).get()
+            done[k] = True
+            print('[walk_forward] window {} done ({}/{})'.format(windows[k]['base_idx'], sum(done), n))
+
+    return scores
@@ -2,6 +2,9 @@
 import numpy as np
 import pandas as pd
 
+from timeseries.rolling import rolling_std, rolling_std_strided, drawdown
+from tf_additional.positional_encoding import positional_encoding
+
 
 def log_y_nd(log_p, n):
     assert len(log_p.shape) == 2
@@ -19,35 +22,22 @@ def fft(log_p, n, m_days, k_days):
 
 def std_nd(log_p, n):
     y = np.exp(log_y_nd(log_p, 1)) - 1.
-    stdarr = np.zeros_like(y)
-    for t in range(1, len(y)):
-        stdarr[t, :] = np.std(y[max(0, t - n):(t + 1), :], ddof=1, axis=0)
+    stdarr = rolling_std(y, n, ddof=1)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def std_nd_new(log_p, n):
     y = np.exp(log_y_nd(log_p, n)) - 1.
-    stdarr = np.zeros_like(y)
-    for t in range(1, len(y)):
-        stdarr[t, :] = np.std(y[max(0, t - n * 12):(t + 1), :][::n], ddof=1, axis=0)
+    stdarr = rolling_std_strided(y, n, n_steps=12, ddof=1)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def mdd_nd(log_p, n):
-    mddarr = np.zeros_like(log_p)
-    for t in range(len(log_p)):
-        mddarr[t, :] = log_p[t, :] - np.max(log_p[max(0, t - n):(t + 1), :], axis=0)
-
-    return mddarr
-
-
-def positional_encoding(seq_size, dim):
-    encoded_vec = np.array([pos / np.power(10000, 2 * i / dim) for pos in range(seq_size) for i in range(dim)], dtype=np.float32)
-    encoded_vec[::2] = np.sin(encoded_vec[::2])
-    encoded_vec[1::2] = np.cos(encoded_vec[1::2])
-    return encoded_vec.reshape([seq_size, dim])
+    return drawdown(log_p, n)
 
 
 class DataGeneratorIndex:
@@ -89,7 +79,7 @@ class DataGeneratorIndex:
             dataset[date_[i]]['data'] = tmp_all.transpose()
 
         seq_size, dim = dataset[date_[min_d]]['data'].shape
-        pos_encoding = positional_encoding(seq_size, dim)
+        pos_encoding = positional_encoding(dim, seq_size)
 
         train_start_d = date_[min_d]
         train_end_d = date_[1000]
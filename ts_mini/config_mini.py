@@ -23,6 +23,17 @@ class Config:
         self.use_beta = False
 
         self.balancing_method = 'each'  # each / once
+        self.use_feature_cube = False   # 전체 기간 feature 를 미리 계산해두고 윈도우는 잘라서 사용
+        self.feature_cube_path = './data/feature_cube/'
+        self.panel_cache_path = './data/panel_cache/'     # csv 원천 데이터의 npy 캐시
+        self.use_xla = False            # multi-task train/eval step XLA compile
+        self.ema_decay = None           # weight EMA 를 early stopping 대상으로 사용 (ex. 0.999, None: 사용 안함)
+        self.n_dataset_workers = 1      # base date 별 샘플링 프로세스 수 (1: 순차)
+        self.dataset_seed = None        # base date 별 np.random seed 의 기준값 (None: 전역 random 상태 사용)
+        self.use_dataset_cache = False  # train/eval/test 데이터셋을 디스크에 저장해두고 같은 조건이면 재사용
+                                        # (dataset_seed 가 None 이면 샘플링이 매번 달라야 하므로 사용되지 않음)
+        self.dataset_cache_path = './data/dataset_cache/'
+        self.dataset_cache_max_gb = 20.
 
         # features info
         self.set_features_info()
@@ -1,6 +1,12 @@
 
 # from dbmanager import SqlManager
 from ts_mini.utils_mini import *
+from timeseries.feature_cube import FeatureCube
+from timeseries.panel_cache import cached_frames, source_fingerprint, DEFAULT_CACHE_DIR
+from timeseries.dataset_cache import DatasetCache
+from timeseries.parallel_dataset import sample_base_dates, seeded_rng
+from timeseries.universe import UniverseIndex
+from timeseries.window_clean import PanelWindows
 # from ts_mini.features_mini import processing # processing_split, labels_for_mtl
 
 import pandas as pd
@@ -18,7 +24,9 @@ class DataScheduler:
         os.makedirs(self.data_out_path, exist_ok=True)
 
         # self.data_generator = DataGenerator(data_type)    # infocode
-        self.data_generator = DataGeneratorDynamic(features_cls, data_type, univ_type=univ_type, use_beta=configs.use_beta, delayed_days=configs.delayed_days)    # infocode
+        self.data_generator = DataGeneratorDynamic(features_cls, data_type, univ_type=univ_type, use_beta=configs.use_beta, delayed_days=configs.delayed_days,
+                                                   use_feature_cube=configs.use_feature_cube, cube_dir=configs.feature_cube_path,
+                                                   panel_cache_dir=configs.panel_cache_path)    # infocode
 
         self.train_set_length = configs.train_set_length
         self.retrain_days = configs.retrain_days
@@ -31,6 +39,26 @@ class DataScheduler:
         self.eval_batch_size = 256
         self.trainset_rate = configs.trainset_rate
 
+        # base date 별 샘플링 병렬 처리
+        self.n_dataset_workers = configs.n_dataset_workers
+        self.dataset_seed = configs.dataset_seed
+
+        # 같은 조건의 데이터셋은 디스크 캐시에서 읽는다.
+        # seed 가 없으면 balance_class / oversampling 이 매번 새로 샘플링되어야 하므로 캐시를 쓰지 않는다.
+        # seed 가 있으면 날짜별 샘플링과 'once' oversampling 모두 dataset_seed 로 정해지므로
+        # (n_dataset_workers 와 상관없이) 캐시된 결과는 다시 만든 결과와 같다.
+        self.dataset_cache = None
+        if configs.use_dataset_cache and configs.dataset_seed is None:
+            print('[dataset_cache] disabled: use_dataset_cache requires dataset_seed')
+        elif configs.use_dataset_cache:
+            self.dataset_cache = DatasetCache(configs.dataset_cache_path, max_bytes=int(configs.dataset_cache_max_gb * (1 << 30)))
+        self.dataset_key_info = {'data_type': data_type, 'univ_type': univ_type, 'use_beta': configs.use_beta,
+                                 'delayed_days': configs.delayed_days, 'balancing_method': configs.balancing_method,
+                                 'features_structure': features_cls.features_structure, 'label_feature': features_cls.label_feature,
+                                 'dataset_seed': configs.dataset_seed,
+                                 # 'once' oversampling 이 seed 되기 전에 저장된 캐시는 쓰지 않는다.
+                                 'sampling_rng': 2}
+
         self.features_cls = features_cls
         self._initialize()
 
@@ -100,21 +128,36 @@ class DataScheduler:
         return start_idx, end_idx, data_params, decaying_factor
 
     def _dataset(self, mode='train'):
+        if self.dataset_cache is None:
+            return self._build_dataset(mode)
+
+        start_idx, end_idx, data_params, decaying_factor = self.get_data_params(mode)
+        key = dict(self.dataset_key_info, mode=mode, start_idx=int(start_idx), end_idx=int(end_idx),
+                   data_params=data_params, decaying_factor=decaying_factor,
+                   sampling_days=self.sampling_days, data_fingerprint=self.data_generator.data_fingerprint)
+        return self.dataset_cache.get(key, lambda: self._build_dataset(mode))
+
+    def _build_dataset(self, mode='train'):
         input_enc, output_dec, target_dec = [], [], []  # test/predict 인경우 list, train/eval인 경우 array
         features_list = []
         additional_infos_list = []  # test/predict 인경우 list, train/eval인 경우 dict
         sampling_wgt = []  # time decaying factor
         start_idx, end_idx, data_params, decaying_factor = self.get_data_params(mode)
 
-        n_loop = np.ceil((end_idx - start_idx) / self.sampling_days)
-        for i, d in enumerate(range(start_idx, end_idx, self.sampling_days)):
-            if self.balancing_method in ['once', 'nothing']:
-                _sampled_data = self.data_generator.sample_inputdata_split_new3(d, **data_params)
-            elif self.balancing_method == 'each':
-                _sampled_data = self.data_generator.sample_inputdata_split_new2(d, **data_params)
-            else:
-                raise NotImplementedError
+        if self.balancing_method in ['once', 'nothing']:
+            sample_fn_name = 'sample_inputdata_split_new3'
+        elif self.balancing_method == 'each':
+            sample_fn_name = 'sample_inputdata_split_new2'
+        else:
+            raise NotImplementedError
 
+        n_loop = np.ceil((end_idx - start_idx) / self.sampling_days)
+        sampled_list = sample_base_dates(self.data_generator, sample_fn_name,
+                                         range(start_idx, end_idx, self.sampling_days),
+                                         data_params,
+                                         n_workers=self.n_dataset_workers,
+                                         seed=self.dataset_seed)
+        for i, _sampled_data in enumerate(sampled_list):
             if _sampled_data is False:
                 continue
             else:
@@ -144,12 +187,14 @@ class DataScheduler:
                 where_p = (np.squeeze(target_dec)[:, idx_label] > 0)
                 where_n = (np.squeeze(target_dec)[:, idx_label] <= 0)
                 n_max = np.max([np.sum(where_p), np.sum(where_n)])
-                idx_pos = np.concatenate([np.random.choice(np.where(where_p)[0], np.sum(where_p), replace=False),
-                                          np.random.choice(np.where(where_p)[0], n_max - np.sum(where_p),
-                                                           replace=True)])
-                idx_neg = np.concatenate([np.random.choice(np.where(where_n)[0], np.sum(where_n), replace=False),
-                                          np.random.choice(np.where(where_n)[0], n_max - np.sum(where_n),
-                                                           replace=True)])
+                # dataset_seed 가 있으면 (worker 수와 상관없이) 구간별로 같은 oversampling
+                rng = seeded_rng(self.dataset_seed, start_idx, end_idx, self.sampling_days)
+                idx_pos = np.concatenate([rng.choice(np.where(where_p)[0], np.sum(where_p), replace=False),
+                                          rng.choice(np.where(where_p)[0], n_max - np.sum(where_p),
+                                                     replace=True)])
+                idx_neg = np.concatenate([rng.choice(np.where(where_n)[0], np.sum(where_n), replace=False),
+                                          rng.choice(np.where(where_n)[0], n_max - np.sum(where_n),
+                                                     replace=True)])
 
                 idx_bal = np.concatenate([idx_pos, idx_neg])
                 input_enc, output_dec, target_dec = input_enc[idx_bal], output_dec[idx_bal], target_dec[idx_bal]
@@ -220,18 +265,22 @@ class DataScheduler:
         train_new_output[:, 0, :] = train_output_dec[:, 0, :] + train_size_value[:, 0, :]
         eval_new_output[:, 0, :] = eval_output_dec[:, 0, :] + eval_size_value[:, 0, :]
 
-        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, train_size_value, batch_size=self.train_batch_size, importance_wgt=train_importance_wgt)
-        eval_dataset = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, eval_size_value, batch_size=self.eval_batch_size, importance_wgt=eval_importance_wgt, iter_num=1)
+        # 라벨(labels_mtl)은 dataset.map 에서 만들어진다.
+        label_fn = self.features_cls.label_fn(features_list)
+        train_dataset = dataset_process(train_input_enc, train_new_output, train_target_dec, train_size_value, batch_size=self.train_batch_size, importance_wgt=train_importance_wgt,
+                                        label_fn=label_fn)
+        eval_dataset = dataset_process(eval_input_enc, eval_new_output, eval_target_dec, eval_size_value, batch_size=self.eval_batch_size, importance_wgt=eval_importance_wgt, iter_num=1,
+                                       label_fn=label_fn)
         print("train step: {}  eval step: {}".format(len(train_input_enc) // self.train_batch_size,
                                                      len(eval_input_enc) // self.eval_batch_size))
-        for i, (features, labels, size_values, importance_wgt) in enumerate(train_dataset.take(train_steps)):
+        for i, (features, labels_mtl) in enumerate(train_dataset.take(train_steps)):
             print_loss = False
             if i % save_steps == 0:
                 model.save_model(model_name)
 
             if i % eval_steps == 0:
                 print_loss = True
-                model.evaluate_mtl(eval_dataset, features_list, steps=len(eval_input_enc) // self.eval_batch_size)
+                model.evaluate_mtl(eval_dataset, steps=len(eval_input_enc) // self.eval_batch_size)
 
                 print("[t: {} / i: {}] min_eval_loss:{} / count:{}".format(self.base_idx, i, model.eval_loss, model.eval_count))
                 if model.eval_count >= early_stopping_count:
@@ -264,7 +313,6 @@ class DataScheduler:
 
                     features_with_noise['input'] = features_with_noise['input'] * mask
 
-            labels_mtl = self.features_cls.labels_for_mtl(features_list, labels, size_values, importance_wgt)
             model.train_mtl(features_with_noise, labels_mtl, print_loss=print_loss)
 
     def test(self, model, dataset=None, use_label=True, out_dir=None, file_nm='out.png', ylog=False, save_type=None, table_nm=None, time_step=1):
@@ -365,107 +413,179 @@ class DataScheduler:
             return False
 
 
-class DataGeneratorDynamic:
-    def __init__(self, features_cls, data_type='kr_stock', univ_type='all', use_beta=True, delayed_days=0):
-        if data_type == 'kr_stock':
-            data_path = './data/kr_close_y_90.csv'
-            data_df_temp = pd.read_csv(data_path)
-            data_df_temp = data_df_temp[data_df_temp.infocode > 0]
+KR_STOCK_SOURCES = ['./data/kr_close_y_90.csv', './data/kr_additional_info.csv']
+KR_UNIV_SOURCES = {'all': ['./data/kr_sizeinfo_90.csv'],
+                   'selected': ['./data/kr_mktcap_daily.csv', './data/date.csv', './data/kr_univ_monthly.csv']}
+
+
+def _pivot(df, value_col):
+    df_pivoted = df[['date_', 'infocode', value_col]].pivot(index='date_', columns='infocode')
+    df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
+    return df_pivoted
+
+
+def load_kr_stock_frames(univ_type):
+    # DataGeneratorDynamic 에서 쓰는 원천 데이터 (panel_cache 에서 한번만 실행된다.)
+    frames = dict()
+
+    data_path = './data/kr_close_y_90.csv'
+    data_df_temp = pd.read_csv(data_path)
+    data_df_temp = data_df_temp[data_df_temp.infocode > 0]
+
+    date_temp = data_df_temp[['date_', 'infocode']].groupby('date_').count()
+    date_temp = date_temp[date_temp.infocode >= 10]
+    date_temp.columns = ['cnt']
+
+    data_df = pd.merge(date_temp, data_df_temp, on='date_')  # 최소 10종목 이상 존재 하는 날짜만
+    data_df['y'] = data_df['y'] + 1
+    data_df['cum_y'] = data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
+
+    frames['cum_y'] = _pivot(data_df, 'cum_y')
 
-            date_temp = data_df_temp[['date_', 'infocode']].groupby('date_').count()
-            date_temp = date_temp[date_temp.infocode >= 10]
-            date_temp.columns = ['cnt']
+    if univ_type == 'all':
+        data_code = pd.read_csv('./data/kr_sizeinfo_90.csv')
+        frames['data_code'] = data_code[data_code.infocode > 0]
+    elif univ_type == 'selected':
+        # size_data = pd.read_csv('./data/kr_sizeinfo_90.csv')
+        size_data = pd.read_csv('./data/kr_mktcap_daily.csv')
+        size_data.columns = ['eval_d', 'infocode', 'mktcap', 'size_port']
+        size_data = size_data[size_data.infocode > 0]
+        size_data['mktcap'] = size_data['mktcap'] / 1000.
+        date_ = pd.read_csv('./data/date.csv')
+        data_code = pd.read_csv('./data/kr_univ_monthly.csv')
+        data_code = data_code[data_code.infocode > 0]
 
-            self.date_ = list(date_temp.index)
-            data_df = pd.merge(date_temp, data_df_temp, on='date_')  # 최소 10종목 이상 존재 하는 날짜만
-            data_df['y'] = data_df['y'] + 1
-            data_df['cum_y'] = data_df[['date_', 'infocode', 'y']].groupby('infocode').cumprod(axis=0)
+        w_date = pd.merge(data_code, date_, left_on='eval_d', right_on='work_m')
+        # data_code_w_size = pd.merge(w_date, size_data, left_on=['infocode', 'eval_y'], right_on=['infocode', 'eval_d'])
+        data_code_w_size = pd.merge(w_date, size_data, left_on=['infocode', 'work_m'], right_on=['infocode', 'eval_d'])
+        data_code = data_code_w_size.ix[:, ['eval_m', 'infocode', 'size_port', 'mktcap']]
+        data_code.columns = ['eval_d', 'infocode', 'size_port', 'mktcap']
+        frames['data_code'] = data_code
+        frames['size_data'] = size_data
 
-            self.df_pivoted_all = data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
-            self.df_pivoted_all.columns = self.df_pivoted_all.columns.droplevel(0).to_numpy(dtype=np.int32)
+    additional_df = pd.read_csv('./data/kr_additional_info.csv')
+    additional_df = additional_df[additional_df.infocode > 0]
+    for key in ['beta', 'ivol']:
+        # cum_y 와 같은 (날짜 x 종목) 축으로 맞춰 저장하고, 원래 있던 날짜/종목은 따로 둔다.
+        df_additional = _pivot(additional_df, key)
+        frames[key] = df_additional.reindex(index=frames['cum_y'].index, columns=frames['cum_y'].columns)
+        frames['{}_dates'.format(key)] = pd.DataFrame({'date_': df_additional.index})
+        frames['{}_codes'.format(key)] = pd.DataFrame({'infocode': df_additional.columns})
+
+    return frames
+
+
+class DataGeneratorDynamic:
+    def __init__(self, features_cls, data_type='kr_stock', univ_type='all', use_beta=True, delayed_days=0,
+                 use_feature_cube=False, cube_dir=None, panel_cache_dir=DEFAULT_CACHE_DIR):
+        if data_type == 'kr_stock':
+            # csv 파싱 / cumprod / pivot 결과는 panel_cache 에 저장해두고 memmap 으로 연다.
+            frames = cached_frames('kr_stock_{}'.format(univ_type),
+                                   KR_STOCK_SOURCES + KR_UNIV_SOURCES[univ_type],
+                                   lambda: load_kr_stock_frames(univ_type),
+                                   cache_dir=panel_cache_dir)
+            self.data_fingerprint = source_fingerprint('kr_stock_{}'.format(univ_type), cache_dir=panel_cache_dir)
+
+            self.df_pivoted_all = frames['cum_y']   # 최소 10종목 이상 존재 하는 날짜만
+            self.date_ = list(self.df_pivoted_all.index)
 
             self.univ_type = univ_type
-            if univ_type == 'all':
-                self.data_code = pd.read_csv('./data/kr_sizeinfo_90.csv')
-                self.data_code = self.data_code[self.data_code.infocode > 0]
-            elif univ_type == 'selected':
-                # size_data = pd.read_csv('./data/kr_sizeinfo_90.csv')
-                size_data = pd.read_csv('./data/kr_mktcap_daily.csv')
-                size_data.columns = ['eval_d', 'infocode', 'mktcap', 'size_port']
-                size_data = size_data[size_data.infocode > 0]
-                size_data['mktcap'] = size_data['mktcap'] / 1000.
-                date_ = pd.read_csv('./data/date.csv')
-                data_code = pd.read_csv('./data/kr_univ_monthly.csv')
-                data_code = data_code[data_code.infocode > 0]
-
-                w_date = pd.merge(data_code, date_, left_on='eval_d', right_on='work_m')
-                # data_code_w_size = pd.merge(w_date, size_data, left_on=['infocode', 'eval_y'], right_on=['infocode', 'eval_d'])
-                data_code_w_size = pd.merge(w_date, size_data, left_on=['infocode', 'work_m'], right_on=['infocode', 'eval_d'])
-                self.data_code = data_code_w_size.ix[:, ['eval_m', 'infocode', 'size_port', 'mktcap']]
-                self.data_code.columns = ['eval_d', 'infocode', 'size_port', 'mktcap']
-                self.size_data = size_data
-
-            additional_df = pd.read_csv('./data/kr_additional_info.csv')
-            additional_df = additional_df[additional_df.infocode > 0]
+            self.data_code = frames['data_code']
+            if univ_type == 'selected':
+                self.size_data = frames['size_data']
+
+            # 윈도우 정제용 (유효값 누적 개수, 이전/다음 유효 행)
+            self.price_windows = PanelWindows(self.df_pivoted_all.values)
 
             self.use_beta = use_beta
             if use_beta:
-                self.df_beta_all = additional_df[['date_', 'infocode', 'beta']].pivot(index='date_', columns='infocode')
-                self.df_beta_all.columns = self.df_beta_all.columns.droplevel(0).to_numpy(dtype=np.int32)
-
-                self.df_ivol_all = additional_df[['date_', 'infocode', 'ivol']].pivot(index='date_', columns='infocode')
-                self.df_ivol_all.columns = self.df_ivol_all.columns.droplevel(0).to_numpy(dtype=np.int32)
+                # beta / ivol 은 df_pivoted_all 과 같은 축 (원래 없던 날짜는 additional_date_exists 로 구분)
+                self.df_beta_all = frames['beta']
+                self.df_ivol_all = frames['ivol']
+                self.additional_windows = {'beta': PanelWindows(self.df_beta_all.values),
+                                           'ivol': PanelWindows(self.df_ivol_all.values)}
+                self.additional_date_exists = self.df_pivoted_all.index.isin(frames['beta_dates']['date_']) \
+                                              & self.df_pivoted_all.index.isin(frames['ivol_dates']['date_'])
+
+            # (리밸런싱 날짜 x 종목) 유니버스 포함 여부. 선택된 종목은 df_pivoted_all 의 열 인덱스(univ_col_idx)로 둔다.
+            self.universe = UniverseIndex(self.df_pivoted_all.columns, self.data_code,
+                                          size_data=self.size_data if univ_type == 'selected' else None)
+            if use_beta:
+                self.universe.require_columns(frames['beta_codes']['infocode'])
+                self.universe.require_columns(frames['ivol_codes']['infocode'])
 
             self.base_d = None
+            self.univ_col_idx = np.zeros([0], dtype=np.int64)
 
             self.features_cls = features_cls
             self.delayed_days = delayed_days
 
-    def _set_df_pivoted(self, base_idx, univ_idx):
+            # 전체 기간/전체 종목 feature 를 한번만 계산해두고 윈도우는 잘라서 쓴다. (유니버스와 무관)
+            self.feature_cube = None
+            if use_feature_cube:
+                self.feature_cube = FeatureCube(self.df_pivoted_all.values, features_cls.cube_specs(), cache_dir=cube_dir)
 
-        date_arr = self.data_code.eval_d.unique()
+    def _cube_view(self, df_for_calc):
+        if self.feature_cube is None:
+            return None
+        start_idx = self.df_pivoted_all.index.get_loc(df_for_calc.index[0])
+        col_idx = self.df_pivoted_all.columns.get_indexer(df_for_calc.columns)
+        return self.feature_cube.view(start_idx, col_idx)
+
+    def _set_df_pivoted(self, base_idx, univ_idx):
         if univ_idx is None:
             univ_idx = base_idx
 
-        if (np.sum(date_arr <= self.date_[base_idx]) == 0) or (np.sum(date_arr <= self.date_[univ_idx]) == 0):
+        base_pos = self.universe.rebalance_pos(self.date_[base_idx])
+        univ_pos = self.universe.rebalance_pos(self.date_[univ_idx])
+        if (base_pos < 0) or (univ_pos < 0):
             return False
 
-        size_list = list(self.size_data[self.size_data.eval_d == self.date_[base_idx]]['infocode'].to_numpy(dtype=np.int32))
-
-        base_d = max(date_arr[date_arr <= self.date_[base_idx]])
+        base_d = self.universe.univ.dates[base_pos]
 
         if self.base_d != base_d:
             # print('base_d changed {} -> {}'.format(self.base_d, base_d))
             self.base_d = base_d
 
-            univ_d = max(date_arr[date_arr <= self.date_[univ_idx]])
-            univ_list = list(self.data_code[self.data_code.eval_d == univ_d]['infocode'].to_numpy(dtype=np.int32))
-            base_list = list(self.data_code[self.data_code.eval_d == base_d]['infocode'].to_numpy(dtype=np.int32))
-
-            # df_pivoted = self.data_df[['date_', 'infocode', 'cum_y']].pivot(index='date_', columns='infocode')
-            # df_pivoted.columns = df_pivoted.columns.droplevel(0).to_numpy(dtype=np.int32)
-            if self.use_beta:
-                univ_list_selected = sorted(list(set.intersection(set(univ_list),
-                                                                  set(base_list),
-                                                                  set(size_list),
-                                                                  set(self.df_pivoted_all.columns),
-                                                                  set(self.df_beta_all.columns),
-                                                                  set(self.df_ivol_all.columns))))
-
-                self.df_beta = self.df_beta_all[univ_list_selected]
-                self.df_ivol = self.df_ivol_all[univ_list_selected]
-            else:
-                univ_list_selected = sorted(list(set.intersection(set(univ_list), set(base_list), set(size_list), set(self.df_pivoted_all.columns))))
-
-            self.df_pivoted = self.df_pivoted_all[univ_list_selected]
+            self.univ_col_idx = self.universe.select(base_pos, univ_pos, size_d=self.date_[base_idx])
             # self.df_size = self.data_code[self.data_code.eval_d == base_d][['infocode', 'mktcap']].set_index('infocode').loc[univ_list_selected, :]
             # self.df_size['rnk'] = self.df_size.mktcap.rank() / len(self.df_size)
-            self.df_size = self.size_data[self.size_data.eval_d == self.date_[base_idx]][['infocode', 'mktcap']].set_index('infocode').loc[univ_list_selected, :]
+            self.df_size = pd.DataFrame({'mktcap': self.universe.mktcap(self.univ_col_idx, base_pos, size_d=self.date_[base_idx])},
+                                        index=pd.Index(self.universe.codes[self.univ_col_idx], name='infocode'))
             self.df_size['rnk'] = self.df_size.mktcap.rank() / len(self.df_size)
-            assert self.df_pivoted.shape[1] == self.df_size.shape[0]
+            assert len(self.univ_col_idx) == self.df_size.shape[0]
 
         return True
 
+    def _clean_window(self, start_idx, end_idx, codes=None):
+        # codes 가 없으면 유니버스 종목 중 90% 이상 데이터 존재 종목 -> ffill -> bfill -> 맨 앞쪽 NA 종목 제거
+        # (numpy 로 하지만 기존 pandas 정제와 같은 결과)
+        # 데이터 끝을 넘는 window (ex. 마지막 날짜들의 label) 는 샘플을 만들지 않는다. (False)
+        if end_idx >= len(self.price_windows):
+            return False
+        if start_idx < 0:
+            return self.df_pivoted_all.iloc[0:0, self.univ_col_idx]
+
+        if codes is None:
+            col_idx, values = self.price_windows.clean(start_idx, end_idx, self.univ_col_idx)
+        else:
+            col_idx, values = self.price_windows.clean(start_idx, end_idx, self.df_pivoted_all.columns.get_indexer(codes), min_rate=0.)
+
+        return pd.DataFrame(values,
+                            index=self.df_pivoted_all.index[start_idx:(end_idx + 1)],
+                            columns=self.df_pivoted_all.columns[col_idx])
+
+    def _additional_window(self, df_for_calc, codes, check_dates=True):
+        # beta / ivol 도 같은 날짜, 종목으로 ffill -> bfill. (check_dates 이고 데이터 없는 날짜가 있으면 None)
+        start_idx = self.df_pivoted_all.index.get_loc(df_for_calc.index[0])
+        end_idx = start_idx + len(df_for_calc) - 1
+        if check_dates and not self.additional_date_exists[start_idx:(end_idx + 1)].all():
+            return None
+
+        col_idx = self.df_pivoted_all.columns.get_indexer(codes)
+        return {key: pd.DataFrame(windows.fill(start_idx, end_idx, col_idx), index=df_for_calc.index, columns=codes)
+                for key, windows in self.additional_windows.items()}
+
     def make_market_idx(self, df_for_data, mktcap, m_days, sampling_days, calc_length, label_type, delayed_days, additional_dict):
         log_p = np.log(df_for_data.values, dtype=np.float32)
         log_p = log_p - log_p[0, :]
@@ -500,16 +620,10 @@ class DataGeneratorDynamic:
             return False
 
         # 미래데이터 원천 제거
-        df_selected_data = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                           & (self.df_pivoted.index <= self.date_[base_idx])]
+        # 현재기준 데이터 정제 (90% 이상 데이터 존재 -> ffill -> bfill -> 맨 앞쪽 NA 제거)
+        df_for_data = self._clean_window(base_idx - m_days - calc_length, base_idx)
 
-        # 현재기준 데이터 정제
-        df_for_data = df_selected_data.ix[:, np.sum(~df_selected_data.isna(), axis=0) >= len(df_selected_data.index) * 0.9]  # 90% 이상 데이터 존재
-        df_for_data.ffill(axis=0, inplace=True)
-        df_for_data.bfill(axis=0, inplace=True)
-        df_for_data = df_for_data.ix[:, np.sum(df_for_data.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
-
-        if df_for_data.empty:
+        if df_for_data is False or df_for_data.empty:
             return False
 
 
@@ -521,20 +635,11 @@ class DataGeneratorDynamic:
         assert df_for_data.shape[-1] == size_adjusted_factor_mktcap.shape[0]
         if self.use_beta:
             # beta & ivol
-            if (len(set.difference(set(df_for_data.index), set(self.df_beta.index))) > 0) or \
-                    (len(set.difference(set(df_for_data.index), set(self.df_ivol.index))) > 0):
+            additional_dict = self._additional_window(df_for_data, df_for_data.columns)
+            if additional_dict is None:
                 print('no beta/ivol data')
                 return False
 
-            df_beta_data = self.df_beta.loc[df_for_data.index, df_for_data.columns]
-            df_ivol_data = self.df_ivol.loc[df_for_data.index, df_for_data.columns]
-            df_beta_data.ffill(axis=0, inplace=True)
-            df_beta_data.bfill(axis=0, inplace=True)
-            df_ivol_data.ffill(axis=0, inplace=True)
-            df_ivol_data.bfill(axis=0, inplace=True)
-
-            additional_dict = {'beta': df_beta_data, 'ivol': df_ivol_data}
-
         features_list, features_sampled_data, _ = self.features_cls.processing_split_new(df_for_data,
                                                                                          m_days=m_days,
                                                                                          # k_days=k_days,
@@ -542,7 +647,8 @@ class DataGeneratorDynamic:
                                                                                          calc_length=calc_length,
                                                                                          label_type=None,
                                                                                          delayed_days=self.delayed_days,
-                                                                                         additional_dict=additional_dict)
+                                                                                         additional_dict=additional_dict,
+                                                                                         cube_view=self._cube_view(df_for_data))
 
         # _, mkt_sampled_data = self.make_market_idx(df_for_data, size_adjusted_factor_mktcap, m_days, sampling_days,
         #                                            calc_length, None, self.delayed_days, additional_dict)
@@ -554,25 +660,13 @@ class DataGeneratorDynamic:
         # ##### 라벨
         if label_type in ['trainable_label', 'test_label']:
             # 1 day adj.
-            df_selected_label = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                                & (self.df_pivoted.index <= self.date_[base_idx + (k_days + self.delayed_days)])]  # 하루 뒤 데이터
-
-            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제
-            df_for_label = df_selected_label.loc[:, df_for_data.columns]
-            df_for_label.ffill(axis=0, inplace=True)
-            df_for_label.bfill(axis=0, inplace=True)
-            df_for_label = df_for_label.ix[:, np.sum(df_for_label.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제 (하루 뒤 데이터)
+            df_for_label = self._clean_window(base_idx - m_days - calc_length, base_idx + (k_days + self.delayed_days), codes=df_for_data.columns)
+            if df_for_label is False:
+                return False
 
             if self.use_beta:
-                df_beta_label = self.df_beta.loc[df_for_label.index, df_for_data.columns]
-                df_ivol_label = self.df_ivol.loc[df_for_label.index, df_for_data.columns]
-
-                df_beta_label.ffill(axis=0, inplace=True)
-                df_beta_label.bfill(axis=0, inplace=True)
-                df_ivol_label.ffill(axis=0, inplace=True)
-                df_ivol_label.bfill(axis=0, inplace=True)
-
-                additional_dict = {'beta': df_beta_label, 'ivol': df_ivol_label}
+                additional_dict = self._additional_window(df_for_label, df_for_data.columns, check_dates=False)
             _, features_data_for_label, features_sampled_label = self.features_cls.processing_split_new(df_for_label,
                                                                                                         m_days=m_days,
                                                                                                         # k_days=k_days,
@@ -580,7 +674,8 @@ class DataGeneratorDynamic:
                                                                                                         calc_length=calc_length,
                                                                                                         label_type=label_type,
                                                                                                         delayed_days=self.delayed_days,
-                                                                                                        additional_dict=additional_dict)
+                                                                                                        additional_dict=additional_dict,
+                                                                                                        cube_view=self._cube_view(df_for_label))
 
             # _, mkt_sampled_label = self.make_market_idx(df_for_label, size_adjusted_factor_mktcap, m_days, sampling_days,
             #                                             calc_length, None, self.delayed_days, additional_dict)
@@ -636,36 +731,21 @@ class DataGeneratorDynamic:
             return False
 
         # 미래데이터 원천 제거
-        df_selected_data = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                           & (self.df_pivoted.index <= self.date_[base_idx])]
+        # 현재기준 데이터 정제 (90% 이상 데이터 존재 -> ffill -> bfill -> 맨 앞쪽 NA 제거)
+        df_for_data = self._clean_window(base_idx - m_days - calc_length, base_idx)
 
-        # 현재기준 데이터 정제
-        df_for_data = df_selected_data.ix[:, np.sum(~df_selected_data.isna(), axis=0) >= len(df_selected_data.index) * 0.9]  # 90% 이상 데이터 존재
-        df_for_data.ffill(axis=0, inplace=True)
-        df_for_data.bfill(axis=0, inplace=True)
-        df_for_data = df_for_data.ix[:, np.sum(df_for_data.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
-
-        if df_for_data.empty:
+        if df_for_data is False or df_for_data.empty:
             return False
 
         additional_info = {'date': self.date_[base_idx], 'assets_list': list(df_for_data.columns)}
         additional_dict = None
         if self.use_beta:
             # beta & ivol
-            if (len(set.difference(set(df_for_data.index), set(self.df_beta.index))) > 0) or \
-                    (len(set.difference(set(df_for_data.index), set(self.df_ivol.index))) > 0):
+            additional_dict = self._additional_window(df_for_data, df_for_data.columns)
+            if additional_dict is None:
                 print('no beta/ivol data')
                 return False
 
-            df_beta_data = self.df_beta.loc[df_for_data.index, df_for_data.columns]
-            df_ivol_data = self.df_ivol.loc[df_for_data.index, df_for_data.columns]
-            df_beta_data.ffill(axis=0, inplace=True)
-            df_beta_data.bfill(axis=0, inplace=True)
-            df_ivol_data.ffill(axis=0, inplace=True)
-            df_ivol_data.bfill(axis=0, inplace=True)
-
-            additional_dict = {'beta': df_beta_data, 'ivol': df_ivol_data}
-
         features_list, features_sampled_data, _ = self.features_cls.processing_split_new(df_for_data,
                                                                                          m_days=m_days,
                                                                                          # k_days=k_days,
@@ -673,7 +753,8 @@ class DataGeneratorDynamic:
                                                                                          calc_length=calc_length,
                                                                                          label_type=None,
                                                                                          delayed_days=self.delayed_days,
-                                                                                         additional_dict=additional_dict)
+                                                                                         additional_dict=additional_dict,
+                                                                                         cube_view=self._cube_view(df_for_data))
         M = m_days // sampling_days
 
         assert features_sampled_data.shape[0] == M
@@ -681,25 +762,13 @@ class DataGeneratorDynamic:
         # ##### 라벨
         if label_type in ['trainable_label', 'test_label']:
             # 1 day adj.
-            df_selected_label = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                                & (self.df_pivoted.index <= self.date_[base_idx + (k_days + self.delayed_days)])]  # 하루 뒤 데이터
-
-            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제
-            df_for_label = df_selected_label.loc[:, df_for_data.columns]
-            df_for_label.ffill(axis=0, inplace=True)
-            df_for_label.bfill(axis=0, inplace=True)
-            df_for_label = df_for_label.ix[:, np.sum(df_for_label.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제 (하루 뒤 데이터)
+            df_for_label = self._clean_window(base_idx - m_days - calc_length, base_idx + (k_days + self.delayed_days), codes=df_for_data.columns)
+            if df_for_label is False:
+                return False
 
             if self.use_beta:
-                df_beta_label = self.df_beta.loc[df_for_label.index, df_for_data.columns]
-                df_ivol_label = self.df_ivol.loc[df_for_label.index, df_for_data.columns]
-
-                df_beta_label.ffill(axis=0, inplace=True)
-                df_beta_label.bfill(axis=0, inplace=True)
-                df_ivol_label.ffill(axis=0, inplace=True)
-                df_ivol_label.bfill(axis=0, inplace=True)
-
-                additional_dict = {'beta': df_beta_label, 'ivol': df_ivol_label}
+                additional_dict = self._additional_window(df_for_label, df_for_data.columns, check_dates=False)
             _, features_data_for_label, features_sampled_label = self.features_cls.processing_split_new(df_for_label,
                                                                                                         m_days=m_days,
                                                                                                         # k_days=k_days,
@@ -707,7 +776,8 @@ class DataGeneratorDynamic:
                                                                                                         calc_length=calc_length,
                                                                                                         label_type=label_type,
                                                                                                         delayed_days=self.delayed_days,
-                                                                                                        additional_dict=additional_dict)
+                                                                                                        additional_dict=additional_dict,
+                                                                                                        cube_view=self._cube_view(df_for_label))
             # features_for_label = features_for_label[calc_length:]
 
             assert np.sum(features_sampled_data - features_data_for_label) == 0
@@ -791,16 +861,10 @@ class DataGeneratorDynamic:
         if not is_data_exist:
             return False
 
-        df_selected_data = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                           & (self.df_pivoted.index <= self.date_[base_idx])]
-
-        # 현재기준 데이터 정제
-        df_for_data = df_selected_data.ix[:, np.sum(~df_selected_data.isna(), axis=0) >= len(df_selected_data.index) * 0.9]  # 90% 이상 데이터 존재
-        df_for_data.ffill(axis=0, inplace=True)
-        df_for_data.bfill(axis=0, inplace=True)
-        df_for_data = df_for_data.ix[:, np.sum(df_for_data.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+        # 현재기준 데이터 정제 (90% 이상 데이터 존재 -> ffill -> bfill -> 맨 앞쪽 NA 제거)
+        df_for_data = self._clean_window(base_idx - m_days - calc_length, base_idx)
 
-        if df_for_data.empty:
+        if df_for_data is False or df_for_data.empty:
             return False
 
 
@@ -808,20 +872,11 @@ class DataGeneratorDynamic:
         additional_dict = None
         if self.use_beta:
             # beta & ivol
-            if (len(set.difference(set(df_for_data.index), set(self.df_beta.index))) > 0) or \
-                    (len(set.difference(set(df_for_data.index), set(self.df_ivol.index))) > 0):
+            additional_dict = self._additional_window(df_for_data, df_for_data.columns)
+            if additional_dict is None:
                 print('no beta/ivol data')
                 return False
 
-            df_beta = self.df_beta.loc[df_for_data.index, df_for_data.columns]
-            df_ivol = self.df_ivol.loc[df_for_data.index, df_for_data.columns]
-            df_beta.ffill(axis=0, inplace=True)
-            df_beta.bfill(axis=0, inplace=True)
-            df_ivol.ffill(axis=0, inplace=True)
-            df_ivol.bfill(axis=0, inplace=True)
-
-            additional_dict = {'beta': df_beta, 'ivol': df_ivol}
-
         features_list, features_sampled_data, _ = self.features_cls.processing_split_new(df_for_data,
                                                                                          m_days=m_days,
                                                                                          # k_days=k_days,
@@ -839,25 +894,13 @@ class DataGeneratorDynamic:
         if label_type == 'trainable_label':
             # 미래데이터 포함 라벨 생성
             # 1 day adj.
-            df_selected_label = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                                & (self.df_pivoted.index <= self.date_[base_idx + (k_days + self.delayed_days) + calc_length])]  # 하루 뒤 데이터
-
-            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제
-            df_for_label = df_selected_label.loc[:, df_for_data.columns]
-            df_for_label.ffill(axis=0, inplace=True)
-            df_for_label.bfill(axis=0, inplace=True)
-            df_for_label = df_for_label.ix[:, np.sum(df_for_label.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+            # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제 (하루 뒤 데이터)
+            df_for_label = self._clean_window(base_idx - m_days - calc_length, base_idx + (k_days + self.delayed_days) + calc_length, codes=df_for_data.columns)
+            if df_for_label is False:
+                return False
 
             if self.use_beta:
-                df_beta = self.df_beta.loc[df_for_label.index, df_for_data.columns]
-                df_ivol = self.df_ivol.loc[df_for_label.index, df_for_data.columns]
-
-                df_beta.ffill(axis=0, inplace=True)
-                df_beta.bfill(axis=0, inplace=True)
-                df_ivol.ffill(axis=0, inplace=True)
-                df_ivol.bfill(axis=0, inplace=True)
-
-                additional_dict = {'beta': df_beta, 'ivol': df_ivol}
+                additional_dict = self._additional_window(df_for_label, df_for_data.columns, check_dates=False)
             _, features_data_for_label, features_sampled_label = self.features_cls.processing_split_new(df_for_label,
                                                                                                         m_days=m_days,
                                                                                                         # k_days=k_days,
@@ -871,25 +914,13 @@ class DataGeneratorDynamic:
             assert np.sum(features_sampled_data - features_data_for_label) == 0
         elif label_type == 'test_label':
             # 1 day adj.
-            df_selected_label = self.df_pivoted[(self.df_pivoted.index >= self.date_[base_idx - m_days - calc_length])
-                                                & (self.df_pivoted.index <= self.date_[base_idx + (k_days + self.delayed_days)])]
-
             # 현재기준으로 정제된 종목 기준 라벨 데이터 생성 및 정제
-            df_for_label = df_selected_label.loc[:, df_for_data.columns]
-            df_for_label.ffill(axis=0, inplace=True)
-            df_for_label.bfill(axis=0, inplace=True)
-            df_for_label = df_for_label.ix[:, np.sum(df_for_label.isna(), axis=0) == 0]    # 맨 앞쪽 NA 제거
+            df_for_label = self._clean_window(base_idx - m_days - calc_length, base_idx + (k_days + self.delayed_days), codes=df_for_data.columns)
+            if df_for_label is False:
+                return False
 
             if self.use_beta:
-                df_beta = self.df_beta.loc[df_for_label.index, df_for_data.columns]
-                df_ivol = self.df_ivol.loc[df_for_label.index, df_for_data.columns]
-
-                df_beta.ffill(axis=0, inplace=True)
-                df_beta.bfill(axis=0, inplace=True)
-                df_ivol.ffill(axis=0, inplace=True)
-                df_ivol.bfill(axis=0, inplace=True)
-
-                additional_dict = {'beta': df_beta, 'ivol': df_ivol}
+                additional_dict = self._additional_window(df_for_label, df_for_data.columns, check_dates=False)
 
             _, features_data_for_label, features_sampled_label = self.features_cls.processing_split_new(df_for_label,
                                                                                                         m_days=m_days,
@@ -974,7 +1005,7 @@ def rearrange(input, output, target, size_value, importance_wgt):
 
 
 # 학습에 들어가 배치 데이터를 만드는 함수이다.
-def dataset_process(input_enc, output_dec, target_dec, size_value, batch_size, importance_wgt=None, shuffle=True, iter_num=None):
+def dataset_process(input_enc, output_dec, target_dec, size_value, batch_size, importance_wgt=None, shuffle=True, iter_num=None, label_fn=None):
     # Dataset을 생성하는 부분으로써 from_tensor_slices부분은
     # 각각 한 문장으로 자른다고 보면 된다.
     # train_input_enc, train_output_dec, train_target_dec
@@ -992,12 +1023,16 @@ def dataset_process(input_enc, output_dec, target_dec, size_value, batch_size, i
     # 데이터 각 요소에 대해서 rearrange 함수를
     # 통해서 요소를 변환하여 맵으로 구성한다.
     dataset = dataset.map(rearrange)
+    # label_fn (Feature.label_fn) 이 있으면 라벨도 여기서 만든다.
+    if label_fn is not None:
+        dataset = dataset.map(label_fn, num_parallel_calls=tf.data.experimental.AUTOTUNE)
     # repeat()함수에 원하는 에포크 수를 넣을수 있으면
     # 아무 인자도 없다면 무한으로 이터레이터 된다.
     if iter_num is None:
         dataset = dataset.repeat()
     else:
         dataset = dataset.repeat(iter_num)
+    dataset = dataset.prefetch(tf.data.experimental.AUTOTUNE)
     # make_one_shot_iterator를 통해 이터레이터를
     # 만들어 준다.
     # 이터레이터를 통해 다음 항목의 텐서
@@ -1,9 +1,13 @@
 
+import functools
 import numpy as np
 import os
 import pandas as pd
+import tensorflow as tf
 from matplotlib import cm, pyplot as plt
 
+from timeseries.rolling import rolling_std, rolling_std_strided, drawdown
+
 
 def log_y_nd(log_p, n):
     assert len(log_p.shape) == 2
@@ -21,28 +25,22 @@ def fft(log_p, n, m_days, k_days):
 
 def std_nd(log_p, n):
     y = np.exp(log_y_nd(log_p, 1)) - 1.
-    stdarr = np.zeros_like(y)
-    for t in range(1, len(y)):
-        stdarr[t, :] = np.std(y[max(0, t - n):(t + 1), :], axis=0)
+    stdarr = rolling_std(y, n)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def std_nd_new(log_p, n):
     y = np.exp(log_y_nd(log_p, n)) - 1.
-    stdarr = np.zeros_like(y)
-    for t in range(1, len(y)):
-        stdarr[t, :] = np.std(y[max(0, t - n * 12):(t + 1), :][::n], axis=0)
+    stdarr = rolling_std_strided(y, n, n_steps=12)
+    stdarr[:1] = 0.
 
     return stdarr
 
 
 def mdd_nd(log_p, n):
-    mddarr = np.zeros_like(log_p)
-    for t in range(len(log_p)):
-        mddarr[t, :] = log_p[t, :] - np.max(log_p[max(0, t - n):(t + 1), :], axis=0)
-
-    return mddarr
+    return drawdown(log_p, n)
 
 
 def arr_to_cs(arr):
@@ -113,8 +111,59 @@ class Feature:
 
         return labels_mtl
 
+    def label_fn(self, features_list):
+        # labels_for_mtl 과 같은 라벨을 dataset.map 에서 만드는 함수 (features_list 위치는 한번만 찾아둔다.)
+        class_idx, regression_idx = dict(), dict()
+        for cls in self.features_structure.keys():
+            for key in self.features_structure[cls].keys():
+                n_arr = self.features_structure[cls][key]
+                if cls == 'classification':
+                    for n in n_arr:
+                        feature_nm = '{}_{}'.format(key, n)
+                        class_idx[feature_nm] = features_list.index(feature_nm)
+                else:
+                    regression_idx[key] = [features_list.index("{}_{}".format(key, n)) for n in n_arr]
+
+        def to_labels_mtl(features, labels, size_value, importance_wgt):
+            labels_mtl = dict()
+            for key, idx in class_idx.items():
+                labels_mtl[key] = tf.cast(tf.stack([labels[:, :, idx] > 0, labels[:, :, idx] <= 0], axis=-1), labels.dtype)
+            for key, idx in regression_idx.items():
+                labels_mtl[key] = tf.gather(labels, idx, axis=-1)
+
+            labels_mtl['size_value'] = size_value
+            labels_mtl['importance_wgt'] = importance_wgt
+            return features, labels_mtl
+
+        return to_labels_mtl
+
+    def cube_specs(self):
+        # 윈도우 원점과 무관한 feature: {name: (fn, lookback)} (timeseries.feature_cube 참고)
+        n_dict = {'logy': set(), 'std': set(), 'stdnew': set()}
+        for cls in self.features_structure.keys():
+            for key in self.features_structure[cls].keys():
+                base_key = {'cslogy': 'logy', 'csstd': 'stdnew'}.get(key, key)
+                if base_key in n_dict:
+                    n_dict[base_key].update(self.features_structure[cls][key])
+        n_dict['logy'].add(int(self.label_feature.split('_')[1]))
+
+        specs = dict()
+        for n in n_dict['logy']:
+            specs['logy_{}'.format(n)] = (functools.partial(log_y_nd, n=n), n)
+        for n in n_dict['std']:
+            specs['std_{}'.format(n)] = (functools.partial(std_nd, n=n), n + 1)
+        for n in n_dict['stdnew']:
+            # stride 윈도우(12개) 안의 모든 행이 n 이후여야 원점과 무관하다.
+            specs['stdnew_{}'.format(n)] = (functools.partial(std_nd_new, n=n), 13 * n)
+        return specs
+
+    def _rolling_feature(self, cube_view, key, nd, log_p):
+        if cube_view is None:
+            return {'logy': log_y_nd, 'std': std_nd, 'stdnew': std_nd_new}[key](log_p, nd)
+        return cube_view.get('{}_{}'.format(key, nd), log_p)
+
     def processing_split_new(self, df_not_null, m_days, sampling_days, calc_length=0, label_type=None,
-                             delayed_days=0, additional_dict=None):
+                             delayed_days=0, additional_dict=None, cube_view=None):
         # if type(df.columns) == pd.MultiIndex:
         #     df.columns = df.columns.droplevel(0)
         features_data_dict = dict()
@@ -139,11 +188,11 @@ class Feature:
                     features_data_dict[key] = dict()
                     for nd in self.features_structure[cls][key]:
                         if key in ['logy']:
-                            features_data_dict[key][str(nd)] = log_y_nd(log_p, nd)[calc_length:][:(m_days+1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'logy', nd, log_p)[calc_length:][:(m_days+1)]
                         elif key == 'std':
-                            features_data_dict[key][str(nd)] = std_nd(log_p, nd)[calc_length:][:(m_days + 1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'std', nd, log_p)[calc_length:][:(m_days + 1)]
                         elif key == 'stdnew':
-                            features_data_dict[key][str(nd)] = std_nd_new(log_p, nd)[calc_length:][:(m_days + 1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'stdnew', nd, log_p)[calc_length:][:(m_days + 1)]
                         elif key == 'pos':
                             features_data_dict[key][str(nd)] = np.sign(features_data_dict['logy'][str(nd)])
                         elif key == 'mdd':
@@ -151,9 +200,9 @@ class Feature:
                         elif key == 'fft':
                             features_data_dict[key][str(nd)] = fft(log_p_wo_calc, nd, m_days, k_days_adj)[:(m_days + 1)]
                         elif key == 'cslogy':
-                            features_data_dict[key][str(nd)] = arr_to_cs(log_y_nd(log_p, nd)[calc_length:][:(m_days+1)])
+                            features_data_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'logy', nd, log_p)[calc_length:][:(m_days+1)])
                         elif key == 'csstd':
-                            features_data_dict[key][str(nd)] = arr_to_cs(std_nd_new(log_p, nd)[calc_length:][:(m_days + 1)])
+                            features_data_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'stdnew', nd, log_p)[calc_length:][:(m_days + 1)])
 
         else:
             # 1 day adj.
@@ -168,11 +217,11 @@ class Feature:
                     features_data_dict[key] = dict()
                     for nd in self.features_structure[cls][key]:
                         if key in ['logy']:
-                            features_data_dict[key][str(nd)] = log_y_nd(log_p, nd)[calc_length:][:(m_days+1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'logy', nd, log_p)[calc_length:][:(m_days+1)]
                         elif key == 'std':
-                            features_data_dict[key][str(nd)] = std_nd(log_p, nd)[calc_length:][:(m_days + 1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'std', nd, log_p)[calc_length:][:(m_days + 1)]
                         elif key == 'stdnew':
-                            features_data_dict[key][str(nd)] = std_nd_new(log_p, nd)[calc_length:][:(m_days + 1)]
+                            features_data_dict[key][str(nd)] = self._rolling_feature(cube_view, 'stdnew', nd, log_p)[calc_length:][:(m_days + 1)]
                         elif key == 'pos':
                             features_data_dict[key][str(nd)] = np.sign(features_data_dict['logy'][str(nd)])
                         elif key == 'mdd':
@@ -180,9 +229,9 @@ class Feature:
                         elif key == 'fft':
                             features_data_dict[key][str(nd)] = fft(log_p_wo_calc, nd, m_days, k_days_adj)[:(m_days + 1)]
                         elif key == 'cslogy':
-                            features_data_dict[key][str(nd)] = arr_to_cs(log_y_nd(log_p, nd)[calc_length:][:(m_days+1)])
+                            features_data_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'logy', nd, log_p)[calc_length:][:(m_days+1)])
                         elif key == 'csstd':
-                            features_data_dict[key][str(nd)] = arr_to_cs(std_nd_new(log_p, nd)[calc_length:][:(m_days + 1)])
+                            features_data_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'stdnew', nd, log_p)[calc_length:][:(m_days + 1)])
 
             if label_type == 'trainable_label':
                 # 1 day adj.
@@ -195,11 +244,11 @@ class Feature:
                         for nd in self.features_structure[cls][key]:
                             n_freq = np.min([n_days, nd]) + delayed_days
                             if key == 'logy':
-                                features_label_dict[key][str(nd)] = log_y_nd(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
+                                features_label_dict[key][str(nd)] = self._rolling_feature(cube_view, 'logy', nd, log_p)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
                             elif key == 'std':
-                                features_label_dict[key][str(nd)] = std_nd(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
+                                features_label_dict[key][str(nd)] = self._rolling_feature(cube_view, 'std', nd, log_p)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
                             elif key == 'stdnew':
-                                features_label_dict[key][str(nd)] = std_nd_new(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
+                                features_label_dict[key][str(nd)] = self._rolling_feature(cube_view, 'stdnew', nd, log_p)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
                             elif key == 'pos':
                                 features_label_dict[key][str(nd)] = np.sign(features_label_dict['logy'][str(nd)])
                             elif key == 'mdd':
@@ -207,12 +256,12 @@ class Feature:
                             elif key == 'fft':
                                 features_label_dict[key][str(nd)] = fft(log_p_wo_calc, nd, m_days, k_days_adj)[m_days:][::k_days_adj]
                             elif key == 'cslogy':
-                                features_label_dict[key][str(nd)] = arr_to_cs(log_y_nd(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq])
+                                features_label_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'logy', nd, log_p)[(calc_length+m_days):][:(n_freq + 1)][::n_freq])
                                 # tmp = log_y_nd(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
                                 # order = tmp.argsort(axis=1)
                                 # features_label_dict[key][str(nd)] = order.argsort(axis=1) / np.max(order, axis=1).reshape([-1, 1])
                             elif key == 'csstd':
-                                features_label_dict[key][str(nd)] = arr_to_cs(std_nd_new(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq])
+                                features_label_dict[key][str(nd)] = arr_to_cs(self._rolling_feature(cube_view, 'stdnew', nd, log_p)[(calc_length+m_days):][:(n_freq + 1)][::n_freq])
                                 # tmp = std_nd(log_p, nd)[(calc_length+m_days):][:(n_freq + 1)][::n_freq]
                                 # order = tmp.argsort(axis=1)
                                 # features_label_dict[key][str(nd)] = order.argsort(axis=1) / np.max(order, axis=1).reshape([-1, 1])
@@ -222,7 +271,7 @@ class Feature:
 
                 if main_class == 'logy':
                     # 1 day adj.
-                    features_label_list = log_y_nd(log_p, n_days)[(calc_length+m_days):][:(k_days_adj + 1)][::k_days_adj]
+                    features_label_list = self._rolling_feature(cube_view, 'logy', n_days, log_p)[(calc_length+m_days):][:(k_days_adj + 1)][::k_days_adj]
                 else:
                     print('[Feature class]label_type: {} Not Implemented for {}'.format(label_type, main_class))
                     raise NotImplementedError
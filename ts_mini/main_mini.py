@@ -4,6 +4,7 @@ from ts_mini.config_mini import Config
 from ts_mini.model_mini import TSModel
 from ts_mini.features_mini import Feature
 from ts_mini.data_process_v2_0_mini import DataScheduler
+from tf_additional.checkpoint import checkpoint_exists
 
 import os
 import numpy as np
@@ -41,7 +42,7 @@ def main(k_days, pred, univ_type, balancing_method):
         f.write(config_str)
 
 
-    if os.path.exists(os.path.join(ds.data_out_path, ts_configs.f_name, ts_configs.f_name + '.pkl')):
+    if checkpoint_exists(os.path.join(ds.data_out_path, ts_configs.f_name, ts_configs.f_name)):
         model.load_model(os.path.join(ds.data_out_path, ts_configs.f_name, ts_configs.f_name))
 
     ds.set_idx(6500)
@@ -1,7 +1,6 @@
 
 # from ts_mini.features_mini import labels_for_mtl
 
-import pickle
 import numpy as np
 import tensorflow as tf
 import sys
@@ -9,24 +8,29 @@ import sys
 from tensorflow.keras import Model
 from tensorflow.keras.layers import Dense, Dropout, Embedding
 
+from tf_additional.checkpoint import save_checkpoint, load_checkpoint
+from tf_additional.multitask import compile_step, fused_heads
+from tf_additional.shadow_weights import ShadowWeights
+from tf_additional.positional_encoding import positional_encoding as _positional_encoding
+from tf_additional.quantization import convert_to_tflite, TFLiteFunction, check_tolerance
+
 
 def positional_encoding(dim, sentence_length):
-    encoded_vec = np.array([pos / np.power(10000, 2 * i / dim) for pos in range(sentence_length) for i in range(dim)])
-    encoded_vec[::2] = np.sin(encoded_vec[::2])
-    encoded_vec[1::2] = np.cos(encoded_vec[1::2])
-    return tf.constant(encoded_vec.reshape([sentence_length, dim]), dtype=tf.float32)
+    # table은 tf_additional.positional_encoding 에 캐시되어 있다.
+    return tf.constant(_positional_encoding(dim, sentence_length), dtype=tf.float32)
+
+
+def quantized_path(f_name, mode):
+    return '{}.{}.tflite'.format(f_name, mode)
 
 
 def layer_norm(inputs, eps=1e-6):
     # LayerNorm(x + Sublayer(x))
-    feature_shape = inputs.get_shape()[-1:]
     #  평균과 표준편차을 넘겨 준다.
     mean = tf.math.reduce_mean(inputs, [-1], keepdims=True)
     std = tf.math.reduce_std(inputs, [-1], keepdims=True)
-    beta = tf.Variable(tf.zeros(feature_shape), trainable=False)
-    gamma = tf.Variable(tf.ones(feature_shape), trainable=False)
-
-    return gamma * (inputs - mean) / (std + eps) + beta
+    # gamma=1, beta=0 고정 (학습/저장 대상이 아니므로 매 호출마다 variable을 만들지 않는다.)
+    return (inputs - mean) / (std + eps)
 
 
 def sublayer_connection(inputs, sublayer, dropout=0.2):
@@ -190,9 +194,6 @@ class TSModel:
 
         self.feature_cls = feature_cls
 
-        self.optim_encoder_w = None
-        self.optim_decoder_w = None
-        self.optim_predictor_w = dict()
         self.dropout_train = configs.dropout
 
         self.accuracy = tf.metrics.Accuracy()
@@ -212,18 +213,25 @@ class TSModel:
 
         for key in self.predictor.keys():
             _ = self.predictor[key](dec_temp)
-            self.optim_predictor_w[key] = self.predictor[key].get_weights()
 
-        self.optim_encoder_w = self.encoder.get_weights()
-        self.optim_decoder_w = self.decoder.get_weights()
+        # early stopping 용 best weight (EMA 옵션) 는 shadow variable 에 in-graph assign 으로 저장
+        self.best_weights = ShadowWeights({'encoder': self.encoder.weights,
+                                           'decoder': self.decoder.weights,
+                                           'predictor': {key: self.predictor[key].weights for key in self.predictor.keys()}},
+                                          ema_decay=configs.ema_decay)
+
+        # multi-task train / eval step 은 고정된 predictor 목록으로 graph compile 한다.
+        self.predictor_keys = list(self.predictor.keys())
+        self.mtl_variables = self.encoder.trainable_variables + self.decoder.trainable_variables
+        for key in self.predictor_keys:
+            self.mtl_variables += self.predictor[key].trainable_variables
+        self._train_mtl_step = compile_step(self._train_mtl_step_fn, use_xla=configs.use_xla)
+        self._eval_mtl_step = compile_step(self._eval_mtl_step_fn, use_xla=configs.use_xla)
 
         self._reset_eval_param()
 
     def weight_to_optim(self):
-        self.encoder.set_weights(self.optim_encoder_w)
-        self.decoder.set_weights(self.optim_decoder_w)
-        for key in self.predictor.keys():
-            self.predictor[key].set_weights(self.optim_predictor_w[key])
+        self.best_weights.restore()
 
         self._reset_eval_param()
 
@@ -231,53 +239,57 @@ class TSModel:
         self.eval_loss = 100000
         self.eval_count = 0
 
-    def train_mtl(self, features, labels_mtl, print_loss=False):
-        with tf.GradientTape(persistent=True) as tape:
-            x_embed = features['input'] + self.position_encode_in
-            y_embed = features['output'] + self.position_encode_out
-
-            encoder_output = self.encoder(x_embed, dropout=self.dropout_train)
-            predict = self.decoder(y_embed, encoder_output, dropout=self.dropout_train)
-
-            var_lists = self.encoder.trainable_variables + self.decoder.trainable_variables
-
-            pred_each = dict()
-            loss_each = dict()
-            loss = None
-            for key in self.predictor.keys():
-                pred_each[key] = self.predictor[key](predict)
-                var_lists += self.predictor[key].trainable_variables
-
-                if self.weight_scheme == 'mw':
-                    adj_weight = labels_mtl['size_value'][:, :, 0] * 2.  # size value 평균이 0.5 이므로 기존이랑 스케일 맞추기 위해 2 곱
+    def _mtl_losses(self, features, labels_mtl, dropout, use_importance):
+        x_embed = features['input'] + self.position_encode_in
+        y_embed = features['output'] + self.position_encode_out
 
-                else:
-                    adj_weight = 1.
-                adj_importance = labels_mtl['importance_wgt']
-
-                if key[:3] == 'pos':
-                    loss_each[key] = tf.losses.categorical_crossentropy(labels_mtl[key], pred_each[key]) \
-                                     * tf.abs(labels_mtl['logy'][:, :, self.predictor_helper[key]]) \
-                                     * adj_weight * adj_importance
-
-                else:
-                    loss_each[key] = tf.losses.MSE(labels_mtl[key], pred_each[key]) * adj_weight * adj_importance
-
-                if loss is None:
-                    loss = loss_each[key]
-                else:
-                    loss += loss_each[key]
+        encoder_output = self.encoder(x_embed, dropout=dropout)
+        predict = self.decoder(y_embed, encoder_output, dropout=dropout)
 
-            # if 'cslogy' in labels_mtl.keys():
-            #     cs_loc = np.stack([features['output'][:, :, idx] for idx in labels_mtl['cslogy_idx']], axis=-1)
-            #     loss_each['cs_loc'] = tf.losses.MSE(cs_loc, pred_each['cslogy']) * adj_weight * 0.1
-            #     loss += loss_each['cs_loc']
-
-        grad = tape.gradient(loss, var_lists)
-        self.optimizer.apply_gradients(zip(grad, var_lists))
+        if self.weight_scheme == 'mw':
+            adj_weight = labels_mtl['size_value'][:, :, 0] * 2.  # size value 평균이 0.5 이므로 기존이랑 스케일 맞추기 위해 2 곱
+        else:
+            adj_weight = 1.
+        if use_importance:
+            adj_weight = adj_weight * labels_mtl['importance_wgt']
+
+        # predictor head 들은 한번에 계산
+        pred_each = dict(zip(self.predictor_keys, fused_heads([self.predictor[key] for key in self.predictor_keys], predict)))
+        loss_each = dict()
+        for key in self.predictor_keys:
+            if key[:3] == 'pos':
+                loss_each[key] = tf.losses.categorical_crossentropy(labels_mtl[key], pred_each[key]) \
+                                 * tf.abs(labels_mtl['logy'][:, :, self.predictor_helper[key]]) \
+                                 * adj_weight
+            else:
+                loss_each[key] = tf.losses.MSE(labels_mtl[key], pred_each[key]) * adj_weight
+
+        # if 'cslogy' in labels_mtl.keys():
+        #     cs_loc = np.stack([features['output'][:, :, idx] for idx in labels_mtl['cslogy_idx']], axis=-1)
+        #     loss_each['cs_loc'] = tf.losses.MSE(cs_loc, pred_each['cslogy']) * adj_weight * 0.1
+
+        return loss_each
+
+    def _train_mtl_step_fn(self, features, labels_mtl):
+        with tf.GradientTape() as tape:
+            loss_each = self._mtl_losses(features, labels_mtl, self.dropout_train, use_importance=True)
+            loss = tf.add_n([loss_each[key] for key in self.predictor_keys])
+
+        grad = tape.gradient(loss, self.mtl_variables)
+        self.optimizer.apply_gradients(zip(grad, self.mtl_variables))
+        if self.best_weights.ema is not None:
+            self.best_weights.update_ema()
+
+        return loss_each
+
+    def _eval_mtl_step_fn(self, features, labels_mtl):
+        loss_each = self._mtl_losses(features, labels_mtl, 0., use_importance=False)
+        return tf.reduce_mean(tf.add_n([loss_each[key] for key in self.predictor_keys]))
 
-        del tape
+    def train_mtl(self, features, labels_mtl, print_loss=False):
+        loss_each = self._train_mtl_step(features, labels_mtl)
 
+        # 출력할 때만 loss 값을 가져온다. (device sync)
         if print_loss:
             print_str = ""
             for key in loss_each.keys():
@@ -285,71 +297,29 @@ class TSModel:
 
             print(print_str)
 
-    def evaluate_mtl(self, datasets, features_list, steps=-1):
-        loss_avg = 0
-        for i, (features, labels, size_values, importance_wgt) in enumerate(datasets.take(steps)):
-            labels_mtl = self.feature_cls.labels_for_mtl(features_list, labels, size_values, importance_wgt)
-
-            x_embed = features['input'] + self.position_encode_in
-            y_embed = features['output'] + self.position_encode_out
-
-            encoder_output = self.encoder(x_embed, dropout=0.)
-            predict = self.decoder(y_embed, encoder_output, dropout=0.)
+    def evaluate_mtl(self, datasets, steps=-1):
+        # datasets: (features, labels_mtl) (Feature.label_fn 으로 만든 dataset)
+        # EMA 를 쓰면 EMA weight 로 평가하고, 개선되면 EMA weight 를 best weight 로 저장
+        use_ema = self.best_weights.ema is not None
+        if use_ema:
+            self.best_weights.swap_ema()
 
-            var_lists = self.encoder.trainable_variables + self.decoder.trainable_variables
-            pred_each = dict()
-            loss_each = dict()
-            loss = None
-            for key in self.predictor.keys():
-                pred_each[key] = self.predictor[key](predict)
-                var_lists += self.predictor[key].trainable_variables
+        loss_list = []
+        for i, (features, labels_mtl) in enumerate(datasets.take(steps)):
+            loss_list.append(self._eval_mtl_step(features, labels_mtl))
 
-                if self.weight_scheme == 'mw':
-                    adj_weight = labels_mtl['size_value'][:, :, 0] * 2.
-                else:
-                    adj_weight = 1.
-
-                # adj_importance = labels_mtl['importance_wgt']
-                if key[:3] == 'pos':
-                    loss_each[key] = tf.losses.categorical_crossentropy(labels_mtl[key], pred_each[key]) \
-                                     * tf.abs(labels_mtl['logy'][:, :, self.predictor_helper[key]]) \
-                                     * adj_weight # * adj_importance
-                else:
-                    loss_each[key] = tf.losses.MSE(labels_mtl[key], pred_each[key]) * adj_weight #* adj_importance
-
-                # if key == 'pos':
-                #     loss_each[key] = tf.losses.categorical_crossentropy(labels_mtl[key], pred_each[key]) * tf.abs(labels_mtl['ret'][:, :, 0])
-                # elif key == 'pos20':
-                #     loss_each[key] = tf.losses.categorical_crossentropy(labels_mtl[key], pred_each[key]) * tf.abs(
-                #         labels_mtl['ret'][:, :, 1])
-                # else:
-                #     loss_each[key] = tf.losses.MSE(labels_mtl[key], pred_each[key])
-
-                if loss is None:
-                    loss = loss_each[key]
-                else:
-                    loss += loss_each[key]
-
-            # if 'cslogy_idx' in labels_mtl.keys():
-            #     cs_loc = np.stack([features['output'][:, :, idx] for idx in labels_mtl['cslogy_idx']], axis=-1)
-            #     loss_each['cs_loc'] = tf.losses.MSE(cs_loc, pred_each['cslogy']) * adj_weight * 0.1
-            #     loss += loss_each['cs_loc']
-
-            loss_avg += np.mean(loss.numpy())
-
-        loss_avg = loss_avg / i
+        loss_avg = float(tf.add_n(loss_list).numpy()) / i
         print("eval loss:{} (steps:{})".format(loss_avg, i))
         if loss_avg < self.eval_loss:
             self.eval_loss = loss_avg
             self.eval_count = 0
-            self.optim_encoder_w = self.encoder.get_weights()
-            self.optim_decoder_w = self.decoder.get_weights()
-            for key in self.predictor.keys():
-                self.optim_predictor_w[key] = self.predictor[key].get_weights()
-
+            self.best_weights.save()
         else:
             self.eval_count += 1
 
+        if use_ema:
+            self.best_weights.swap_ema()
+
     def predict_mtl(self, feature):
 
         x_embed = feature['input'] + self.position_encode_in
@@ -365,36 +335,59 @@ class TSModel:
         return pred_each
         # return pred_ret, pred_pos, pred_vol, pred_mdd
 
-    def save_model(self, f_name):
-        if f_name[-4:] != '.pkl':
-            f_name = f_name + ".pkl"
+    def export_quantized(self, f_name, calibration_features, mode='int8', atol=0.05):
+        # predict_mtl 을 CPU 추론용 TFLite 모델로 변환한다.
+        # calibration_features: predict_mtl 에 넣는 {'input', 'output'} 배치 몇개
+        # 변환 후 calibration 배치에서 float32 출력과의 차이가 atol 이하인지 확인한다.
+        in_shape = [None] + self.position_encode_in.shape.as_list()
+        out_shape = [None] + self.position_encode_out.shape.as_list()
+
+        @tf.function(input_signature=[tf.TensorSpec(in_shape, tf.float32, name='input'),
+                                      tf.TensorSpec(out_shape, tf.float32, name='output')])
+        def predict_fn(input, output):
+            return self.predict_mtl({'input': input, 'output': output})
 
-        w_dict = {}
-        w_dict['encoder'] = self.optim_encoder_w
-        w_dict['decoder'] = self.optim_decoder_w
-        w_dict['predictor'] = self.optim_predictor_w
+        trackable = tf.Module()
+        trackable.encoder, trackable.decoder = self.encoder, self.decoder
+        trackable.predictor = self.predictor
 
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'wb') as f:
-            pickle.dump(w_dict, f)
+        samples = [{'input': np.asarray(feature['input'], dtype=np.float32),
+                    'output': np.asarray(feature['output'], dtype=np.float32)} for feature in calibration_features]
+
+        path = quantized_path(f_name, mode)
+        with open(path, 'wb') as f:
+            f.write(convert_to_tflite(trackable, predict_fn.get_concrete_function(), mode, samples))
+
+        def reference_fn(input, output):
+            return {k: v.numpy() for k, v in predict_fn(input, output).items()}
+
+        max_diff = check_tolerance(reference_fn, QuantizedTSModel(f_name, mode).predict_fn, samples, atol)
+        print("quantized model exported. (mode: {}, max diff: {}, path: {})".format(mode, max_diff, path))
+
+        return max_diff
+
+    def save_model(self, f_name):
+        # {'encoder': [...], 'decoder': [...], 'predictor': {key: [...]}}
+        w_dict = self.best_weights.numpy()
+
+        # 저장은 background thread에서 진행된다.
+        save_checkpoint(f_name, w_dict)
 
         print("model saved. (path: {})".format(f_name))
 
     def load_model(self, f_name):
-        if f_name[-4:] != '.pkl':
-            f_name = f_name + ".pkl"
+        w_dict = load_checkpoint(f_name)
 
-        # f_name = os.path.join(model_path, model_name)
-        with open(f_name, 'rb') as f:
-            w_dict = pickle.load(f)
+        # best weight 와 현재 weight 모두 설정
+        self.best_weights.load(w_dict)
 
-        self.optim_encoder_w = w_dict['encoder']
-        self.optim_decoder_w = w_dict['decoder']
-        self.optim_predictor_w = w_dict['predictor']
+        print("model loaded. (path: {})".format(f_name))
 
-        self.encoder.set_weights(self.optim_encoder_w)
-        self.decoder.set_weights(self.optim_decoder_w)
-        for key in self.optim_predictor_w.keys():
-            self.predictor[key].set_weights(self.optim_predictor_w[key])
 
-        print("model loaded. (path: {})".format(f_name))
+class QuantizedTSModel:
+    # export_quantized 로 만든 TFLite 모델. predict_mtl 과 같은 dict를 돌려준다.
+    def __init__(self, f_name, mode='int8', num_threads=None):
+        self.predict_fn = TFLiteFunction(model_path=quantized_path(f_name, mode), num_threads=num_threads)
+
+    def predict_mtl(self, feature):
+        return self.predict_fn(input=feature['input'], output=feature['output'])